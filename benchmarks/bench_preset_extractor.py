@@ -0,0 +1,108 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model_preset_manager.preset_extractor import CIVITAI_MODEL_DESCRIPTION_PRESET_PREFIX, extract_presets_from_chunks, extract_presets_from_description
+
+FIXTURES_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+CIVITAI_MODEL_DESCRIPTION_TAG = 'mantine-TypographyStylesProvider-root mantine-dfvxn9'
+CHUNK_SIZE = 64 * 1024
+
+
+def legacy_extract(model_page_html):
+    # The whole-page character loop the extension used before the streaming extractor
+    data_start_index = model_page_html.find(CIVITAI_MODEL_DESCRIPTION_TAG)
+    if data_start_index == -1:
+        return None
+    model_page_html = model_page_html[data_start_index + len(CIVITAI_MODEL_DESCRIPTION_TAG):]
+    preset_start_index = model_page_html.find(CIVITAI_MODEL_DESCRIPTION_PRESET_PREFIX)
+    if preset_start_index == -1:
+        return None
+    preset_start_index += len(CIVITAI_MODEL_DESCRIPTION_PRESET_PREFIX)
+    opened_braces = 0
+    json_start_index = -1
+    for i in range(preset_start_index, len(model_page_html)):
+        if model_page_html[i] == '{':
+            if opened_braces == 0:
+                json_start_index = i
+            opened_braces += 1
+        elif model_page_html[i] == '}':
+            opened_braces -= 1
+            if opened_braces == 0:
+                try:
+                    return json.loads(model_page_html[json_start_index:i + 1])
+                except json.JSONDecodeError:
+                    pass
+    return None
+
+
+def load_page_fixture(filler_kb):
+    with open(os.path.join(FIXTURES_DIRECTORY, "civitai_model_page.html"), "r", encoding="utf-8") as file:
+        # Real model pages carry a ~1-2 MB __NEXT_DATA__ blob after the description
+        return file.read().replace("%FILLER%", "x" * (filler_kb * 1024)).encode("utf-8")
+
+
+def iter_chunks(data, consumed):
+    for offset in range(0, len(data), CHUNK_SIZE):
+        consumed[0] = offset + CHUNK_SIZE
+        yield data[offset:offset + CHUNK_SIZE]
+
+
+def check_chunk_splits():
+    # Every way of splitting a presets file in two has to give back the same object
+    presets_file = {"url": "https://civitai.com/models/1", "default_preset": "a", "trigger_words": ["caf\u00e9"], "presets": {"a": "Steps: 20"}, "nsfw": False, "shared": True, "notes": None, "escaped": "\"quoted\" \\ \u2603"}
+    texts = [
+        f"intro {{not json}} {CIVITAI_MODEL_DESCRIPTION_PRESET_PREFIX}{json.dumps(presets_file)} outro",
+        # A stray brace after the marker, like inline css, has to be skipped rather than waited on
+        f"{CIVITAI_MODEL_DESCRIPTION_PRESET_PREFIX} <style>.a{{color:red}}</style> {{not: json}} {json.dumps(presets_file)} outro",
+    ]
+    split_count = 0
+    for text in texts:
+        failures = [offset for offset in range(1, len(text)) if extract_presets_from_chunks([text[:offset], text[offset:]]) != presets_file]
+        assert not failures, f"wrong result when split at {failures}"
+        split_count += len(text) - 1
+    return split_count
+
+
+def time_call(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the legacy and streaming Civitai preset extractors")
+    parser.add_argument("--filler-kb", type=int, default=1536)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    page = load_page_fixture(args.filler_kb)
+    consumed = [0]
+    legacy_time, legacy_result = time_call(lambda: legacy_extract(page.decode("utf-8")), args.repeat)
+    streaming_time, streaming_result = time_call(lambda: extract_presets_from_chunks(iter_chunks(page, consumed)), args.repeat)
+    assert legacy_result == streaming_result, "extractors disagree"
+
+    with open(os.path.join(FIXTURES_DIRECTORY, "civitai_model.json"), "r", encoding="utf-8") as file:
+        description = json.load(file)["description"]
+    api_time, api_result = time_call(lambda: extract_presets_from_description(description), args.repeat)
+    assert api_result == streaming_result, "api description disagrees with model page"
+
+    split_count = check_chunk_splits()
+
+    print(f"chunk splits checked: {split_count}")
+    print(f"page size: {len(page) / 1024:.0f} KB")
+    print(f"legacy page scan:    {legacy_time * 1000:8.3f} ms (reads {len(page) / 1024:.0f} KB)")
+    print(f"streaming page scan: {streaming_time * 1000:8.3f} ms (reads {min(consumed[0], len(page)) / 1024:.0f} KB)")
+    print(f"api description:     {api_time * 1000:8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model_preset_manager.trigger_words import TriggerWordMatcher, get_matcher
+
+
+def legacy_checked_boxes(trigger_words, prompt):
+    # What getCheckedBoxesFromPrompt did before the matcher
+    return [choice for choice in trigger_words if choice in prompt]
+
+
+def legacy_remove(prompt, word):
+    return re.sub(f"{word} ?", "", prompt).strip()
+
+
+def build_trigger_words(count, rng):
+    words = []
+    for i in range(count):
+        style = i % 4
+        if style == 0:
+            words.append(f"trigger{i}")
+        elif style == 1:
+            words.append(f"style {i} lighting")
+        elif style == 2:
+            words.append(f"(detail_{i}:1.{i % 10})")
+        else:
+            words.append(f"char.{i}")
+    rng.shuffle(words)
+    return words
+
+
+def build_prompt(trigger_words, length, rng):
+    filler = ["masterpiece", "best quality", "portrait", "soft light", "bokeh", "highly detailed", "8k"]
+    parts = []
+    while sum(len(part) + 2 for part in parts) < length:
+        parts.append(rng.choice(trigger_words) if rng.random() < 0.2 else rng.choice(filler))
+    return ", ".join(parts) + "\nNegative prompt: lowres, bad anatomy\nSteps: 20, Sampler: Euler a, CFG scale: 7, Size: 512x512"
+
+
+def time_per_call(function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the legacy substring scan with the compiled trigger word matcher")
+    parser.add_argument("--words", type=int, default=150)
+    parser.add_argument("--prompt-length", type=int, default=4000)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    trigger_words = build_trigger_words(args.words, rng)
+    prompt = build_prompt(trigger_words, args.prompt_length, rng)
+
+    build_time = time_per_call(lambda: TriggerWordMatcher(trigger_words), 20)
+    matcher = get_matcher(trigger_words)
+    legacy_time = time_per_call(lambda: legacy_checked_boxes(trigger_words, prompt), args.repeat)
+    matcher_time = time_per_call(lambda: get_matcher(trigger_words).find_present(prompt), args.repeat)
+
+    # Legacy substring matching over-reports words that only appear inside other tokens
+    legacy_found = set(legacy_checked_boxes(trigger_words, prompt))
+    matcher_found = set(matcher.find_present(prompt))
+
+    special_word = next(word for word in trigger_words if word.startswith("("))
+    special_prompt = f"{special_word}, portrait"
+
+    print(f"{len(trigger_words)} trigger words, {len(prompt)} character prompt")
+    print(f"matcher build (once per model): {build_time * 1000:8.3f} ms")
+    print(f"legacy scan per keystroke:      {legacy_time * 1000:8.3f} ms ({len(legacy_found)} matches)")
+    print(f"matcher scan per keystroke:     {matcher_time * 1000:8.3f} ms ({len(matcher_found)} matches)")
+    print(f"legacy removal of {special_word!r}: {legacy_remove(special_prompt, special_word)!r}")
+    print(f"matcher removal of {special_word!r}: {matcher.remove(special_prompt, special_word)!r}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import argparse
+import os
+import sys
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+FIXTURES_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+MODEL_VERSION_BY_HASH_PATH = "/api/v1/model-versions/by-hash/"
+MODEL_BY_ID_PATH = "/api/v1/models/"
+MODEL_PAGE_PATH = "/models/"
+PREVIEW_IMAGE_PATH = "/images/preview.jpg"
+# Hashes starting with this aren't on the stub, like checkpoints Civitai doesn't know
+UNKNOWN_HASH_PREFIX = "0"
+DEFAULT_FILLER_KB = 1536
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES_DIRECTORY, name), "r", encoding="utf-8") as file:
+        return file.read()
+
+
+def build_preview_image(size=(832, 1216)):
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    buffer = BytesIO()
+    Image.new("RGB", size, (180, 120, 90)).save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+class StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # The streaming extractor hangs up as soon as it has the presets, that's expected here
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+class CivitaiStubServer:
+    # Serves the saved Civitai fixtures on localhost, so benchmarks never touch the real site
+    def __init__(self, port=0, filler_kb=DEFAULT_FILLER_KB):
+        self.server = StubHTTPServer(("127.0.0.1", port), self.create_handler())
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.responses = {
+            "model_version": read_fixture("civitai_model_version.json").replace("%BASE_URL%", self.base_url).encode("utf-8"),
+            "model": read_fixture("civitai_model.json").encode("utf-8"),
+            "model_page": read_fixture("civitai_model_page.html").replace("%FILLER%", "x" * (filler_kb * 1024)).encode("utf-8"),
+            "preview_image": build_preview_image(),
+        }
+        self.request_count = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def create_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out as separate writes, Nagle would hold the body back for a delayed ACK
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                with stub.lock:
+                    stub.request_count += 1
+                status_code, content_type, body = stub.get_response(self.path)
+                self.send_response(status_code)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def get_response(self, path):
+        if path.startswith(MODEL_VERSION_BY_HASH_PATH):
+            if path[len(MODEL_VERSION_BY_HASH_PATH):].startswith(UNKNOWN_HASH_PREFIX):
+                return 404, "application/json", b'{"error":"Model not found"}'
+            return 200, "application/json", self.responses["model_version"]
+        if path.startswith(MODEL_BY_ID_PATH):
+            return 200, "application/json", self.responses["model"]
+        if path.startswith(MODEL_PAGE_PATH):
+            return 200, "text/html; charset=utf-8", self.responses["model_page"]
+        if path == PREVIEW_IMAGE_PATH and self.responses["preview_image"]:
+            return 200, "image/jpeg", self.responses["preview_image"]
+        return 404, "text/plain", b"not found"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="civitai_stub", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the saved Civitai fixtures on localhost")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--filler-kb", type=int, default=DEFAULT_FILLER_KB)
+    args = parser.parse_args()
+
+    stub = CivitaiStubServer(args.port, args.filler_kb)
+    print(f"serving Civitai fixtures on {stub.base_url}")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        stub.server.server_close()
+
+
+if __name__ == "__main__":
+    main()
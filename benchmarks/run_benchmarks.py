@@ -0,0 +1,315 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from civitai_stub import CivitaiStubServer
+from model_preset_manager import civitai, hash_cache, hashing, library, library_manifest, library_sync, paths, preset_index, storage, thumbnails
+from model_preset_manager.http_cache import ResponseCache
+from model_preset_manager.model_info import empty_model_info
+from model_preset_manager.model_info_store import ModelInfoStore
+from model_preset_manager.session_state import SessionState
+from model_preset_manager.sqlite_storage import SqliteBackend, import_json_directory
+
+SECTIONS = ["hashing", "storage", "civitai", "library", "handlers"]
+REPORT_FORMAT_VERSION = 1
+SPARSE_HEADER_BYTES = 1024 * 1024
+SAMPLERS = ["Euler a", "DPM++ 2M Karras", "DPM++ SDE Karras", "DDIM"]
+SIZES = ["512x512", "512x768", "1024x1024", "832x1216"]
+
+
+class BenchmarkReport:
+    def __init__(self, parameters):
+        self.parameters = parameters
+        self.results = []
+
+    def add(self, section, name, timings, calls=1, **extra):
+        # Timings are per run, calls splits a run into per-call numbers for very fast operations
+        per_call = [timing / calls for timing in timings]
+        result = {
+            "section": section,
+            "name": name,
+            "runs": len(timings),
+            "calls_per_run": calls,
+            "min": min(per_call),
+            "median": statistics.median(per_call),
+            "mean": statistics.mean(per_call),
+            "max": max(per_call),
+        }
+        result.update(extra)
+        self.results.append(result)
+        details = "".join(f", {key} {value:.3f}" if isinstance(value, float) else f", {key} {value}" for key, value in extra.items())
+        print(f"{section:9} {name:48} {format_seconds(result['min']):>10} min {format_seconds(result['median']):>10} median{details}")
+        return result
+
+    def to_dict(self):
+        return {
+            "format_version": REPORT_FORMAT_VERSION,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "parameters": self.parameters,
+            "results": self.results,
+        }
+
+
+def format_seconds(seconds):
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.1f} us"
+    if seconds < 1:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds:.2f} s"
+
+
+def measure(function, repeat, setup=None):
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def create_sparse_checkpoint(path, size):
+    # Only the header is real data, the rest is a hole, so a multi-GB file costs no disk space
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(os.urandom(SPARSE_HEADER_BYTES))
+        file.truncate(size)
+    return path
+
+
+def build_model_info(index, preset_count=3):
+    trigger_words = [f"trigger{index}", f"style {index % 50}"]
+    presets = {}
+    for preset_index_number in range(preset_count):
+        presets[f"preset {preset_index_number}"] = (
+            f"{trigger_words[0]}, portrait of subject {index}, masterpiece, best quality\n"
+            f"Negative prompt: lowres, bad anatomy\n"
+            f"Steps: {20 + (index + preset_index_number) % 3 * 10}, Sampler: {SAMPLERS[(index + preset_index_number) % len(SAMPLERS)]}, "
+            f"CFG scale: {5 + (index % 5)}, Seed: {index * 7 + preset_index_number}, Size: {SIZES[(index // len(SAMPLERS) + preset_index_number) % len(SIZES)]}, Clip skip: 2"
+        )
+    return {"url": f"https://civitai.com/models/{index}", "default_preset": "preset 0", "trigger_words": trigger_words, "presets": presets}
+
+
+def get_model_hash(index):
+    return f"{index:010x}"
+
+
+def create_library(directory, model_count):
+    backend = storage.JsonFileBackend(lambda model_hash: os.path.join(directory, f"{model_hash}.json"))
+    for index in range(model_count):
+        backend.write(get_model_hash(index), build_model_info(index))
+    return backend
+
+
+def benchmark_hashing(report, args, work_directory):
+    size = int(args.checkpoint_gb * 1024 ** 3)
+    checkpoint_path = create_sparse_checkpoint(os.path.join(work_directory, "checkpoints", "sparse.safetensors"), size)
+    for strategy in hashing.STRATEGIES:
+        timings = measure(lambda: hashing.sha256_file(checkpoint_path, strategy=strategy), args.repeat)
+        report.add("hashing", f"sha256_file {strategy} {args.checkpoint_gb:g} GB", timings, gb_per_second=size / min(timings) / 1e9)
+
+    cache = hash_cache.HashCache(os.path.join(work_directory, "bench_hash_cache.json"))
+    report.add("hashing", "hash cache cold (hash and store)", measure(lambda: cache.get_sha256(checkpoint_path), 1))
+    calls = 1000
+    report.add("hashing", "hash cache warm lookup", measure(lambda: [cache.get_sha256(checkpoint_path) for _ in range(calls)], args.repeat), calls)
+    hash_cache.hash_cache = cache
+    report.add("hashing", "get_short_hash_from_filename (cached)", measure(lambda: [library.get_short_hash_from_filename(checkpoint_path) for _ in range(calls)], args.repeat), calls)
+    os.remove(checkpoint_path)
+
+
+def benchmark_storage(report, args, work_directory):
+    library_directory = os.path.join(work_directory, "library")
+    start = time.perf_counter()
+    backend = create_library(library_directory, args.models)
+    report.add("storage", f"json write {args.models} model info files", [time.perf_counter() - start], models_per_second=args.models / (time.perf_counter() - start))
+
+    model_hashes = backend.list_hashes()
+    report.add("storage", f"json list_hashes over {args.models} files", measure(backend.list_hashes, args.repeat))
+
+    cold_stores = []
+    def create_cold_store():
+        cold_stores[:] = [ModelInfoStore(backend, empty_model_info, max_entries=len(model_hashes))]
+    report.add("storage", "model info store cold get", measure(lambda: [cold_stores[0].get(model_hash, False) for model_hash in model_hashes], args.repeat, setup=create_cold_store), len(model_hashes))
+    store = ModelInfoStore(backend, empty_model_info)
+    calls = 1000
+    report.add("storage", "model info store warm get", measure(lambda: [store.get(model_hashes[0]) for _ in range(calls)], args.repeat), calls)
+
+    save_count = min(100, len(model_hashes))
+    def save_model_infos():
+        for model_hash in model_hashes[:save_count]:
+            model_info = store.get(model_hash)
+            model_info["presets"]["benchmark"] = "Steps: 20, Sampler: Euler a, CFG scale: 7"
+            store.put(model_hash, model_info)
+        store.flush()
+    report.add("storage", f"save_model_info x{save_count} with flush", measure(save_model_infos, args.repeat), save_count)
+
+    database_path = os.path.join(work_directory, "library.sqlite3")
+    start = time.perf_counter()
+    sqlite_backend = SqliteBackend(database_path)
+    import_json_directory(sqlite_backend, library_directory)
+    report.add("storage", f"sqlite import {args.models} models", [time.perf_counter() - start])
+    report.add("storage", "sqlite read", measure(lambda: [sqlite_backend.read(model_hash) for model_hash in model_hashes], args.repeat), len(model_hashes))
+
+    index_path = os.path.join(work_directory, "preset_index.json")
+    index = preset_index.PresetIndex(backend, index_path)
+    start = time.perf_counter()
+    index.refresh(force=True)
+    report.add("storage", f"preset index build over {len(model_hashes) * 3} presets", [time.perf_counter() - start])
+    index.save()
+    report.add("storage", "preset index load from disk", measure(lambda: preset_index.PresetIndex(backend, index_path), args.repeat))
+    report.add("storage", "preset index incremental refresh (no changes)", measure(lambda: index.refresh(force=True), args.repeat))
+    for query in ["dpm++ 2m karras 1024x1024", 'sampler:"Euler a" steps:30 size:512x768', "trigger42"]:
+        # An empty result would only time an empty intersection
+        result_count = len(index.search(query, limit=0, refresh=False))
+        assert result_count, f"preset search {query!r} found nothing"
+        report.add("storage", f"preset search {query!r}", measure(lambda: index.search(query, refresh=False), args.repeat * 10), results=result_count)
+
+
+def benchmark_civitai(report, args, work_directory):
+    with CivitaiStubServer(filler_kb=args.page_kb) as stub:
+        uncached_client = civitai.CivitaiClient(base_url=stub.base_url, requests_per_second=0, use_cache=False)
+        model_url, _, _ = uncached_client.get_model_url_trigger_words_and_first_image_url_from_hash("abc1234567")
+        report.add("civitai", "model version by hash (uncached)", measure(lambda: uncached_client.get_model_url_trigger_words_and_first_image_url_from_hash("abc1234567"), args.repeat * 5))
+        report.add("civitai", "get_model_presets_from_civitai_model_url (uncached)", measure(lambda: uncached_client.get_model_presets_from_civitai_model_url(model_url), args.repeat * 5))
+        stub.responses["model"] = b"{}"
+        report.add("civitai", f"presets from {args.page_kb} KB model page (uncached)", measure(lambda: uncached_client.get_model_presets_from_civitai_model_url(model_url), args.repeat * 5))
+
+        cached_client = civitai.CivitaiClient(base_url=stub.base_url, requests_per_second=0, response_cache=ResponseCache(os.path.join(work_directory, "http")))
+        cached_client.get_model_presets_from_civitai_model_url(model_url)
+        report.add("civitai", "get_model_presets_from_civitai_model_url (cached)", measure(lambda: cached_client.get_model_presets_from_civitai_model_url(model_url), args.repeat * 5))
+
+        checkpoint_directory = os.path.join(work_directory, "sync_checkpoints")
+        checkpoints = [library_sync.Checkpoint(f"model{index}.safetensors", os.path.join(checkpoint_directory, f"model{index}.safetensors"), f"a{index:09x}") for index in range(args.sync_models)]
+        def reset_sync():
+            shutil.rmtree(checkpoint_directory, ignore_errors=True)
+            os.makedirs(checkpoint_directory)
+        def run_sync():
+            store = ModelInfoStore(storage.JsonFileBackend(lambda model_hash: os.path.join(checkpoint_directory, "presets", f"{model_hash}.json")), empty_model_info)
+            library_sync.LibrarySyncJob(checkpoints, store, uncached_client, max_workers=args.sync_workers).run()
+        request_count = stub.request_count
+        timings = measure(run_sync, args.repeat, setup=reset_sync)
+        report.add("civitai", f"library sync {args.sync_models} models with thumbnails", timings, models_per_second=args.sync_models / min(timings), requests_per_run=(stub.request_count - request_count) // args.repeat)
+
+
+def benchmark_library(report, args, work_directory):
+    # Small stand-in checkpoints in nested folders, every tenth one with a preview next to it
+    checkpoint_directory = os.path.join(work_directory, "library_checkpoints")
+    checkpoint_paths = []
+    for index in range(args.models):
+        path = os.path.join(checkpoint_directory, f"folder{index % 20}", f"model{index}.safetensors")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as file:
+            file.write(index.to_bytes(4, "little"))
+        if index % 10 == 0:
+            open(thumbnails.get_thumbnail_path_for_checkpoint(path), "wb").close()
+        checkpoint_paths.append(path)
+
+    report.add("library", f"list_checkpoints walk {args.models} checkpoints", measure(lambda: library_sync.list_checkpoints([checkpoint_directory]), args.repeat))
+    database_path = os.path.join(work_directory, "library_manifest.sqlite3")
+    def remove_manifest():
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(database_path + suffix):
+                os.remove(database_path + suffix)
+    report.add("library", f"manifest cold scan {args.models} checkpoints", measure(lambda: library_manifest.LibraryManifest(database_path, [checkpoint_directory]).scan(), args.repeat, setup=remove_manifest))
+    report.add("library", f"manifest startup scan {args.models} unchanged", measure(lambda: library_manifest.LibraryManifest(database_path, [checkpoint_directory]).scan(), args.repeat))
+
+    manifest = library_manifest.LibraryManifest(database_path, [checkpoint_directory])
+    changed_paths = checkpoint_paths[::100]
+    def touch_checkpoints():
+        for path in changed_paths:
+            os.utime(path)
+    report.add("library", f"manifest rescan {len(changed_paths)} changed", measure(manifest.scan, args.repeat, setup=touch_checkpoints))
+    report.add("library", f"manifest update {len(changed_paths)} watched changes", measure(lambda: manifest.update_checkpoints(changed_paths), args.repeat, setup=touch_checkpoints))
+    manifest.close()
+
+
+def benchmark_handlers(report, args, work_directory):
+    # The package functions the tab's save_preset, update_current_preset and retrieve_model_info_from_disk handlers call, without Gradio
+    backend = create_library(os.path.join(work_directory, "handlers"), args.models)
+    store = ModelInfoStore(backend, empty_model_info)
+    model_hash = get_model_hash(args.models // 2)
+    model_filename = f"model.safetensors [{model_hash}]"
+    thumbnail_path = os.path.join(work_directory, "handlers", "model.png")
+    calls = 200
+    generation_data = build_model_info(1)["presets"]["preset 0"]
+
+    def save_preset():
+        for call in range(calls):
+            library.save_preset(store, model_hash, f"saved {call % 10}", generation_data)
+    report.add("handlers", "save_preset", measure(save_preset, args.repeat), calls)
+
+    def update_current_preset():
+        for _ in range(calls):
+            library.get_preset(store, model_filename, "preset 1")
+    report.add("handlers", "update_current_preset", measure(update_current_preset, args.repeat), calls)
+
+    def retrieve_model_info_from_disk():
+        # What the tab runs around library.load_model_info: the thumbnail lookup and the session's trigger word matcher
+        for _ in range(calls):
+            short_hash, model_info, _, current_generation_data = library.load_model_info(store, model_filename)
+            thumbnails.get_display_thumbnail_path(thumbnail_path)
+            session_state = SessionState().set_model(model_filename, short_hash, model_info["trigger_words"])
+            session_state.matcher.find_present(current_generation_data)
+    report.add("handlers", "retrieve_model_info_from_disk", measure(retrieve_model_info_from_disk, args.repeat), calls)
+    store.flush()
+
+
+def compare_reports(report, previous_report_path):
+    with open(previous_report_path, "r") as file:
+        previous = {(result["section"], result["name"]): result for result in json.load(file)["results"]}
+    print(f"\ncompared with {previous_report_path} (min time, lower is better):")
+    for result in report.results:
+        old = previous.get((result["section"], result["name"]))
+        if old and old["min"]:
+            print(f"{result['section']:9} {result['name']:48} {result['min'] / old['min']:6.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark hashing, storage, Civitai parsing, library scans and tab handlers, and write a JSON report")
+    parser.add_argument("--sections", nargs="+", choices=SECTIONS, default=SECTIONS)
+    parser.add_argument("--checkpoint-gb", type=float, default=2.0, help="size of the sparse checkpoint file that gets hashed")
+    parser.add_argument("--models", type=int, default=1000, help="model info files in the synthetic library (try 10000)")
+    parser.add_argument("--sync-models", type=int, default=50)
+    parser.add_argument("--sync-workers", type=int, default=library_sync.DEFAULT_MAX_WORKERS)
+    parser.add_argument("--page-kb", type=int, default=1536, help="size of the served Civitai model page")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--report", help="write the JSON report to this file")
+    parser.add_argument("--compare", help="a previous JSON report to compare against")
+    parser.add_argument("--work-dir", help="where the synthetic files go, a temporary directory by default")
+    args = parser.parse_args()
+
+    work_directory = args.work_dir or tempfile.mkdtemp(prefix="model_preset_manager_bench_")
+    # Caches and thumbnails written during the run stay in the work directory
+    paths.CACHE_DIRECTORY = os.path.join(work_directory, "cache")
+    hash_cache.hash_cache = hash_cache.HashCache(os.path.join(work_directory, "hash_cache.json"))
+
+    report = BenchmarkReport({key: value for key, value in vars(args).items() if key not in ("report", "compare", "work_dir")})
+    benchmarks = {"hashing": benchmark_hashing, "storage": benchmark_storage, "civitai": benchmark_civitai, "library": benchmark_library, "handlers": benchmark_handlers}
+    try:
+        for section in args.sections:
+            benchmarks[section](report, args, work_directory)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_directory, ignore_errors=True)
+
+    if args.report:
+        with open(args.report, "w") as file:
+            json.dump(report.to_dict(), file, indent=4)
+        print(f"report written to {args.report}")
+    if args.compare:
+        compare_reports(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
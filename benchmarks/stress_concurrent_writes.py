@@ -0,0 +1,111 @@
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model_preset_manager.model_info import empty_model_info
+from model_preset_manager.model_info_store import ModelInfoStore
+from model_preset_manager.storage import JsonFileBackend, get_backup_path, read_json_file
+
+SHARED_MODEL_HASH = "sharedhash"
+
+
+def create_store(directory):
+    return ModelInfoStore(JsonFileBackend(lambda model_hash: os.path.join(directory, f"{model_hash}.json")), empty_model_info, revalidate_interval=0)
+
+
+def writer(directory, index, edits, results):
+    # Every edit is flushed right away, the worst case for two tabs or a sync racing a click
+    store = create_store(directory)
+    for edit in range(edits):
+        with store.edit(SHARED_MODEL_HASH) as model_info:
+            model_info["presets"][f"writer{index}_preset{edit}"] = f"Steps: {edit}, Seed: {index}"
+        store.flush()
+    results.put((index, store.get_stats()["conflicts"]))
+
+
+def crashing_writer(directory, index):
+    store = create_store(directory)
+    edit = 0
+    while True:
+        with store.edit(SHARED_MODEL_HASH) as model_info:
+            model_info["presets"][f"crasher{index}_preset{edit}"] = "x" * random.randint(10, 5000)
+        store.flush()
+        edit += 1
+
+
+def run_writers(directory, writer_count, edits):
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=writer, args=(directory, index, edits, results)) for index in range(writer_count)]
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    conflicts = sum(results.get()[1] for _ in processes)
+    for process in processes:
+        process.join()
+    return time.perf_counter() - start, conflicts
+
+
+def run_crashes(directory, rounds, crasher_count):
+    # Writers are killed at random points, the file on disk has to stay readable without any recovery
+    unreadable = 0
+    for _ in range(rounds):
+        processes = [multiprocessing.Process(target=crashing_writer, args=(directory, index)) for index in range(crasher_count)]
+        for process in processes:
+            process.start()
+        time.sleep(random.uniform(0.05, 0.3))
+        for process in processes:
+            process.kill()
+        for process in processes:
+            process.join()
+        try:
+            read_json_file(os.path.join(directory, f"{SHARED_MODEL_HASH}.json"))
+        except ValueError:
+            unreadable += 1
+    return unreadable
+
+
+def check_recovery(directory):
+    # A file damaged outside of the extension is restored from its backup on the next read
+    path = os.path.join(directory, f"{SHARED_MODEL_HASH}.json")
+    backup, _ = read_json_file(get_backup_path(path))
+    with open(path, "r+") as file:
+        file.truncate(os.path.getsize(path) // 2)
+    recovered = create_store(directory).get(SHARED_MODEL_HASH, create_if_missing=False)
+    return recovered == backup
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Save presets to one model info file from many processes at once, then kill writers mid-write")
+    parser.add_argument("--writers", type=int, default=16)
+    parser.add_argument("--edits", type=int, default=50)
+    parser.add_argument("--crash-rounds", type=int, default=20)
+    parser.add_argument("--crashers", type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        create_store(directory).get(SHARED_MODEL_HASH)
+        elapsed, conflicts = run_writers(directory, args.writers, args.edits)
+        presets = create_store(directory).get(SHARED_MODEL_HASH, create_if_missing=False)["presets"]
+        saved_presets = sum(1 for name in presets if name.startswith("writer"))
+        expected_presets = args.writers * args.edits
+        print(f"{args.writers} writer processes: {expected_presets / elapsed:8.0f} saves/s, {conflicts} version conflicts rebased, {saved_presets}/{expected_presets} presets saved")
+
+        unreadable = run_crashes(directory, args.crash_rounds, args.crashers)
+        leftover = [filename for filename in os.listdir(directory) if filename.endswith(".tmp")]
+        print(f"{args.crash_rounds} rounds of killed writers: {unreadable} unreadable files, {len(leftover)} leftover temporary files")
+
+        recovered = check_recovery(directory)
+        print(f"damaged file restored from backup: {recovered}")
+
+    if saved_presets != expected_presets or unreadable or not recovered:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
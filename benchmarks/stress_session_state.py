@@ -0,0 +1,89 @@
+import argparse
+import copy
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model_preset_manager.model_info import empty_model_info
+from model_preset_manager.model_info_store import ModelInfoStore
+from model_preset_manager.session_state import SessionState
+from model_preset_manager.storage import JsonFileBackend
+
+
+def run_sessions(session_count, iterations, errors):
+    barrier = threading.Barrier(session_count)
+
+    def session(index):
+        # Each session has its own model, so each one must only ever see its own trigger words
+        state = SessionState()
+        own_word = f"session{index}_trigger"
+        barrier.wait()
+        for iteration in range(iterations):
+            state = copy.deepcopy(state.set_model(f"model{index}.safetensors", f"hash{index:06d}", [own_word, f"shared_{iteration % 3}"]))
+            prompt = f"{own_word}, shared_0, shared_1, session{(index + 1) % session_count}_trigger"
+            present = state.matcher.find_present(prompt)
+            if own_word not in present or any(word.startswith("session") and word != own_word for word in present):
+                errors.append(f"session {index} saw {present}")
+                return
+
+    threads = [threading.Thread(target=session, args=(index,)) for index in range(session_count)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def run_edits(store, writer_count, edits, model_hash):
+    barrier = threading.Barrier(writer_count)
+
+    def writer(index):
+        barrier.wait()
+        for edit in range(edits):
+            with store.edit(model_hash) as model_info:
+                model_info["presets"][f"writer{index}_preset{edit}"] = f"Steps: {edit}"
+
+    threads = [threading.Thread(target=writer, args=(index,)) for index in range(writer_count)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hammer per-session state and concurrent preset edits from many threads")
+    parser.add_argument("--sessions", type=int, default=32)
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--writers", type=int, default=16)
+    parser.add_argument("--edits", type=int, default=100)
+    args = parser.parse_args()
+
+    errors = []
+    session_time = run_sessions(args.sessions, args.iterations, errors)
+    session_ops = args.sessions * args.iterations
+    print(f"{args.sessions} sessions: {session_ops / session_time:10.0f} model switches + prompt scans/s, {len(errors)} cross-session leaks")
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = ModelInfoStore(JsonFileBackend(lambda model_hash: os.path.join(directory, f"{model_hash}.json")), empty_model_info)
+        edit_time = run_edits(store, args.writers, args.edits, "stresshash")
+        store.flush()
+        reloaded = ModelInfoStore(JsonFileBackend(lambda model_hash: os.path.join(directory, f"{model_hash}.json")), empty_model_info)
+        saved_presets = sum(1 for name in reloaded.get("stresshash", create_if_missing=False)["presets"] if name.startswith("writer"))
+    expected_presets = args.writers * args.edits
+    print(f"{args.writers} writers: {expected_presets / edit_time:10.0f} preset edits/s, {saved_presets}/{expected_presets} presets saved")
+
+    if errors or saved_presets != expected_presets:
+        for error in errors[:10]:
+            print(error)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+import argparse
+import json
+import sys
+
+from model_preset_manager import bundles, metrics, storage
+
+# Subcommands import the heavier modules (requests, PIL, sqlite) only when they run, so --help and light commands stay fast
+
+
+def get_store(args):
+    from model_preset_manager import library
+    return library.create_model_info_store(args.backend)
+
+
+def hash_command(args):
+    from model_preset_manager import hash_cache
+
+    for path in args.files:
+        sha256 = hash_cache.get_sha256(path)
+        print(f"{sha256[:10]}  {sha256}  {path}")
+    return 0
+
+
+def sync_command(args):
+    from model_preset_manager import civitai, library_manifest, library_sync
+
+    store = get_store(args)
+    manifest = library_manifest.LibraryManifest(directories=args.models_dir, get_model_hashes=store.list_hashes)
+    manifest.scan()
+    checkpoints = manifest.list_checkpoints()
+    client = civitai.CivitaiClient(requests_per_second=args.requests_per_second or civitai.DEFAULT_REQUESTS_PER_SECOND)
+    job = library_sync.LibrarySyncJob(checkpoints, store, client, args.workers or library_sync.DEFAULT_MAX_WORKERS, not args.no_thumbnails)
+    job.run(lambda job: print(f"\r{job.done_count}/{len(job.checkpoints)} models synced", end="", file=sys.stderr, flush=True))
+    print(file=sys.stderr)
+    print(job.get_status_text())
+    return 1 if job.errors else 0
+
+
+def library_command(args):
+    from model_preset_manager import library_manifest
+
+    manifest = library_manifest.LibraryManifest(directories=args.models_dir, get_model_hashes=get_store(args).list_hashes)
+    manifest.scan()
+    if args.json:
+        print(json.dumps([entry.to_dict() for entry in manifest.get_entries()], indent=4))
+    else:
+        for entry in manifest.get_entries():
+            print(f"{entry.short_hash or '?' * 10}  {'info' if entry.has_model_info else '    '}  {entry.thumbnail:<8}  {entry.size / 1024 ** 3:6.2f} GB  {entry.name}")
+    print(manifest.get_summary_text(), file=sys.stderr)
+    return 0
+
+
+def list_command(args):
+    store = get_store(args)
+    for model_hash in store.list_hashes():
+        model_info = store.get(model_hash, create_if_missing=False)
+        presets = model_info.get("presets", {})
+        print(f"{model_hash}  {len(presets)} presets  {model_info.get('url', '')}")
+        if args.presets:
+            for preset_name in presets:
+                print(f"    {preset_name}{' (default)' if preset_name == model_info.get('default_preset') else ''}")
+    return 0
+
+
+def export_command(args):
+    store = get_store(args)
+    print(f"exported {bundles.export_bundle(store.backend, args.path, args.models or None)} models to {args.path}")
+    return 0
+
+
+def import_command(args):
+    counts, errors = bundles.import_bundle(get_store(args), args.path, args.policy)
+    print(bundles.format_import_report(counts, errors))
+    return 1 if errors else 0
+
+
+def search_command(args):
+    from model_preset_manager import preset_index
+
+    index = preset_index.PresetIndex(get_store(args).backend)
+    for result in index.search(args.query, limit=args.limit):
+        print(f"{result['model_hash']}  {result['preset_name']}  {result['sampler']}  {result['steps']} steps  cfg {result['cfg_scale']}  {result['size']}  {result['prompt']}")
+    index.save()
+    return 0
+
+
+def watch_command(args):
+    from model_preset_manager import hashing, library_manifest, paths, preset_index, watcher
+
+    store = get_store(args)
+    index = preset_index.PresetIndex(store.backend)
+    checkpoint_directories = args.models_dir or hashing.get_model_directories()
+    manifest = library_manifest.LibraryManifest(directories=checkpoint_directories, get_model_hashes=store.list_hashes)
+    manifest.scan()
+    handler = watcher.LibraryChangeHandler(store, paths.MODEL_PRESETS_DIRECTORY, checkpoint_directories, lambda: index, manifest)
+
+    def report(changes):
+        print(handler(changes), flush=True)
+        index.save()
+
+    directory_watcher = watcher.DirectoryWatcher(watcher.get_watched_directories(paths.MODEL_PRESETS_DIRECTORY, checkpoint_directories), report, use_inotify=not args.poll).start()
+    print(f"watching {len(directory_watcher.directories)} folders with {directory_watcher.backend}, press Ctrl+C to stop", file=sys.stderr)
+    try:
+        directory_watcher.thread.join()
+    except KeyboardInterrupt:
+        directory_watcher.stop()
+    return 0
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="python -m model_preset_manager", description="Manage model presets without the webui")
+    parser.add_argument("--backend", default="json", choices=storage.STORAGE_BACKENDS, help="where model info is stored")
+    parser.add_argument("--metrics", choices=["text", "json", "prometheus"], help="print timings of hashing, file, network and image calls to stderr when done")
+    parser.add_argument("--profile", action="store_true", help="run the command under cProfile and print where its time went to stderr")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    hash_parser = subparsers.add_parser("hash", help="print the sha256 of checkpoint files, using the hash cache")
+    hash_parser.add_argument("files", nargs="+")
+    hash_parser.set_defaults(function=hash_command)
+
+    sync_parser = subparsers.add_parser("sync", help="download model info, presets and thumbnails from Civitai for every checkpoint")
+    sync_parser.add_argument("--models-dir", action="append", help="checkpoint directory, can be repeated (defaults to models/Stable-diffusion)")
+    sync_parser.add_argument("--workers", type=int)
+    sync_parser.add_argument("--requests-per-second", type=float)
+    sync_parser.add_argument("--no-thumbnails", action="store_true")
+    sync_parser.set_defaults(function=sync_command)
+
+    library_parser = subparsers.add_parser("library", help="list every checkpoint with its hash, model info and thumbnail, rescanning only what changed")
+    library_parser.add_argument("--models-dir", action="append", help="checkpoint directory, can be repeated (defaults to models/Stable-diffusion)")
+    library_parser.add_argument("--json", action="store_true")
+    library_parser.set_defaults(function=library_command)
+
+    list_parser = subparsers.add_parser("list", help="list every model with stored model info")
+    list_parser.add_argument("--presets", action="store_true", help="also list each model's presets")
+    list_parser.set_defaults(function=list_command)
+
+    export_parser = subparsers.add_parser("export", help="export model info to a .jsonl, .jsonl.gz or .jsonl.zst bundle")
+    export_parser.add_argument("path")
+    export_parser.add_argument("models", nargs="*", help="model hashes to export, the whole library when left out")
+    export_parser.set_defaults(function=export_command)
+
+    import_parser = subparsers.add_parser("import", help="import a preset bundle")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--policy", default=bundles.DEFAULT_CONFLICT_POLICY, choices=bundles.CONFLICT_POLICIES, help="what to do with imported presets whose name is already used")
+    import_parser.set_defaults(function=import_command)
+
+    search_parser = subparsers.add_parser("search", help="search every model's presets")
+    search_parser.add_argument("query")
+    search_parser.add_argument("--limit", type=int, default=100)
+    search_parser.set_defaults(function=search_command)
+
+    watch_parser = subparsers.add_parser("watch", help="keep the preset search index and hash cache up to date while files change")
+    watch_parser.add_argument("--models-dir", action="append", help="checkpoint directory, can be repeated (defaults to models/Stable-diffusion)")
+    watch_parser.add_argument("--poll", action="store_true", help="poll for changes instead of using inotify")
+    watch_parser.set_defaults(function=watch_command)
+
+    args = parser.parse_args(argv)
+    if args.profile:
+        metrics.metrics.request_profile()
+    try:
+        with metrics.span("command", command=args.command), metrics.metrics.profile(args.command):
+            return args.function(args)
+    except (OSError, ValueError, RuntimeError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        print_metrics(args)
+
+
+def print_metrics(args):
+    last_profile = metrics.metrics.get_last_profile()
+    if args.profile and last_profile:
+        profile_path, profile_text = last_profile
+        print(f"profile saved to {profile_path}\n{profile_text}", file=sys.stderr)
+    if args.metrics == "json":
+        print(json.dumps(metrics.metrics.to_dict(), indent=4), file=sys.stderr)
+    elif args.metrics == "prometheus":
+        print(metrics.metrics.to_prometheus(), end="", file=sys.stderr)
+    elif args.metrics:
+        print(metrics.metrics.get_summary_text(), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,255 @@
+import argparse
+import json
+import sys
+import threading
+import time
+
+from collections import OrderedDict
+
+from model_preset_manager.generation_parameters import parse_generation_parameters
+
+STUB_SECONDS_PER_STEP = 0.001
+BATCH_STATE_JOB = "model_preset_manager_batch"
+
+
+class BatchJob:
+    __slots__ = ("checkpoint", "model_hash", "preset_name", "generation_data", "status", "error", "seconds", "result")
+
+    def __init__(self, checkpoint, model_hash, preset_name, generation_data):
+        self.checkpoint = checkpoint
+        self.model_hash = model_hash
+        self.preset_name = preset_name
+        self.generation_data = generation_data or ""
+        self.status = "queued"
+        self.error = None
+        self.seconds = None
+        self.result = None
+
+    @property
+    def parameters(self):
+        return parse_generation_parameters(self.generation_data)
+
+    def to_dict(self):
+        return {
+            "checkpoint": self.checkpoint,
+            "model_hash": self.model_hash,
+            "preset_name": self.preset_name,
+            "status": self.status,
+            "error": self.error,
+            "seconds": self.seconds,
+            "result": self.result,
+        }
+
+
+def build_jobs(model_info_store, selections):
+    # Each selection is (checkpoint, model hash, preset names), no preset names means every preset of that model
+    jobs = []
+    for checkpoint, model_hash, preset_names in selections:
+        presets = model_info_store.get(model_hash, create_if_missing=False).get("presets", {})
+        for preset_name in (preset_names or list(presets)):
+            if preset_name in presets:
+                jobs.append(BatchJob(checkpoint, model_hash, preset_name, presets[preset_name]))
+    return jobs
+
+
+def group_jobs_by_checkpoint(jobs, current_checkpoint=None):
+    # The loaded checkpoint goes first so the batch doesn't start with a swap
+    groups = OrderedDict()
+    if current_checkpoint is not None and any(job.checkpoint == current_checkpoint for job in jobs):
+        groups[current_checkpoint] = []
+    for job in jobs:
+        groups.setdefault(job.checkpoint, []).append(job)
+    return groups
+
+
+def stub_load_checkpoint(checkpoint):
+    return checkpoint
+
+
+def stub_process(job):
+    # Stands in for the webui pipeline, sleeping in proportion to the preset's step count
+    parameters = job.parameters
+    time.sleep((parameters.steps or 20) * STUB_SECONDS_PER_STEP)
+    return {"images": 1, "width": parameters.width, "height": parameters.height, "sampler": parameters.sampler}
+
+
+class BatchRunner:
+    def __init__(self, jobs, process=stub_process, load_checkpoint=stub_load_checkpoint, current_checkpoint=None, restore_checkpoint=False):
+        self.process = process
+        self.load_checkpoint = load_checkpoint
+        self.current_checkpoint = current_checkpoint
+        self.restore_checkpoint = restore_checkpoint
+        self.groups = group_jobs_by_checkpoint(jobs, current_checkpoint)
+        self.jobs = [job for group in self.groups.values() for job in group]
+        self.load_seconds = OrderedDict()
+        self.started_at = None
+        self.finished_at = None
+        self.cancelled = threading.Event()
+        self.thread = None
+
+    def run_group(self, checkpoint, jobs, progress_callback=None):
+        if checkpoint != self.current_checkpoint:
+            start = time.perf_counter()
+            self.load_checkpoint(checkpoint)
+            self.load_seconds[checkpoint] = time.perf_counter() - start
+            self.current_checkpoint = checkpoint
+
+        for job in jobs:
+            if self.cancelled.is_set():
+                job.status = "cancelled"
+                continue
+            job.status = "running"
+            start = time.perf_counter()
+            try:
+                job.result = self.process(job)
+                job.status = "done"
+            except Exception as e:
+                job.error = str(e)
+                job.status = "error"
+            job.seconds = time.perf_counter() - start
+            if progress_callback:
+                progress_callback(self)
+
+    def run(self, progress_callback=None):
+        self.started_at = time.monotonic()
+        original_checkpoint = self.current_checkpoint
+        try:
+            for checkpoint, jobs in self.groups.items():
+                if self.cancelled.is_set():
+                    for job in jobs:
+                        job.status = "cancelled"
+                    continue
+                try:
+                    self.run_group(checkpoint, jobs, progress_callback)
+                except Exception as e:
+                    # A checkpoint that fails to load only fails its own presets
+                    for job in jobs:
+                        if job.status == "queued":
+                            job.status = "error"
+                            job.error = f"could not load checkpoint: {e}"
+            if self.restore_checkpoint and original_checkpoint is not None and self.current_checkpoint != original_checkpoint:
+                self.load_checkpoint(original_checkpoint)
+                self.current_checkpoint = original_checkpoint
+        finally:
+            self.finished_at = time.monotonic()
+        return self.jobs
+
+    def start(self, progress_callback=None):
+        self.thread = threading.Thread(target=self.run, args=(progress_callback,), name="model_preset_manager_batch", daemon=True)
+        self.thread.start()
+        return self
+
+    def cancel(self):
+        self.cancelled.set()
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def get_report(self):
+        return {
+            "seconds": ((self.finished_at or time.monotonic()) - self.started_at) if self.started_at else 0.0,
+            "checkpoint_load_seconds": dict(self.load_seconds),
+            "jobs": [job.to_dict() for job in self.jobs],
+        }
+
+    def get_status_text(self):
+        done_count = sum(1 for job in self.jobs if job.status in ("done", "error", "cancelled"))
+        error_count = sum(1 for job in self.jobs if job.status == "error")
+        elapsed = ((self.finished_at or time.monotonic()) - self.started_at) if self.started_at else 0.0
+        lines = [f"{done_count}/{len(self.jobs)} presets rendered across {len(self.groups)} checkpoints in {elapsed:.1f}s, {error_count} errors"]
+        lines += [f"loaded {checkpoint} in {seconds:.1f}s" for checkpoint, seconds in self.load_seconds.items()]
+        for job in self.jobs:
+            if job.status == "error":
+                lines.append(f"{job.checkpoint} / {job.preset_name}: error: {job.error}")
+            elif job.seconds is not None:
+                lines.append(f"{job.checkpoint} / {job.preset_name}: {job.status} in {job.seconds:.2f}s")
+        return "\n".join(lines)
+
+
+def webui_load_checkpoint(checkpoint):
+    from modules import sd_models
+    from modules.call_queue import queue_lock
+
+    checkpoint_info = sd_models.get_closet_checkpoint_match(checkpoint)
+    if checkpoint_info is None:
+        raise ValueError(f"checkpoint {checkpoint} not found")
+    with queue_lock:
+        sd_models.reload_model_weights(info=checkpoint_info)
+
+
+def webui_process(job):
+    from modules import processing, shared
+    from modules.call_queue import queue_lock
+
+    parameters = job.parameters
+    override_settings = {"CLIP_stop_at_last_layers": parameters.clip_skip} if parameters.clip_skip else {}
+    arguments = {
+        "prompt": parameters.prompt,
+        "negative_prompt": parameters.negative_prompt or "",
+        "steps": parameters.steps,
+        "sampler_name": parameters.sampler,
+        "cfg_scale": parameters.cfg_scale,
+        "seed": parameters.seed,
+        "width": parameters.width,
+        "height": parameters.height,
+    }
+    # Settings the preset leaves out keep the webui's own defaults
+    arguments = {key: value for key, value in arguments.items() if value is not None}
+    # Batch jobs share the webui's generation queue, so they never run alongside a Generate click
+    with queue_lock:
+        p = processing.StableDiffusionProcessingTxt2Img(
+            sd_model=shared.sd_model,
+            outpath_samples=shared.opts.outdir_samples or shared.opts.outdir_txt2img_samples,
+            outpath_grids=shared.opts.outdir_grids or shared.opts.outdir_txt2img_grids,
+            override_settings=override_settings,
+            **arguments,
+        )
+        # Like a Generate click, the job owns shared.state while it runs, so an interrupt ends here and is cleared afterwards
+        try:
+            shared.state.begin(job=BATCH_STATE_JOB)
+        except TypeError:
+            # webui before 1.6 doesn't name jobs
+            shared.state.begin()
+            shared.state.job = BATCH_STATE_JOB
+        try:
+            processed = processing.process_images(p)
+        finally:
+            p.close()
+            shared.state.end()
+    return {"images": len(processed.images), "seed": processed.seed}
+
+
+def webui_interrupt():
+    from modules import shared
+
+    # Only a generation started by the batch is interrupted, never one from the txt2img tab
+    if shared.state.job == BATCH_STATE_JOB:
+        shared.state.interrupt()
+
+
+def main(argv):
+    from model_preset_manager import storage
+    from model_preset_manager.model_info import empty_model_info
+    from model_preset_manager.model_info_store import ModelInfoStore
+
+    parser = argparse.ArgumentParser(prog="python -m model_preset_manager.batch_runner", description="Run every preset of the given models through the stub pipeline and report timings")
+    parser.add_argument("models", nargs="*", help="model hashes, every stored model when left out")
+    parser.add_argument("--preset", action="append", help="only run presets with this name, can be repeated")
+    parser.add_argument("--backend", default="json", choices=storage.STORAGE_BACKENDS)
+    parser.add_argument("--report", help="write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    store = ModelInfoStore(storage.create_backend(args.backend), empty_model_info)
+    model_hashes = args.models or store.list_hashes()
+    runner = BatchRunner(build_jobs(store, [(model_hash, model_hash, args.preset) for model_hash in model_hashes]))
+    runner.run()
+    print(runner.get_status_text())
+    if args.report:
+        with open(args.report, "w") as file:
+            json.dump(runner.get_report(), file, indent=4)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,168 @@
+import argparse
+import gzip
+import io
+import json
+import sys
+import time
+
+from model_preset_manager.generation_parameters import strip_preset_parameters, update_preset_parameters
+from model_preset_manager.model_info import strip_remote_base, update_default_preset, validate_model_info
+
+BUNDLE_FORMAT = "model_preset_manager_bundle"
+BUNDLE_FORMAT_VERSION = 1
+CONFLICT_POLICIES = ["keep", "overwrite", "rename"]
+DEFAULT_CONFLICT_POLICY = "keep"
+ZSTD_LEVEL = 10
+GZIP_LEVEL = 6
+
+
+def get_compression(path):
+    if path.endswith(".zst"):
+        return "zstd"
+    if path.endswith(".gz"):
+        return "gzip"
+    return None
+
+
+def open_bundle(path, mode):
+    # Text streams over the compressed file, so entries are written and read one line at a time
+    compression = get_compression(path)
+    if compression == "gzip":
+        return gzip.open(path, mode + "t", encoding="utf-8", compresslevel=GZIP_LEVEL) if mode == "w" else gzip.open(path, "rt", encoding="utf-8")
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("zstd bundles need the zstandard package, use a .jsonl.gz bundle instead")
+        file = open(path, mode + "b")
+        if mode == "w":
+            stream = zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(file, closefd=True)
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(file, closefd=True)
+        return io.TextIOWrapper(stream, encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def export_bundle(backend, path, model_hashes=None):
+    exported = 0
+    with open_bundle(path, "w") as bundle:
+        bundle.write(json.dumps({"format": BUNDLE_FORMAT, "version": BUNDLE_FORMAT_VERSION, "created": int(time.time())}) + "\n")
+        for model_hash in (model_hashes if model_hashes is not None else backend.list_hashes()):
+            result = backend.read(model_hash)
+            if result is None:
+                continue
+            model_info, _ = result
+            # Parsed parameters are rebuilt on import, so bundles only carry the presets themselves
+            bundle.write(json.dumps({"hash": model_hash, "model_info": strip_remote_base(strip_preset_parameters(model_info))}, separators=(",", ":")) + "\n")
+            exported += 1
+    return exported
+
+
+def iter_bundle(path):
+    with open_bundle(path, "r") as bundle:
+        header = json.loads(bundle.readline() or "{}")
+        if header.get("format") != BUNDLE_FORMAT:
+            raise ValueError(f"{path} is not a model preset bundle")
+        if header.get("version", 0) > BUNDLE_FORMAT_VERSION:
+            raise ValueError(f"{path} was written by a newer version of the extension")
+        for line_number, line in enumerate(bundle, start=2):
+            if line.strip():
+                yield line_number, line
+
+
+def get_free_preset_name(presets, preset_name):
+    new_preset_name = f"{preset_name} (imported)"
+    number = 2
+    while new_preset_name in presets:
+        new_preset_name = f"{preset_name} (imported {number})"
+        number += 1
+    return new_preset_name
+
+
+def merge_model_info(local_model_info, imported_model_info, policy, counts):
+    presets = local_model_info.setdefault("presets", {})
+    for preset_name, generation_data in imported_model_info.get("presets", {}).items():
+        if preset_name not in presets:
+            presets[preset_name] = generation_data
+            counts["presets_added"] += 1
+        elif presets[preset_name] == generation_data:
+            continue
+        elif policy == "overwrite":
+            presets[preset_name] = generation_data
+            counts["presets_overwritten"] += 1
+        elif policy == "rename":
+            presets[get_free_preset_name(presets, preset_name)] = generation_data
+            counts["presets_renamed"] += 1
+        else:
+            counts["presets_kept"] += 1
+
+    for key in ("url", "trigger_words"):
+        if imported_model_info.get(key) and (policy == "overwrite" or not local_model_info.get(key)):
+            local_model_info[key] = imported_model_info[key]
+    if policy == "overwrite" and imported_model_info.get("default_preset") in presets:
+        local_model_info["default_preset"] = imported_model_info["default_preset"]
+    return update_default_preset(local_model_info)
+
+
+def import_bundle(model_info_store, path, policy=DEFAULT_CONFLICT_POLICY):
+    if policy not in CONFLICT_POLICIES:
+        raise ValueError(f"unknown conflict policy {policy}, use one of {', '.join(CONFLICT_POLICIES)}")
+    counts = {"models_added": 0, "models_merged": 0, "presets_added": 0, "presets_overwritten": 0, "presets_renamed": 0, "presets_kept": 0, "invalid": 0}
+    errors = []
+    for line_number, line in iter_bundle(path):
+        try:
+            entry = json.loads(line)
+            model_hash = entry["hash"]
+            imported_model_info = entry["model_info"]
+        except (ValueError, KeyError, TypeError) as e:
+            counts["invalid"] += 1
+            errors.append(f"line {line_number}: {e}")
+            continue
+        if not model_hash or not validate_model_info(imported_model_info) or not isinstance(imported_model_info.get("presets"), dict):
+            counts["invalid"] += 1
+            errors.append(f"line {line_number}: invalid model info for {model_hash}")
+            continue
+
+        if model_info_store.exists(model_hash):
+            with model_info_store.edit(model_hash) as model_info:
+                merge_model_info(model_info, imported_model_info, policy, counts)
+                update_preset_parameters(model_info)
+            counts["models_merged"] += 1
+        else:
+            model_info_store.put(model_hash, update_preset_parameters(update_default_preset(imported_model_info)))
+            counts["models_added"] += 1
+            counts["presets_added"] += len(imported_model_info["presets"])
+    model_info_store.flush()
+    return counts, errors
+
+
+def format_import_report(counts, errors):
+    lines = [", ".join(f"{count} {name.replace('_', ' ')}" for name, count in counts.items())]
+    lines += errors
+    return "\n".join(lines)
+
+
+def main(argv):
+    from model_preset_manager import storage
+    from model_preset_manager.model_info import empty_model_info
+    from model_preset_manager.model_info_store import ModelInfoStore
+
+    parser = argparse.ArgumentParser(prog="python -m model_preset_manager.bundles", description="Export or import model preset bundles (.jsonl, .jsonl.gz or .jsonl.zst)")
+    parser.add_argument("action", choices=["export", "import"])
+    parser.add_argument("path")
+    parser.add_argument("models", nargs="*", help="model hashes to export, the whole library when left out")
+    parser.add_argument("--policy", default=DEFAULT_CONFLICT_POLICY, choices=CONFLICT_POLICIES, help="what to do with imported presets whose name is already used")
+    parser.add_argument("--backend", default="json", choices=storage.STORAGE_BACKENDS)
+    args = parser.parse_args(argv)
+
+    store = ModelInfoStore(storage.create_backend(args.backend), empty_model_info)
+    if args.action == "export":
+        print(f"exported {export_bundle(store.backend, args.path, args.models or None)} models to {args.path}")
+    else:
+        counts, errors = import_bundle(store, args.path, args.policy)
+        print(format_import_report(counts, errors))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,261 @@
+import re
+import shutil
+import threading
+import time
+
+from urllib.parse import urlsplit
+
+import requests
+
+from model_preset_manager.http_cache import CachedResponse, ResponseCache
+from model_preset_manager.metrics import increment, span
+from model_preset_manager.preset_extractor import extract_presets_from_chunks, extract_presets_from_description
+
+CIVITAI_URL = 'https://civitai.com'
+CIVITAI_MODEL_INFO_BY_HASH_PATH = '/api/v1/model-versions/by-hash/'
+CIVITAI_MODEL_BY_ID_PATH = '/api/v1/models/'
+CIVITAI_MODEL_PAGE_BY_ID_PATH = '/models/'
+MODEL_ID_PATTERN = re.compile(r'/models/(\d+)')
+STREAM_CHUNK_SIZE = 64 * 1024
+
+DEFAULT_REQUESTS_PER_SECOND = 2.0
+DEFAULT_TIMEOUT = 30
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_BACKOFF = 1.0
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+MAX_RETRY_AFTER = 60
+CONNECTION_POOL_SIZE = 16
+
+API_CACHE_TTL = 24 * 60 * 60
+PAGE_CACHE_TTL = 24 * 60 * 60
+IMAGE_CACHE_TTL = 30 * 24 * 60 * 60
+# Hashes Civitai doesn't know are remembered too, so unknown models don't cost a request on every sync
+NOT_FOUND_CACHE_TTL = 24 * 60 * 60
+
+shared_session = None
+shared_response_cache = None
+shared_lock = threading.Lock()
+
+
+def get_shared_session():
+    global shared_session
+    with shared_lock:
+        if shared_session is None:
+            shared_session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=CONNECTION_POOL_SIZE)
+            shared_session.mount("https://", adapter)
+            shared_session.mount("http://", adapter)
+        return shared_session
+
+
+def get_shared_response_cache():
+    global shared_response_cache
+    with shared_lock:
+        if shared_response_cache is None:
+            shared_response_cache = ResponseCache()
+        return shared_response_cache
+
+
+class RateLimiter:
+    def __init__(self, requests_per_second):
+        self.interval = 1.0 / requests_per_second if requests_per_second and requests_per_second > 0 else 0.0
+        self.next_request_time = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            request_time = max(now, self.next_request_time)
+            self.next_request_time = request_time + self.interval
+        if request_time > now:
+            time.sleep(request_time - now)
+
+
+def get_request_kind(url):
+    # Requests are labelled by endpoint, not by url, so the metrics stay small
+    path = urlsplit(url).path
+    if path.startswith(CIVITAI_MODEL_INFO_BY_HASH_PATH):
+        return "model_version"
+    if path.startswith(CIVITAI_MODEL_BY_ID_PATH):
+        return "model"
+    if path.startswith(CIVITAI_MODEL_PAGE_BY_ID_PATH):
+        return "model_page"
+    return "image"
+
+
+def get_retry_delay(response, attempt, backoff):
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), MAX_RETRY_AFTER)
+        except ValueError:
+            pass
+    return backoff * (2 ** attempt)
+
+
+class CivitaiClient:
+    def __init__(self, base_url=CIVITAI_URL, requests_per_second=DEFAULT_REQUESTS_PER_SECOND, timeout=DEFAULT_TIMEOUT, max_retries=DEFAULT_MAX_RETRIES, backoff=DEFAULT_BACKOFF, session=None, response_cache=None, use_cache=True):
+        self.base_url = base_url.rstrip('/')
+        self.rate_limiter = RateLimiter(requests_per_second)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.session = session or get_shared_session()
+        self.use_cache = use_cache
+        self.own_response_cache = response_cache
+
+    @property
+    def response_cache(self):
+        # The shared cache is only set up on the first request, so importing this module leaves nothing on disk
+        if not self.use_cache:
+            return None
+        return self.own_response_cache or get_shared_response_cache()
+
+    def get(self, url, ttl=None, not_found_ttl=None, **kwargs):
+        entry = self.response_cache.load(url) if self.response_cache and ttl else None
+        if entry and entry.is_fresh():
+            increment("http_cache_lookups", kind=get_request_kind(url), result="hit")
+            return entry.to_response()
+
+        increment("http_cache_lookups", kind=get_request_kind(url), result="stale" if entry else "miss")
+        if entry:
+            kwargs["headers"] = dict(kwargs.get("headers") or {}, **entry.get_validator_headers())
+        try:
+            response = self.fetch(url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            # Stale data beats no data when Civitai can't be reached
+            if entry:
+                return entry.to_response()
+            raise
+
+        if entry and response.status_code == 304:
+            self.response_cache.refresh(entry)
+            return entry.to_response()
+        if self.response_cache and ttl and response.status_code == 200:
+            self.response_cache.store(url, response, ttl)
+        elif self.response_cache and not_found_ttl and response.status_code == 404:
+            self.response_cache.store(url, response, not_found_ttl)
+        return response
+
+    def fetch(self, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        kind = get_request_kind(url)
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.wait()
+            response = None
+            try:
+                # Streamed requests are timed up to the response headers, the body is read by the caller
+                with span("http_request", kind=kind):
+                    response = self.session.get(url, **kwargs)
+                increment("http_responses", kind=kind, status=response.status_code)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    return response
+            except (requests.ConnectionError, requests.Timeout):
+                increment("http_responses", kind=kind, status="connection_error")
+                if attempt == self.max_retries:
+                    raise
+            if attempt < self.max_retries:
+                increment("http_retries", kind=kind)
+                time.sleep(get_retry_delay(response, attempt, self.backoff))
+        return response
+
+    def get_model_page_url(self, model_id):
+        return f'{self.base_url}{CIVITAI_MODEL_PAGE_BY_ID_PATH}{model_id}'
+
+    def get_model_version_by_hash(self, short_hash):
+        response = self.get(f"{self.base_url}{CIVITAI_MODEL_INFO_BY_HASH_PATH}{short_hash}", API_CACHE_TTL, NOT_FOUND_CACHE_TTL)
+        try:
+            return response.json()
+        except ValueError:
+            return {}
+
+    def get_model_url_trigger_words_and_first_image_url_from_hash(self, short_hash, data=None):
+        if data is None:
+            data = self.get_model_version_by_hash(short_hash)
+
+        # The get() method returns None if the key does not exist.
+        trigger_words = data.get("trainedWords", [])
+        images = data.get("images", [{}]) or [{}]
+        model_url = self.get_model_page_url(data.get("modelId", ""))
+
+        first_image_url = images[0].get("url", None)
+
+        return model_url, trigger_words, first_image_url
+
+    def get_model_description(self, model_id):
+        response = self.get(f"{self.base_url}{CIVITAI_MODEL_BY_ID_PATH}{model_id}", API_CACHE_TTL, NOT_FOUND_CACHE_TTL)
+        try:
+            return response.json().get("description") or ""
+        except (ValueError, AttributeError):
+            return ""
+
+    def iter_content(self, url, ttl=None, **kwargs):
+        entry = self.response_cache.load(url) if self.response_cache and ttl else None
+        if entry and entry.is_fresh():
+            increment("http_cache_lookups", kind=get_request_kind(url), result="hit")
+            yield from entry.to_response().iter_content(STREAM_CHUNK_SIZE)
+            return
+        increment("http_cache_lookups", kind=get_request_kind(url), result="stale" if entry else "miss")
+
+        response = self.fetch(url, stream=True, **kwargs)
+        chunks = []
+        try:
+            for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+                chunks.append(chunk)
+                yield chunk
+        finally:
+            response.close()
+        # Only a page that was read to the end can be cached
+        if self.response_cache and ttl and response.status_code == 200:
+            self.response_cache.store(url, CachedResponse(url, response.status_code, response.headers, b"".join(chunks)), ttl)
+
+    def get_model_presets_from_civitai_model_url(self, model_url):
+        # The API hands out the description on its own, so the model page is only a fallback
+        match = MODEL_ID_PATTERN.search(model_url)
+        if match and model_url.startswith(self.base_url):
+            presets = extract_presets_from_description(self.get_model_description(match.group(1)))
+            if presets is not None:
+                return presets
+
+        headers = {'User-Agent': 'Mozilla/5.0'}
+        chunks = self.iter_content(model_url, PAGE_CACHE_TTL, headers=headers)
+        try:
+            return extract_presets_from_chunks(chunks)
+        finally:
+            chunks.close()
+
+    def download(self, url):
+        response = self.get(url, IMAGE_CACHE_TTL)
+        response.raise_for_status()
+        return response.content
+
+    def download_to_file(self, url, path):
+        entry = self.response_cache.load(url) if self.response_cache else None
+        if entry and entry.is_fresh():
+            increment("http_cache_lookups", kind=get_request_kind(url), result="hit")
+            shutil.copyfile(entry.body_path, path)
+            return path
+        increment("http_cache_lookups", kind=get_request_kind(url), result="stale" if entry else "miss")
+
+        response = self.fetch(url, stream=True)
+        try:
+            response.raise_for_status()
+            with open(path, "wb") as file:
+                for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+                    file.write(chunk)
+        finally:
+            response.close()
+        if self.response_cache:
+            self.response_cache.store_file(url, response, path, IMAGE_CACHE_TTL)
+        return path
+
+
+civitai_client = CivitaiClient()
+
+
+def get_model_url_trigger_words_and_first_image_url_from_hash(short_hash):
+    return civitai_client.get_model_url_trigger_words_and_first_image_url_from_hash(short_hash)
+
+
+def get_model_presets_from_civitai_model_url(model_url):
+    return civitai_client.get_model_presets_from_civitai_model_url(model_url)
@@ -0,0 +1,184 @@
+import functools
+import hashlib
+import re
+
+# Same key: value grammar the webui uses for the last line of infotext
+PARAMETER_PATTERN = re.compile(r'\s*(\w[\w \-/]+):\s*("(?:\\.|[^\\"])+"|[^,]*)(?:,|$)')
+SIZE_PATTERN = re.compile(r'^(\d+)x(\d+)$')
+NEGATIVE_PROMPT_PREFIX = "Negative prompt:"
+MIN_PARAMETERS_ON_LAST_LINE = 3
+MAX_CACHED_PARSES = 1024
+PRESET_PARAMETERS_KEY = "preset_parameters"
+
+FIELDS = ("prompt", "negative_prompt", "steps", "sampler", "cfg_scale", "seed", "width", "height", "clip_skip", "extras")
+# Infotext key, field name and type, in the order the webui writes them
+TYPED_PARAMETERS = [
+    ("Steps", "steps", int),
+    ("Sampler", "sampler", str),
+    ("CFG scale", "cfg_scale", float),
+    ("Seed", "seed", int),
+]
+TRAILING_TYPED_PARAMETERS = [
+    ("Clip skip", "clip_skip", int),
+]
+TYPED_PARAMETERS_BY_KEY = {key: (field, field_type) for key, field, field_type in TYPED_PARAMETERS + TRAILING_TYPED_PARAMETERS}
+
+
+def get_text_hash(text):
+    return hashlib.blake2b((text or "").encode("utf-8"), digest_size=8).hexdigest()
+
+
+def format_number(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class GenerationParameters:
+    __slots__ = FIELDS + ("text",)
+
+    def __init__(self, prompt="", negative_prompt=None, steps=None, sampler=None, cfg_scale=None, seed=None, width=None, height=None, clip_skip=None, extras=None, text=None):
+        self.prompt = prompt
+        self.negative_prompt = negative_prompt
+        self.steps = steps
+        self.sampler = sampler
+        self.cfg_scale = cfg_scale
+        self.seed = seed
+        self.width = width
+        self.height = height
+        self.clip_skip = clip_skip
+        self.extras = dict(extras or {})
+        # The infotext this was parsed from, handed back unchanged while nothing was edited
+        self.text = text
+
+    def get_values(self):
+        return tuple(getattr(self, field) for field in FIELDS)
+
+    def __eq__(self, other):
+        if not isinstance(other, GenerationParameters):
+            return NotImplemented
+        return self.get_values() == other.get_values()
+
+    def __repr__(self):
+        values = ", ".join(f"{field}={getattr(self, field)!r}" for field in FIELDS if getattr(self, field) not in (None, "", {}))
+        return f"GenerationParameters({values})"
+
+    def copy(self):
+        return GenerationParameters(*self.get_values(), text=self.text)
+
+    def get_parameters(self):
+        parameters = {}
+        for key, field, _ in TYPED_PARAMETERS:
+            if getattr(self, field) is not None:
+                parameters[key] = getattr(self, field)
+        if self.width is not None and self.height is not None:
+            parameters["Size"] = f"{self.width}x{self.height}"
+        parameters.update(self.extras)
+        for key, field, _ in TRAILING_TYPED_PARAMETERS:
+            if getattr(self, field) is not None:
+                parameters[key] = getattr(self, field)
+        return parameters
+
+    def to_infotext(self):
+        if self.text is not None and parse_generation_parameters(self.text) == self:
+            return self.text
+
+        lines = [self.prompt] if self.prompt else []
+        if self.negative_prompt is not None:
+            lines.append(f"{NEGATIVE_PROMPT_PREFIX} {self.negative_prompt}".rstrip())
+        parameters = self.get_parameters()
+        if parameters:
+            lines.append(", ".join(f"{key}: {format_number(value)}" for key, value in parameters.items()))
+        return "\n".join(lines)
+
+    def to_dict(self, include_prompts=True):
+        data = {field: getattr(self, field) for field in FIELDS if getattr(self, field) is not None and field != "extras"}
+        if not include_prompts:
+            data.pop("prompt", None)
+            data.pop("negative_prompt", None)
+        if self.extras:
+            data["extras"] = dict(self.extras)
+        return data
+
+    @classmethod
+    def from_dict(cls, data, text=None):
+        return cls(**{field: data[field] for field in FIELDS if field in data}, text=text)
+
+    def diff(self, other):
+        differences = {}
+        for field in FIELDS[:-1]:
+            if getattr(self, field) != getattr(other, field):
+                differences[field] = (getattr(self, field), getattr(other, field))
+        for key in dict.fromkeys(list(self.extras) + list(other.extras)):
+            if self.extras.get(key) != other.extras.get(key):
+                differences[key] = (self.extras.get(key), other.extras.get(key))
+        return differences
+
+
+def parse_value(field_type, value):
+    if value.startswith('"'):
+        raise ValueError("quoted values are kept as they are")
+    return field_type(value)
+
+
+@functools.lru_cache(maxsize=MAX_CACHED_PARSES)
+def parse_infotext(text):
+    *lines, last_line = text.strip().split("\n")
+    if len(PARAMETER_PATTERN.findall(last_line)) < MIN_PARAMETERS_ON_LAST_LINE:
+        lines.append(last_line)
+        last_line = ""
+
+    prompt = ""
+    negative_prompt = None
+    for line in lines:
+        line = line.strip()
+        if line.startswith(NEGATIVE_PROMPT_PREFIX):
+            negative_prompt = line[len(NEGATIVE_PROMPT_PREFIX):].strip()
+        elif negative_prompt is not None:
+            negative_prompt += "\n" + line
+        else:
+            prompt += ("\n" if prompt else "") + line
+
+    parameters = GenerationParameters(prompt, negative_prompt, text=text)
+    for key, value in PARAMETER_PATTERN.findall(last_line):
+        value = value.strip()
+        size = SIZE_PATTERN.match(value) if key == "Size" else None
+        if size:
+            parameters.width, parameters.height = int(size.group(1)), int(size.group(2))
+            continue
+        if key in TYPED_PARAMETERS_BY_KEY:
+            field, field_type = TYPED_PARAMETERS_BY_KEY[key]
+            try:
+                setattr(parameters, field, parse_value(field_type, value))
+                continue
+            except ValueError:
+                pass
+        parameters.extras[key] = value
+    return parameters
+
+
+def parse_generation_parameters(text):
+    # Cached parses are shared, so callers get a copy they're free to change
+    return parse_infotext(text or "").copy()
+
+
+def get_preset_parameters(model_info, preset_name):
+    return parse_generation_parameters(model_info.get("presets", {}).get(preset_name, ""))
+
+
+def update_preset_parameters(model_info):
+    # Parsed parameters are kept next to the raw presets and only reparsed when a preset's text changes
+    stored = model_info.get(PRESET_PARAMETERS_KEY) or {}
+    updated = {}
+    for preset_name, text in model_info.get("presets", {}).items():
+        text_hash = get_text_hash(text)
+        entry = stored.get(preset_name)
+        if not isinstance(entry, dict) or entry.get("text_hash") != text_hash:
+            entry = dict(parse_generation_parameters(text).to_dict(include_prompts=False), text_hash=text_hash)
+        updated[preset_name] = entry
+    model_info[PRESET_PARAMETERS_KEY] = updated
+    return model_info
+
+
+def strip_preset_parameters(model_info):
+    return {key: value for key, value in model_info.items() if key != PRESET_PARAMETERS_KEY}
@@ -0,0 +1,145 @@
+import json
+import os
+import threading
+
+from concurrent import futures
+
+from model_preset_manager import hashing, paths
+from model_preset_manager.metrics import increment
+
+HASH_CACHE_FILE_NAME = "hash_cache.json"
+PROGRESS_POLL_INTERVAL = 0.25
+
+
+def get_file_signature(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "inode": stat.st_ino}
+
+
+def get_webui_cached_sha256(path, title):
+    # The webui keeps its own sha256 cache for checkpoints it has already hashed
+    try:
+        from modules import hashes
+        return hashes.sha256_from_cache(path, title)
+    except Exception:
+        pass
+
+    try:
+        from modules import paths as webui_paths
+        with open(os.path.join(webui_paths.data_path, "cache.json"), "r") as file:
+            entry = json.load(file).get("hashes", {}).get(title)
+    except Exception:
+        return None
+
+    if not entry or os.path.getmtime(path) > entry.get("mtime", 0):
+        return None
+    return entry.get("sha256")
+
+
+class HashJob:
+    def __init__(self, path, total_bytes, signature=None):
+        self.path = path
+        self.total_bytes = total_bytes
+        self.signature = signature
+        self.bytes_done = 0
+        self.future = None
+
+    def update(self, bytes_done):
+        self.bytes_done = bytes_done
+
+    @property
+    def fraction(self):
+        if not self.total_bytes:
+            return 0.0
+        return min(self.bytes_done / self.total_bytes, 1.0)
+
+
+class HashCache:
+    def __init__(self, cache_file_path=None):
+        # Only the path is worked out here, the cache folder is made on the first save so importing this module leaves nothing on disk
+        self.cache_file_path = cache_file_path or os.path.join(paths.CACHE_DIRECTORY, HASH_CACHE_FILE_NAME)
+        self.lock = threading.Lock()
+        self.entries = None
+        self.jobs = {}
+        self.executor = futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="model_preset_manager_hash")
+
+    def load(self):
+        if self.entries is None:
+            try:
+                with open(self.cache_file_path, "r") as file:
+                    self.entries = json.load(file)
+            except (FileNotFoundError, json.JSONDecodeError):
+                self.entries = {}
+        return self.entries
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.cache_file_path), exist_ok=True)
+        temporary_path = f"{self.cache_file_path}.tmp"
+        with open(temporary_path, "w") as file:
+            json.dump(self.entries, file)
+        os.replace(temporary_path, self.cache_file_path)
+
+    def lookup(self, path):
+        resolved_path = os.path.realpath(path)
+        signature = get_file_signature(resolved_path)
+        with self.lock:
+            entry = self.load().get(resolved_path)
+        if entry and all(entry.get(key) == value for key, value in signature.items()):
+            return entry["sha256"]
+        return None
+
+    def store(self, path, sha256, signature=None):
+        resolved_path = os.path.realpath(path)
+        entry = dict(signature or get_file_signature(resolved_path), sha256=sha256)
+        with self.lock:
+            self.load()[resolved_path] = entry
+            self.save()
+
+    def compute(self, resolved_path, signature, job, webui_title):
+        try:
+            sha256 = get_webui_cached_sha256(resolved_path, webui_title) if webui_title else None
+            if not sha256:
+                sha256 = hashing.sha256_file(resolved_path, job.update)
+            self.store(resolved_path, sha256, signature)
+            return sha256
+        finally:
+            with self.lock:
+                if self.jobs.get(resolved_path) is job:
+                    del self.jobs[resolved_path]
+
+    def submit(self, path, webui_title=None):
+        resolved_path = os.path.realpath(path)
+        signature = get_file_signature(resolved_path)
+        with self.lock:
+            job = self.jobs.get(resolved_path)
+            # A job started on an earlier version of the file, say while it was still being copied, isn't reused
+            if job is None or job.signature != signature:
+                job = HashJob(resolved_path, signature["size"], signature)
+                job.future = self.executor.submit(self.compute, resolved_path, signature, job, webui_title)
+                self.jobs[resolved_path] = job
+        return job
+
+    def get_sha256(self, path, webui_title=None, progress=None):
+        sha256 = self.lookup(path)
+        increment("hash_cache_lookups", result="hit" if sha256 else "miss")
+        if sha256:
+            return sha256
+
+        job = self.submit(path, webui_title)
+        while True:
+            try:
+                return job.future.result(timeout=PROGRESS_POLL_INTERVAL)
+            except futures.TimeoutError:
+                if progress:
+                    progress(job.fraction, desc=f"Hashing {os.path.basename(path)}")
+
+    def get_progress(self):
+        with self.lock:
+            return {path: job.fraction for path, job in self.jobs.items()}
+
+
+hash_cache = HashCache()
+
+
+def get_sha256(path, webui_title=None, progress=None):
+    return hash_cache.get_sha256(path, webui_title, progress)
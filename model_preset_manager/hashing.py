@@ -0,0 +1,152 @@
+import hashlib
+import mmap
+import os
+import sys
+import time
+
+from concurrent import futures
+
+from model_preset_manager.metrics import increment, span
+
+BUFFER_SIZE = 8 * 1024 * 1024
+DEFAULT_STRATEGY = "readinto"
+
+
+def get_model_directories():
+    directories = []
+    try:
+        from modules import sd_models, shared
+        directories += [shared.cmd_opts.ckpt_dir, sd_models.model_path]
+    except Exception:
+        pass
+    directories.append(os.path.join("models", "Stable-diffusion"))
+    return [directory for directory in directories if directory]
+
+
+def resolve_checkpoint_path(filename):
+    # Prefer the webui's own checkpoint registry, it already knows the absolute path
+    try:
+        from modules import sd_models
+        checkpoints = getattr(sd_models, "checkpoint_aliases", None) or sd_models.checkpoints_list
+        checkpoint_info = checkpoints.get(filename)
+        if checkpoint_info:
+            return checkpoint_info.filename
+    except Exception:
+        pass
+
+    if os.path.isabs(filename):
+        return filename
+
+    for directory in get_model_directories():
+        candidate = os.path.join(directory, filename)
+        if os.path.isfile(candidate):
+            return candidate
+    return filename
+
+
+def sha256_readinto(path, progress_callback=None, buffer_size=BUFFER_SIZE):
+    sha256 = hashlib.sha256()
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    bytes_done = 0
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            size = f.readinto(buffer)
+            if not size:
+                break
+            sha256.update(view[:size])
+            bytes_done += size
+            if progress_callback:
+                progress_callback(bytes_done)
+    return sha256.hexdigest()
+
+
+def sha256_mmap(path, progress_callback=None, buffer_size=BUFFER_SIZE):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return sha256.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            with memoryview(mapped) as view:
+                for offset in range(0, size, buffer_size):
+                    sha256.update(view[offset:offset + buffer_size])
+                    if progress_callback:
+                        progress_callback(min(offset + buffer_size, size))
+    return sha256.hexdigest()
+
+
+def sha256_file_digest(path, progress_callback=None, buffer_size=BUFFER_SIZE):
+    with open(path, 'rb') as f:
+        digest = hashlib.file_digest(f, "sha256").hexdigest()
+    if progress_callback:
+        progress_callback(os.path.getsize(path))
+    return digest
+
+
+STRATEGIES = {
+    "readinto": sha256_readinto,
+    "mmap": sha256_mmap,
+}
+# hashlib.file_digest only exists on python 3.11+
+if hasattr(hashlib, "file_digest"):
+    STRATEGIES["file_digest"] = sha256_file_digest
+
+
+def sha256_file(path, progress_callback=None, strategy=DEFAULT_STRATEGY):
+    with span("hash", strategy=strategy):
+        sha256 = STRATEGIES[strategy](path, progress_callback)
+    increment("hash_bytes", os.path.getsize(path))
+    return sha256
+
+
+def sha256_files(paths, max_workers=None, strategy=DEFAULT_STRATEGY, progress_callback=None):
+    # hashlib releases the GIL while hashing large buffers, so threads scale with the disk
+    results = {}
+    with futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="model_preset_manager_hash") as executor:
+        jobs = {executor.submit(sha256_file, path, None, strategy): path for path in paths}
+        for done_count, job in enumerate(futures.as_completed(jobs), 1):
+            path = jobs[job]
+            try:
+                results[path] = job.result()
+            except OSError as e:
+                print(f"could not hash {path}: {e}")
+                results[path] = None
+            if progress_callback:
+                progress_callback(done_count, len(jobs))
+    return results
+
+
+def benchmark_strategies(path, strategies=None, repeat=3):
+    size = os.path.getsize(path)
+    results = {}
+    for strategy in strategies or STRATEGIES:
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            sha256_file(path, strategy=strategy)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results[strategy] = size / (1024 * 1024) / best if best else float("inf")
+    return results
+
+
+def main(argv):
+    if not argv:
+        print("usage: python -m model_preset_manager.hashing FILE [FILE ...]")
+        return 1
+    for path in argv:
+        print(f"{path} ({os.path.getsize(path) / (1024 * 1024):.1f} MB)")
+        for strategy, megabytes_per_second in benchmark_strategies(path).items():
+            print(f"  {strategy:<12} {megabytes_per_second:10.1f} MB/s")
+    if len(argv) > 1:
+        start = time.perf_counter()
+        sha256_files(argv)
+        elapsed = time.perf_counter() - start
+        total_megabytes = sum(os.path.getsize(path) for path in argv) / (1024 * 1024)
+        print(f"parallel batch: {total_megabytes / elapsed:.1f} MB/s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
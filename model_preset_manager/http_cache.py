@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+import requests
+
+from model_preset_manager import paths
+
+HTTP_CACHE_DIRECTORY_NAME = "http"
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+VALIDATOR_HEADERS = ("ETag", "Last-Modified", "Content-Type")
+
+
+class CachedResponse:
+    def __init__(self, url, status_code, headers, content):
+        self.url = url
+        self.status_code = status_code
+        self.headers = requests.structures.CaseInsensitiveDict(headers)
+        self.content = content
+        self.from_cache = True
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode(requests.utils.get_encoding_from_headers(self.headers) or "utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size=1):
+        for offset in range(0, len(self.content), chunk_size):
+            yield self.content[offset:offset + chunk_size]
+
+    def close(self):
+        pass
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise requests.HTTPError(f"{self.status_code} Error for url: {self.url}", response=self)
+
+
+class CacheEntry:
+    def __init__(self, metadata, body_path):
+        self.metadata = metadata
+        self.body_path = body_path
+
+    def is_fresh(self):
+        return time.time() - self.metadata["stored_at"] < self.metadata["ttl"]
+
+    def get_validator_headers(self):
+        headers = {}
+        if self.metadata["headers"].get("ETag"):
+            headers["If-None-Match"] = self.metadata["headers"]["ETag"]
+        if self.metadata["headers"].get("Last-Modified"):
+            headers["If-Modified-Since"] = self.metadata["headers"]["Last-Modified"]
+        return headers
+
+    def to_response(self):
+        with open(self.body_path, "rb") as file:
+            content = file.read()
+        return CachedResponse(self.metadata["url"], self.metadata["status_code"], self.metadata["headers"], content)
+
+
+class ResponseCache:
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory or os.path.join(paths.CACHE_DIRECTORY, HTTP_CACHE_DIRECTORY_NAME)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.total_bytes = None
+
+    def get_paths(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        base_path = os.path.join(self.directory, key)
+        return f"{base_path}.json", f"{base_path}.body"
+
+    def load(self, url):
+        metadata_path, body_path = self.get_paths(url)
+        try:
+            with open(metadata_path, "r") as file:
+                metadata = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if metadata.get("url") != url or not os.path.exists(body_path):
+            return None
+        # Access time drives eviction order
+        os.utime(body_path)
+        return CacheEntry(metadata, body_path)
+
+    def write_file(self, path, data):
+        # The folder is only made once something is stored
+        os.makedirs(self.directory, exist_ok=True)
+        temporary_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "wb") as file:
+            file.write(data)
+        os.replace(temporary_path, path)
+
+    def store(self, url, response, ttl):
+        metadata_path, body_path = self.get_paths(url)
+        previous_size = self.get_stored_size(metadata_path)
+        self.write_file(body_path, response.content)
+        self.store_metadata(url, response, len(response.content), ttl, previous_size)
+
+    def store_file(self, url, response, source_path, ttl):
+        # Large bodies are copied from disk instead of being held in memory
+        metadata_path, body_path = self.get_paths(url)
+        previous_size = self.get_stored_size(metadata_path)
+        temporary_path = f"{body_path}.{threading.get_ident()}.tmp"
+        os.makedirs(self.directory, exist_ok=True)
+        shutil.copyfile(source_path, temporary_path)
+        os.replace(temporary_path, body_path)
+        self.store_metadata(url, response, os.path.getsize(body_path), ttl, previous_size)
+
+    def store_metadata(self, url, response, size, ttl, previous_size):
+        metadata_path, _ = self.get_paths(url)
+        headers = {name: response.headers[name] for name in VALIDATOR_HEADERS if name in response.headers}
+        metadata = {"url": url, "status_code": response.status_code, "headers": headers, "stored_at": time.time(), "ttl": ttl, "size": size}
+        self.write_file(metadata_path, json.dumps(metadata).encode("utf-8"))
+        with self.lock:
+            if self.total_bytes is not None:
+                self.total_bytes += size - previous_size
+        self.evict()
+
+    def refresh(self, entry, ttl=None):
+        entry.metadata["stored_at"] = time.time()
+        if ttl is not None:
+            entry.metadata["ttl"] = ttl
+        metadata_path, _ = self.get_paths(entry.metadata["url"])
+        self.write_file(metadata_path, json.dumps(entry.metadata).encode("utf-8"))
+
+    def get_stored_size(self, metadata_path):
+        try:
+            with open(metadata_path, "r") as file:
+                return json.load(file).get("size", 0)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return 0
+
+    def list_bodies(self):
+        bodies = []
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return bodies
+        for entry in entries:
+            if entry.name.endswith(".body"):
+                stat = entry.stat()
+                bodies.append((stat.st_mtime, stat.st_size, entry.path))
+        return bodies
+
+    def evict(self):
+        with self.lock:
+            if self.total_bytes is None:
+                self.total_bytes = sum(size for _, size, _ in self.list_bodies())
+            if self.total_bytes <= self.max_bytes:
+                return
+            # Drop the least recently used responses until we're back under the limit
+            for _, size, body_path in sorted(self.list_bodies()):
+                if self.total_bytes <= self.max_bytes:
+                    break
+                for path in (body_path, body_path[:-len(".body")] + ".json"):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                self.total_bytes -= size
+
+    def clear(self):
+        with self.lock:
+            if os.path.isdir(self.directory):
+                for entry in os.scandir(self.directory):
+                    os.remove(entry.path)
+            self.total_bytes = 0
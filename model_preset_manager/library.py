@@ -0,0 +1,98 @@
+import re
+
+from model_preset_manager import hash_cache, hashing, storage
+from model_preset_manager.generation_parameters import update_preset_parameters
+from model_preset_manager.model_info import empty_model_info, get_default_preset, update_default_preset
+from model_preset_manager.model_info_store import ModelInfoStore
+
+
+def create_model_info_store(backend_name="json", get_file_path=storage.get_model_info_file_path):
+    return ModelInfoStore(storage.create_backend(backend_name, get_file_path), empty_model_info)
+
+
+def remove_hash_and_whitespace(s, remove_extension=False):
+    # Remove any whitespace and hash surrounded by square brackets
+    cleaned_string = re.sub(r'\s*\[.*?\]', '', s)
+
+    # If remove_extension is set to True, remove the file extension as well
+    if remove_extension:
+        cleaned_string = re.sub(r'\.[^.]*$', '', cleaned_string)
+
+    return cleaned_string
+
+
+def get_short_hash_from_filename(filename, progress=None):
+    match = re.search(r'\[(.*?)\]', filename)
+    if match:
+        return match.group(1)
+    filename = remove_hash_and_whitespace(filename)
+    model_path = hashing.resolve_checkpoint_path(filename)
+    # Hashes are cached on disk by path, size, mtime and inode, so only changed files get rehashed
+    return hash_cache.get_sha256(model_path, f"checkpoint/{filename}", progress)[:10]
+
+
+def load_model_info(model_info_store, model_filename, progress=None):
+    # Backs Retrieve Local Model Info, model info that is missing or has no url still has to be downloaded and comes back as None
+    short_hash = get_short_hash_from_filename(model_filename, progress)
+    model_info = model_info_store.get(short_hash, False)
+    if not model_info or not model_info.get('url'):
+        return short_hash, None, None, None
+    model_info.setdefault('presets', {"default": ""})
+    model_info.setdefault('trigger_words', [])
+    preset_name, generation_data = get_default_preset(model_info)
+    return short_hash, model_info, preset_name, generation_data
+
+
+def get_preset(model_info_store, model_filename, preset_name):
+    # Backs picking a preset in the dropdown
+    model_info = model_info_store.get(get_short_hash_from_filename(model_filename))
+    return model_info, model_info['presets'].get(preset_name, "")
+
+
+def set_model_info(model_info_store, model_hash, label, info):
+    with model_info_store.edit(model_hash) as model_info:
+        model_info[label] = info
+    return model_info
+
+
+def save_preset(model_info_store, model_hash, preset_name, generation_data):
+    with model_info_store.edit(model_hash) as model_info:
+        model_info['presets'][preset_name] = generation_data
+        update_preset_parameters(model_info)
+    return model_info
+
+
+def rename_preset(model_info_store, model_hash, preset_name, new_preset_name):
+    new_current_preset_name = new_preset_name
+
+    with model_info_store.edit(model_hash) as model_info:
+        # Check if the preset name is already the same
+        if preset_name == new_preset_name:
+            message = f"Preset already named {new_preset_name}"
+        # Check if the new preset name already exists
+        elif new_preset_name in model_info['presets'].keys():
+            message = f"Preset name {new_preset_name} already exists"
+            new_current_preset_name = preset_name
+        else:
+            # Rename the preset by creating a new key with the same value and removing the old one
+            model_info['presets'][new_preset_name] = model_info['presets'].pop(preset_name)
+            if model_info['default_preset'] == preset_name:
+                model_info['default_preset'] = new_preset_name
+            update_preset_parameters(model_info)
+            message = f"Preset {preset_name} renamed to {new_preset_name}"
+
+    return model_info, new_current_preset_name, message
+
+
+def delete_preset(model_info_store, model_hash, preset_name):
+    with model_info_store.edit(model_hash) as model_info:
+        model_info['presets'].pop(preset_name, None)
+        update_default_preset(model_info)
+        update_preset_parameters(model_info)
+    return model_info
+
+
+def set_default_preset(model_info_store, model_hash, preset_name):
+    with model_info_store.edit(model_hash) as model_info:
+        model_info['default_preset'] = preset_name
+    return model_info
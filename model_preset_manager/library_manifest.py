@@ -0,0 +1,289 @@
+import os
+import sqlite3
+import threading
+import time
+
+from concurrent import futures
+
+from model_preset_manager import hash_cache, hashing, paths, thumbnails
+from model_preset_manager.library_sync import CHECKPOINT_EXTENSIONS, Checkpoint
+from model_preset_manager.metrics import span
+
+LIBRARY_MANIFEST_FILE_NAME = "library_manifest.sqlite3"
+LIBRARY_MANIFEST_FORMAT_VERSION = 1
+DEFAULT_SCAN_WORKERS = 8
+
+THUMBNAIL_MISSING = "missing"
+THUMBNAIL_PREVIEW = "preview"
+THUMBNAIL_COMPACT = "compact"
+
+FIELDS = ("path", "root", "size", "mtime_ns", "short_hash", "has_model_info", "thumbnail", "thumbnail_mtime_ns")
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    path TEXT PRIMARY KEY,
+    root TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    short_hash TEXT,
+    has_model_info INTEGER NOT NULL DEFAULT 0,
+    thumbnail TEXT NOT NULL DEFAULT 'missing',
+    thumbnail_mtime_ns INTEGER
+) WITHOUT ROWID;
+"""
+
+
+class ManifestEntry:
+    __slots__ = FIELDS
+
+    def __init__(self, path, root, size, mtime_ns, short_hash=None, has_model_info=False, thumbnail=THUMBNAIL_MISSING, thumbnail_mtime_ns=None):
+        self.path = path
+        self.root = root
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.short_hash = short_hash
+        self.has_model_info = bool(has_model_info)
+        self.thumbnail = thumbnail
+        self.thumbnail_mtime_ns = thumbnail_mtime_ns
+
+    @property
+    def name(self):
+        return os.path.relpath(self.path, self.root)
+
+    def to_row(self):
+        return tuple(getattr(self, field) for field in FIELDS)
+
+    def to_dict(self):
+        return dict(zip(FIELDS, self.to_row()), name=self.name)
+
+
+def list_directory(directory):
+    # Only checkpoints and their previews are kept, everything else in the folder is skipped without a stat
+    subdirectories = []
+    files = {}
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirectories.append(entry.path)
+                        continue
+                    lower_name = entry.name.lower()
+                    if lower_name.endswith(CHECKPOINT_EXTENSIONS) or lower_name.endswith(".png"):
+                        stat = entry.stat()
+                        files[entry.name] = (stat.st_size, stat.st_mtime_ns)
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    return directory, subdirectories, files
+
+
+def walk_directories(roots, max_workers=DEFAULT_SCAN_WORKERS):
+    # Folders are listed in parallel, sub folders are queued as soon as their parent is listed
+    listings = {}
+    with futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="model_preset_manager_scan") as executor:
+        pending = {executor.submit(list_directory, root): root for root in roots}
+        while pending:
+            done, _ = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+            for job in done:
+                root = pending.pop(job)
+                directory, subdirectories, files = job.result()
+                listings[directory] = (root, files)
+                for subdirectory in subdirectories:
+                    pending[executor.submit(list_directory, subdirectory)] = root
+    return listings
+
+
+def get_thumbnail_state(thumbnail_path, thumbnail_exists):
+    if not thumbnail_exists:
+        return THUMBNAIL_MISSING
+    if thumbnails.get_display_thumbnail_path(thumbnail_path) != thumbnail_path:
+        return THUMBNAIL_COMPACT
+    return THUMBNAIL_PREVIEW
+
+
+def get_hashed_paths(roots):
+    # The hash cache is keyed by real path, mapping it onto the scanned folders once means files that were never hashed need no lookup
+    with hash_cache.hash_cache.lock:
+        hashed_paths = set(hash_cache.hash_cache.load())
+    for root in roots:
+        real_root = os.path.realpath(root)
+        if real_root != root:
+            hashed_paths.update([root + path[len(real_root):] for path in hashed_paths if path.startswith(real_root + os.sep)])
+    return hashed_paths
+
+
+def lookup_short_hash(path):
+    try:
+        sha256 = hash_cache.hash_cache.lookup(path)
+    except OSError:
+        return None
+    return sha256[:10] if sha256 else None
+
+
+class LibraryManifest:
+    def __init__(self, database_path=None, directories=None, get_model_hashes=None, max_workers=DEFAULT_SCAN_WORKERS):
+        self.database_path = database_path or paths.get_cache_file_path(LIBRARY_MANIFEST_FILE_NAME)
+        self.directories = directories
+        self.get_model_hashes = get_model_hashes
+        self.max_workers = max_workers
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(self.database_path, timeout=30, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        if self.connection.execute("PRAGMA user_version").fetchone()[0] != LIBRARY_MANIFEST_FORMAT_VERSION:
+            # The manifest can always be rebuilt from disk, so a format change just starts over
+            self.connection.execute("DROP TABLE IF EXISTS checkpoints")
+            self.connection.execute(f"PRAGMA user_version = {LIBRARY_MANIFEST_FORMAT_VERSION}")
+        self.connection.executescript(SCHEMA)
+        self.entries = {row[0]: ManifestEntry(*row) for row in self.connection.execute(f"SELECT {', '.join(FIELDS)} FROM checkpoints")}
+        self.last_scan = None
+
+    def get_roots(self):
+        roots = {}
+        for directory in (self.directories or hashing.get_model_directories()):
+            if os.path.isdir(directory):
+                roots.setdefault(os.path.realpath(directory), os.path.abspath(directory))
+        return list(roots.values())
+
+    def get_root(self, path):
+        matches = [root for root in self.get_roots() if path.startswith(root + os.sep)]
+        return max(matches, key=len) if matches else None
+
+    def update_entry(self, path, root, size, mtime_ns, thumbnail_mtime_ns, model_hashes, hashed_paths=None):
+        # Returns the entry and whether anything about it changed, hashes and thumbnails are only looked at when needed
+        entry = self.entries.get(path)
+        changed = False
+        if entry is None:
+            entry = ManifestEntry(path, root, size, mtime_ns)
+            self.entries[path] = entry
+            changed = True
+        elif entry.size != size or entry.mtime_ns != mtime_ns or entry.root != root:
+            entry.root = root
+            entry.size = size
+            entry.mtime_ns = mtime_ns
+            entry.short_hash = None
+            changed = True
+
+        if entry.short_hash is None and (hashed_paths is None or path in hashed_paths):
+            entry.short_hash = lookup_short_hash(path)
+            changed = changed or entry.short_hash is not None
+
+        if model_hashes is not None:
+            has_model_info = entry.short_hash is not None and entry.short_hash in model_hashes
+            if has_model_info != entry.has_model_info:
+                entry.has_model_info = has_model_info
+                changed = True
+
+        # A preview that was already there can get its compact copy later, so those are checked again
+        if changed or thumbnail_mtime_ns != entry.thumbnail_mtime_ns or entry.thumbnail == THUMBNAIL_PREVIEW:
+            thumbnail = get_thumbnail_state(thumbnails.get_thumbnail_path_for_checkpoint(path), thumbnail_mtime_ns is not None)
+            if thumbnail != entry.thumbnail or thumbnail_mtime_ns != entry.thumbnail_mtime_ns:
+                entry.thumbnail = thumbnail
+                entry.thumbnail_mtime_ns = thumbnail_mtime_ns
+                changed = True
+        return entry, changed
+
+    def save(self, changed_entries, removed_paths):
+        if not changed_entries and not removed_paths:
+            return
+        with self.connection:
+            self.connection.executemany(f"INSERT OR REPLACE INTO checkpoints ({', '.join(FIELDS)}) VALUES ({', '.join('?' * len(FIELDS))})", [entry.to_row() for entry in changed_entries])
+            self.connection.executemany("DELETE FROM checkpoints WHERE path = ?", [(path,) for path in removed_paths])
+
+    def scan(self):
+        start = time.perf_counter()
+        with span("library_scan"):
+            roots = self.get_roots()
+            listings = walk_directories(roots, self.max_workers)
+            hashed_paths = get_hashed_paths(roots)
+            model_hashes = set(self.get_model_hashes()) if self.get_model_hashes else None
+            counts = {"checkpoints": 0, "added": 0, "changed": 0, "removed": 0}
+            with self.lock:
+                known_paths = set(self.entries)
+                changed_entries = []
+                for directory, (root, files) in listings.items():
+                    for name, (size, mtime_ns) in files.items():
+                        if not name.lower().endswith(CHECKPOINT_EXTENSIONS):
+                            continue
+                        path = os.path.join(directory, name)
+                        thumbnail = files.get(os.path.basename(thumbnails.get_thumbnail_path_for_checkpoint(path)))
+                        entry, changed = self.update_entry(path, root, size, mtime_ns, thumbnail[1] if thumbnail else None, model_hashes, hashed_paths)
+                        counts["checkpoints"] += 1
+                        if changed:
+                            changed_entries.append(entry)
+                            counts["added" if path not in known_paths else "changed"] += 1
+                        known_paths.discard(path)
+                for path in known_paths:
+                    del self.entries[path]
+                counts["removed"] = len(known_paths)
+                self.save(changed_entries, known_paths)
+        counts["seconds"] = round(time.perf_counter() - start, 4)
+        self.last_scan = counts
+        return counts
+
+    def update_checkpoints(self, checkpoint_paths, model_hashes=None):
+        # For a file watcher that already knows what changed, only these checkpoints are looked at
+        if model_hashes is None and self.get_model_hashes:
+            model_hashes = set(self.get_model_hashes())
+        with self.lock:
+            changed_entries = []
+            removed_paths = []
+            for path in map(os.path.abspath, checkpoint_paths):
+                root = self.get_root(path)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    stat = None
+                if stat is None or root is None:
+                    if self.entries.pop(path, None) is not None:
+                        removed_paths.append(path)
+                    continue
+                try:
+                    thumbnail_mtime_ns = os.stat(thumbnails.get_thumbnail_path_for_checkpoint(path)).st_mtime_ns
+                except FileNotFoundError:
+                    thumbnail_mtime_ns = None
+                entry, changed = self.update_entry(path, root, stat.st_size, stat.st_mtime_ns, thumbnail_mtime_ns, model_hashes)
+                if changed:
+                    changed_entries.append(entry)
+            self.save(changed_entries, removed_paths)
+            return len(changed_entries) + len(removed_paths)
+
+    def set_model_info_exists(self, short_hash, exists):
+        with self.lock:
+            changed_entries = [entry for entry in self.entries.values() if entry.short_hash == short_hash and entry.has_model_info != exists]
+            for entry in changed_entries:
+                entry.has_model_info = exists
+            self.save(changed_entries, [])
+
+    def get_entries(self):
+        with self.lock:
+            return sorted(self.entries.values(), key=lambda entry: entry.name.lower())
+
+    def list_checkpoints(self):
+        return [Checkpoint(entry.name, entry.path, entry.short_hash) for entry in self.get_entries()]
+
+    def get_summary(self):
+        entries = self.get_entries()
+        return {
+            "checkpoints": len(entries),
+            "hashed": sum(1 for entry in entries if entry.short_hash),
+            "with_model_info": sum(1 for entry in entries if entry.has_model_info),
+            "with_thumbnail": sum(1 for entry in entries if entry.thumbnail != THUMBNAIL_MISSING),
+            "compact_thumbnails": sum(1 for entry in entries if entry.thumbnail == THUMBNAIL_COMPACT),
+            "total_bytes": sum(entry.size for entry in entries),
+        }
+
+    def get_summary_text(self):
+        summary = self.get_summary()
+        text = f"{summary['checkpoints']} checkpoints ({summary['total_bytes'] / 1024 ** 3:.1f} GB), {summary['hashed']} hashed, {summary['with_model_info']} with model info, {summary['with_thumbnail']} with thumbnails"
+        if self.last_scan:
+            text += f", last scan {self.last_scan['seconds'] * 1000:.0f} ms: {self.last_scan['added']} added, {self.last_scan['changed']} changed, {self.last_scan['removed']} removed"
+        return text
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
@@ -0,0 +1,130 @@
+import os
+import re
+import threading
+import time
+
+from concurrent import futures
+
+from model_preset_manager import hash_cache, hashing, model_info_merge, thumbnails
+from model_preset_manager.civitai import CivitaiClient
+
+CHECKPOINT_EXTENSIONS = (".ckpt", ".safetensors")
+DEFAULT_MAX_WORKERS = 4
+
+
+class Checkpoint:
+    __slots__ = ("name", "path", "short_hash")
+
+    def __init__(self, name, path, short_hash=None):
+        self.name = name
+        self.path = path
+        self.short_hash = short_hash
+
+
+def list_checkpoints(directories=None):
+    if directories is None:
+        try:
+            from modules import sd_models
+            if sd_models.checkpoints_list:
+                return [Checkpoint(info.name, info.filename, getattr(info, "shorthash", None)) for info in sd_models.checkpoints_list.values()]
+        except Exception:
+            pass
+
+    checkpoints = {}
+    for directory in (directories or hashing.get_model_directories()):
+        for root, _, filenames in os.walk(directory):
+            for filename in filenames:
+                if filename.lower().endswith(CHECKPOINT_EXTENSIONS):
+                    path = os.path.join(root, filename)
+                    checkpoints.setdefault(os.path.realpath(path), Checkpoint(os.path.relpath(path, directory), path))
+    return list(checkpoints.values())
+
+
+def get_checkpoint_short_hash(checkpoint):
+    if checkpoint.short_hash:
+        return checkpoint.short_hash
+    match = re.search(r'\[(.*?)\]', checkpoint.name)
+    if match:
+        return match.group(1)
+    return hash_cache.get_sha256(checkpoint.path, f"checkpoint/{checkpoint.name}")[:10]
+
+
+class LibrarySyncJob:
+    def __init__(self, checkpoints, model_info_store, client=None, max_workers=DEFAULT_MAX_WORKERS, download_thumbnails=True):
+        self.checkpoints = list(checkpoints)
+        self.model_info_store = model_info_store
+        self.client = client or CivitaiClient()
+        self.max_workers = max_workers
+        self.download_thumbnails = download_thumbnails
+        self.results = {}
+        self.errors = {}
+        self.started_at = None
+        self.finished_at = None
+        self.cancelled = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def sync_checkpoint(self, checkpoint):
+        if self.cancelled.is_set():
+            return "cancelled"
+
+        short_hash = get_checkpoint_short_hash(checkpoint)
+        data = self.client.get_model_version_by_hash(short_hash)
+        if not data.get("modelId"):
+            return "not found on Civitai"
+
+        model_url, trigger_words, first_image_url = self.client.get_model_url_trigger_words_and_first_image_url_from_hash(short_hash, data)
+        full_presets_file = self.client.get_model_presets_from_civitai_model_url(model_url)
+
+        thumbnail_path = thumbnails.get_thumbnail_path_for_checkpoint(checkpoint.path)
+        if self.download_thumbnails and first_image_url and not os.path.exists(thumbnail_path):
+            thumbnails.thumbnail_service.download(self.client, first_image_url, thumbnail_path).result()
+
+        # Civitai's copy is merged into the local one, a model whose download didn't change since last time isn't written at all
+        result = model_info_merge.merge_downloaded_model_info(self.model_info_store.get(short_hash), model_url, trigger_words, full_presets_file)
+        if result.changed:
+            self.model_info_store.put(short_hash, result.model_info)
+        return result.get_summary_text()
+
+    def run(self, progress_callback=None):
+        self.started_at = time.monotonic()
+        with futures.ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="model_preset_manager_sync") as executor:
+            jobs = {executor.submit(self.sync_checkpoint, checkpoint): checkpoint for checkpoint in self.checkpoints}
+            for job in futures.as_completed(jobs):
+                checkpoint = jobs[job]
+                with self.lock:
+                    try:
+                        self.results[checkpoint.name] = job.result()
+                    except Exception as e:
+                        self.errors[checkpoint.name] = str(e)
+                if progress_callback:
+                    progress_callback(self)
+        self.model_info_store.flush()
+        self.finished_at = time.monotonic()
+        return self.results
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="model_preset_manager_library_sync", daemon=True)
+        self.thread.start()
+        return self
+
+    def cancel(self):
+        self.cancelled.set()
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    @property
+    def done_count(self):
+        with self.lock:
+            return len(self.results) + len(self.errors)
+
+    def get_status_text(self):
+        with self.lock:
+            done_count = len(self.results) + len(self.errors)
+            elapsed = ((self.finished_at or time.monotonic()) - self.started_at) if self.started_at else 0.0
+            lines = [f"{done_count}/{len(self.checkpoints)} models synced in {elapsed:.1f}s, {len(self.errors)} errors"]
+            lines += [f"{name}: {result}" for name, result in self.results.items()]
+            lines += [f"{name}: error: {error}" for name, error in self.errors.items()]
+        return "\n".join(lines)
@@ -0,0 +1,276 @@
+import cProfile
+import functools
+import inspect
+import io
+import json
+import os
+import pstats
+import threading
+import time
+
+from contextlib import contextmanager
+
+from model_preset_manager import paths
+
+METRIC_PREFIX = "model_preset_manager"
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRICS_LOG_FILE_NAME = "metrics.jsonl"
+PROFILE_DIRECTORY_NAME = "profiles"
+PROFILE_TOP_FUNCTIONS = 30
+
+
+class Timing:
+    __slots__ = ("count", "errors", "total", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(DURATION_BUCKETS)
+
+    def add(self, seconds, failed):
+        self.count += 1
+        self.errors += failed
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        for index, bound in enumerate(DURATION_BUCKETS):
+            if seconds <= bound:
+                self.buckets[index] += 1
+                break
+
+
+def get_key(name, labels):
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def format_labels(labels, extra=()):
+    labels = list(labels) + list(extra)
+    if not labels:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timings = {}
+        self.counters = {}
+        self.started_at = time.time()
+        self.log_file = None
+        self.profile_requested = False
+        self.last_profile = None
+
+    def increment(self, name, value=1, **labels):
+        key = get_key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def record(self, name, seconds, failed=False, **labels):
+        key = get_key(name, labels)
+        with self.lock:
+            timing = self.timings.get(key)
+            if timing is None:
+                timing = self.timings[key] = Timing()
+            timing.add(seconds, failed)
+            if self.log_file is not None:
+                self.log_file.write(json.dumps(dict(labels, time=round(time.time(), 3), span=name, seconds=round(seconds, 6), error=failed)) + "\n")
+
+    @contextmanager
+    def span(self, name, **labels):
+        start = time.perf_counter()
+        failed = True
+        try:
+            yield
+            failed = False
+        except GeneratorExit:
+            # A generator handler that is closed early was stopped, it didn't fail
+            failed = False
+            raise
+        finally:
+            self.record(name, time.perf_counter() - start, failed, **labels)
+
+    def instrument_handler(self, function, name=None):
+        # Gradio inspects the handler's signature and whether it is a generator, functools.wraps and a matching wrapper keep both
+        name = name or function.__name__
+        if inspect.isgeneratorfunction(function):
+            @functools.wraps(function)
+            def generator_wrapper(*args, **kwargs):
+                with self.span("handler", handler=name):
+                    yield from self.profile_iteration(name, function(*args, **kwargs))
+            return generator_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with self.span("handler", handler=name), self.profile(name):
+                return function(*args, **kwargs)
+        return wrapper
+
+    def request_profile(self):
+        with self.lock:
+            self.profile_requested = True
+
+    def take_profile_request(self):
+        # Only the one call after request_profile() is profiled, everything else pays a single flag check
+        with self.lock:
+            requested = self.profile_requested
+            self.profile_requested = False
+        return requested
+
+    def enable_profiler(self, name, profiler):
+        try:
+            profiler.enable()
+        except ValueError as e:
+            print(f"could not profile {name}: {e}")
+            return False
+        return True
+
+    @contextmanager
+    def profile(self, name):
+        if not self.take_profile_request():
+            yield
+            return
+
+        profiler = cProfile.Profile()
+        if not self.enable_profiler(name, profiler):
+            yield
+            return
+        try:
+            yield
+        finally:
+            profiler.disable()
+            self.save_profile(name, profiler)
+
+    def profile_iteration(self, name, iterator):
+        # Gradio can run each step of a generator handler on a different thread, so the profiler is switched on around every step and saved once at the end
+        if not self.take_profile_request():
+            yield from iterator
+            return
+
+        profiler = cProfile.Profile()
+        try:
+            while True:
+                if not self.enable_profiler(name, profiler):
+                    yield from iterator
+                    return
+                try:
+                    value = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    profiler.disable()
+                yield value
+            self.save_profile(name, profiler)
+        finally:
+            iterator.close()
+
+    def save_profile(self, name, profiler):
+        directory = os.path.join(paths.CACHE_DIRECTORY, PROFILE_DIRECTORY_NAME)
+        os.makedirs(directory, exist_ok=True)
+        profile_path = os.path.join(directory, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.prof")
+        profiler.dump_stats(profile_path)
+        text = io.StringIO()
+        pstats.Stats(profiler, stream=text).sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+        with self.lock:
+            self.last_profile = (profile_path, text.getvalue())
+
+    def get_last_profile(self):
+        with self.lock:
+            return self.last_profile
+
+    def enable_log(self, path=None):
+        log_file = open(path or paths.get_cache_file_path(METRICS_LOG_FILE_NAME), "a", buffering=1)
+        with self.lock:
+            previous_log_file, self.log_file = self.log_file, log_file
+        if previous_log_file is not None:
+            previous_log_file.close()
+
+    def disable_log(self):
+        with self.lock:
+            log_file, self.log_file = self.log_file, None
+        if log_file is not None:
+            log_file.close()
+
+    def reset(self):
+        with self.lock:
+            self.timings = {}
+            self.counters = {}
+            self.started_at = time.time()
+
+    def snapshot(self):
+        with self.lock:
+            timings = [(key, timing.count, timing.errors, timing.total, timing.max, list(timing.buckets)) for key, timing in self.timings.items()]
+            counters = list(self.counters.items())
+        return sorted(timings), sorted(counters)
+
+    def to_dict(self):
+        timings, counters = self.snapshot()
+        return {
+            "uptime_seconds": round(time.time() - self.started_at, 3),
+            "timings": [
+                {"name": name, "labels": dict(labels), "count": count, "errors": errors, "total_seconds": total, "mean_seconds": total / count if count else 0.0, "max_seconds": maximum}
+                for (name, labels), count, errors, total, maximum, _ in timings
+            ],
+            "counters": [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in counters],
+        }
+
+    def to_prometheus(self):
+        timings, counters = self.snapshot()
+        lines = []
+        family = None
+        for (name, labels), count, errors, total, _, buckets in timings:
+            metric = f"{METRIC_PREFIX}_{name}_seconds"
+            if name != family:
+                family = name
+                lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(DURATION_BUCKETS, buckets):
+                cumulative += bucket_count
+                lines.append(f"{metric}_bucket{format_labels(labels, [('le', str(bound))])} {cumulative}")
+            lines.append(f"{metric}_bucket{format_labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{metric}_sum{format_labels(labels)} {total:.6f}")
+            lines.append(f"{metric}_count{format_labels(labels)} {count}")
+        family = None
+        for (name, labels), count, errors, _, _, _ in timings:
+            metric = f"{METRIC_PREFIX}_{name}_errors_total"
+            if name != family:
+                family = name
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{format_labels(labels)} {errors}")
+        family = None
+        for (name, labels), value in counters:
+            metric = f"{METRIC_PREFIX}_{name}_total"
+            if name != family:
+                family = name
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def get_summary_text(self):
+        timings, counters = self.snapshot()
+        lines = [f"{'span':<40} {'count':>7} {'errors':>6} {'total':>9} {'mean':>9} {'max':>9}"]
+        # Where the time went comes first
+        for (name, labels), count, errors, total, maximum, _ in sorted(timings, key=lambda timing: -timing[3]):
+            label = name + "".join(f" {value}" for _, value in labels)
+            lines.append(f"{label:<40} {count:>7} {errors:>6} {total:>8.3f}s {total / count * 1000:>7.1f}ms {maximum * 1000:>7.1f}ms")
+        for (name, labels), value in counters:
+            label = name + "".join(f" {key}={label_value}" for key, label_value in labels)
+            lines.append(f"{label:<40} {value:>7}")
+        return "\n".join(lines)
+
+
+metrics = Metrics()
+
+
+def span(name, **labels):
+    return metrics.span(name, **labels)
+
+
+def increment(name, value=1, **labels):
+    metrics.increment(name, value, **labels)
+
+
+def instrument_handler(function, name=None):
+    return metrics.instrument_handler(function, name)
@@ -0,0 +1,52 @@
+# What Civitai sent on the last download, the base for merging the next one
+REMOTE_BASE_KEY = "remote_base"
+
+
+def empty_model_info():
+    return  {
+                "url": "",
+                "default_preset" : "default",
+                "trigger_words": [],
+                "presets": {"default": ""}
+            }
+
+
+def update_default_preset(model_info):
+    default_preset_name = model_info.get("default_preset", "default") or "default"
+    presets = model_info.get("presets", {})
+
+    if default_preset_name not in presets:
+        if presets:
+            first_preset_name = next(iter(presets.keys()))
+            model_info["default_preset"] = first_preset_name
+        else:
+            model_info["default_preset"] = "default"
+            model_info["presets"]["default"] = ""
+
+    return model_info
+
+
+def get_default_preset(model_info):
+    default_preset_name = model_info.get("default_preset", "default")
+
+    if default_preset_name == "" or default_preset_name is None:
+        default_preset_name = "default"
+
+    presets = model_info.get("presets", {})
+
+    if default_preset_name in presets:
+        return default_preset_name, presets[default_preset_name]
+    elif len(presets) > 0:
+        first_preset_name, first_preset_value = next(iter(presets.items()))
+        return first_preset_name, first_preset_value
+    else:
+        return "default", ""
+
+
+def validate_model_info(model_info):
+    required_keys = ["url", "default_preset", "trigger_words", "presets"]
+    return model_info and all(key in model_info for key in required_keys)
+
+
+def strip_remote_base(model_info):
+    return {key: value for key, value in model_info.items() if key != REMOTE_BASE_KEY}
@@ -0,0 +1,161 @@
+import copy
+import json
+
+from model_preset_manager.generation_parameters import FIELDS, GenerationParameters, get_text_hash, parse_generation_parameters, update_preset_parameters
+from model_preset_manager.model_info import REMOTE_BASE_KEY, empty_model_info, update_default_preset, validate_model_info
+
+SCALAR_KEYS = ("url", "default_preset")
+# Size is one parameter in infotext, so width and height are merged together
+PARAMETER_GROUPS = [(field,) for field in FIELDS if field not in ("width", "height", "extras")] + [("width", "height")]
+
+
+class MergeResult:
+    __slots__ = ("model_info", "changed", "applied", "conflicts")
+
+    def __init__(self, model_info, changed=False, applied=None, conflicts=None):
+        self.model_info = model_info
+        self.changed = changed
+        self.applied = applied or []
+        self.conflicts = conflicts or []
+
+    def get_summary_text(self):
+        if not self.changed:
+            return "up to date"
+        text = f"{len(self.applied)} changes from Civitai" if self.applied else "no changes from Civitai"
+        if self.conflicts:
+            text += f", kept local for {len(self.conflicts)} conflicts: {'; '.join(self.conflicts)}"
+        return text
+
+
+def get_content_hash(data):
+    return get_text_hash(json.dumps(data, sort_keys=True, separators=(",", ":")))
+
+
+def get_remote_snapshot(model_url, trigger_words, full_presets_file):
+    # Only what Civitai actually provided is part of the snapshot, so keys it doesn't know about are never merged
+    remote = {"url": model_url or "", "trigger_words": list(trigger_words or [])}
+    if validate_model_info(full_presets_file):
+        remote.update({key: copy.deepcopy(full_presets_file[key]) for key in ("url", "default_preset", "trigger_words", "presets")})
+    remote["content_hash"] = get_content_hash(remote)
+    return remote
+
+
+def get_base(model_info):
+    # Without a snapshot the base is what an empty model info holds, so the first download fills in whatever is still untouched
+    base = dict(empty_model_info(), presets={})
+    base.update(model_info.get(REMOTE_BASE_KEY) or {})
+    return base
+
+
+def get_preset_hashes(presets):
+    # An empty preset counts as no preset, so the placeholder default preset never conflicts with a downloaded one
+    return {preset_name: get_text_hash(text) for preset_name, text in presets.items() if text}
+
+
+def merge_values(base, local, remote):
+    # Returns the merged value and whether both sides changed it differently, local wins those
+    if remote == base or local == remote:
+        return local, False
+    if local == base:
+        return remote, False
+    return local, True
+
+
+def merge_trigger_words(base, local, remote):
+    removed = set(base) - set(remote)
+    merged = [word for word in local if word not in removed]
+    merged += [word for word in remote if word not in base and word not in merged]
+    return merged
+
+
+def merge_preset_text(base_text, local_text, remote_text):
+    # Each parameter is merged on its own, so a new sampler from Civitai and a local prompt edit both survive
+    base = parse_generation_parameters(base_text)
+    local = parse_generation_parameters(local_text)
+    remote = parse_generation_parameters(remote_text)
+    merged = local.copy()
+    conflicts = []
+    for fields in PARAMETER_GROUPS:
+        value, conflict = merge_values(*(tuple(getattr(parameters, field) for field in fields) for parameters in (base, local, remote)))
+        for field, field_value in zip(fields, value):
+            setattr(merged, field, field_value)
+        if conflict:
+            conflicts.append("size" if fields == ("width", "height") else fields[0])
+    for key in dict.fromkeys(list(base.extras) + list(local.extras) + list(remote.extras)):
+        value, conflict = merge_values(base.extras.get(key), local.extras.get(key), remote.extras.get(key))
+        if value is None:
+            merged.extras.pop(key, None)
+        else:
+            merged.extras[key] = value
+        if conflict:
+            conflicts.append(key)
+    if merged == local:
+        return local_text, conflicts
+    return GenerationParameters(*merged.get_values()).to_infotext(), conflicts
+
+
+def merge_presets(base_presets, local_presets, remote_presets, applied, conflicts):
+    base_hashes = get_preset_hashes(base_presets)
+    local_hashes = get_preset_hashes(local_presets)
+    remote_hashes = get_preset_hashes(remote_presets)
+    merged = dict(local_presets)
+    for preset_name in dict.fromkeys(list(base_hashes) + list(remote_hashes)):
+        base_hash, local_hash, remote_hash = base_hashes.get(preset_name), local_hashes.get(preset_name), remote_hashes.get(preset_name)
+        if remote_hash == base_hash or local_hash == remote_hash:
+            continue
+        if local_hash == base_hash:
+            if remote_hash is None:
+                merged.pop(preset_name, None)
+                applied.append(f"removed preset {preset_name}")
+            else:
+                merged[preset_name] = remote_presets[preset_name]
+                applied.append(f"{'updated' if local_hash else 'added'} preset {preset_name}")
+            continue
+        if local_hash is None or remote_hash is None:
+            conflicts.append(f"preset {preset_name} was {'deleted' if local_hash is None else 'edited'} here and {'deleted' if remote_hash is None else 'edited'} on Civitai")
+            continue
+        text, parameter_conflicts = merge_preset_text(base_presets.get(preset_name, ""), local_presets[preset_name], remote_presets[preset_name])
+        if text != local_presets[preset_name]:
+            merged[preset_name] = text
+            applied.append(f"merged preset {preset_name}")
+        if parameter_conflicts:
+            conflicts.append(f"preset {preset_name}: {', '.join(parameter_conflicts)}")
+    return merged
+
+
+def merge_model_info(local, remote):
+    # Three-way merge of what Civitai sent (remote) into the local model info, using the snapshot stored by the last download as the base
+    base_snapshot = local.get(REMOTE_BASE_KEY)
+    if base_snapshot and base_snapshot.get("content_hash") == remote["content_hash"]:
+        return MergeResult(local)
+
+    base = get_base(local)
+    merged = copy.deepcopy(local)
+    applied = []
+    conflicts = []
+    for key in SCALAR_KEYS:
+        if key in remote:
+            value, conflict = merge_values(base.get(key), local.get(key), remote[key])
+            if value != local.get(key):
+                merged[key] = value
+                applied.append(f"{key.replace('_', ' ')} set to {value}")
+            if conflict:
+                conflicts.append(key.replace("_", " "))
+    if "trigger_words" in remote:
+        trigger_words = merge_trigger_words(base.get("trigger_words", []), local.get("trigger_words", []), remote["trigger_words"])
+        if trigger_words != local.get("trigger_words"):
+            merged["trigger_words"] = trigger_words
+            applied.append("trigger words updated")
+    if "presets" in remote:
+        merged["presets"] = merge_presets(base.get("presets", {}), local.get("presets", {}), remote["presets"], applied, conflicts)
+        # The empty placeholder preset of a new model info makes way for downloaded presets
+        if merged["presets"].get("default") == "" and len(merged["presets"]) > 1 and merged.get("default_preset") != "default":
+            del merged["presets"]["default"]
+
+    merged[REMOTE_BASE_KEY] = remote
+    update_preset_parameters(update_default_preset(merged))
+    return MergeResult(merged, True, applied, conflicts)
+
+
+def merge_downloaded_model_info(model_info, model_url, trigger_words, full_presets_file):
+    return merge_model_info(model_info, get_remote_snapshot(model_url, trigger_words, full_presets_file))
@@ -0,0 +1,227 @@
+import atexit
+import contextlib
+import copy
+import threading
+import time
+
+from collections import OrderedDict
+
+MAX_CACHED_MODEL_INFOS = 128
+FLUSH_DELAY = 1.0
+# A steady stream of saves keeps pushing the flush back, this is as long as a change waits
+MAX_FLUSH_DELAY = 5.0
+REVALIDATE_INTERVAL = 1.0
+
+
+class CachedModelInfo:
+    __slots__ = ("model_info", "version", "checked_at")
+
+    def __init__(self, model_info, version):
+        self.model_info = model_info
+        self.version = version
+        self.checked_at = time.monotonic()
+
+
+def rebase_changes(base, local, current):
+    # Replays what changed from base to local on top of current, one level into nested dicts, so two saves of different presets both survive
+    result = copy.deepcopy(current)
+    for key in list(local) + [key for key in base if key not in local]:
+        if key not in local:
+            result.pop(key, None)
+            continue
+        value = local[key]
+        base_value = base.get(key)
+        if key in base and value == base_value:
+            continue
+        if isinstance(value, dict) and isinstance(base_value, dict) and isinstance(result.get(key), dict):
+            nested = result[key]
+            for name in list(value) + [name for name in base_value if name not in value]:
+                if name not in value:
+                    nested.pop(name, None)
+                elif name not in base_value or value[name] != base_value[name]:
+                    nested[name] = copy.deepcopy(value[name])
+        else:
+            result[key] = copy.deepcopy(value)
+    return result
+
+
+class ModelInfoStore:
+    def __init__(self, backend, empty_model_info, max_entries=MAX_CACHED_MODEL_INFOS, flush_delay=FLUSH_DELAY, revalidate_interval=REVALIDATE_INTERVAL, max_flush_delay=MAX_FLUSH_DELAY):
+        self.backend = backend
+        self.empty_model_info = empty_model_info
+        self.max_entries = max_entries
+        self.flush_delay = flush_delay
+        self.max_flush_delay = max_flush_delay
+        self.revalidate_interval = revalidate_interval
+        self.entries = OrderedDict()
+        self.dirty = {}
+        self.bases = {}
+        self.lock = threading.RLock()
+        self.flush_timer = None
+        self.flush_deadline = None
+        # Called with the model hash after each write, so indexes over the stored files can catch up right away
+        self.write_callbacks = []
+        self.stats = {"hits": 0, "misses": 0, "reads": 0, "writes": 0, "flushes": 0, "invalidations": 0, "conflicts": 0}
+        atexit.register(self.flush)
+
+    def read(self, model_hash):
+        result = self.backend.read(model_hash)
+        if result is None:
+            return None
+        self.stats["reads"] += 1
+        return CachedModelInfo(*result)
+
+    def is_fresh(self, model_hash, cached):
+        # Pending writes are newer than whatever is on disk
+        if model_hash in self.dirty:
+            return True
+        now = time.monotonic()
+        if now - cached.checked_at < self.revalidate_interval:
+            return True
+        if self.backend.get_version(model_hash) != cached.version:
+            self.stats["invalidations"] += 1
+            return False
+        cached.checked_at = now
+        return True
+
+    def remember(self, model_hash, cached):
+        self.entries[model_hash] = cached
+        self.entries.move_to_end(model_hash)
+        while len(self.entries) > self.max_entries:
+            oldest_hash = next(iter(self.entries))
+            if oldest_hash in self.dirty:
+                self.write(oldest_hash)
+            del self.entries[oldest_hash]
+
+    def get(self, model_hash, create_if_missing=True):
+        with self.lock:
+            cached = self.entries.get(model_hash)
+            if cached is not None and self.is_fresh(model_hash, cached):
+                self.stats["hits"] += 1
+                self.entries.move_to_end(model_hash)
+                return copy.deepcopy(cached.model_info)
+
+            self.stats["misses"] += 1
+            cached = self.read(model_hash)
+            if cached is None:
+                if not create_if_missing:
+                    return self.empty_model_info()
+                self.put(model_hash, self.empty_model_info())
+                self.write(model_hash)
+                return self.empty_model_info()
+
+            self.remember(model_hash, cached)
+            return copy.deepcopy(cached.model_info)
+
+    def put(self, model_hash, model_info):
+        with self.lock:
+            model_info = copy.deepcopy(model_info)
+            cached = self.entries.get(model_hash)
+            version = cached.version if cached else None
+            # The copy this change was based on, a write only replaces the file if it still holds that version
+            if model_hash not in self.dirty and cached is not None and version is not None:
+                self.bases[model_hash] = cached
+            self.dirty[model_hash] = model_info
+            # Scheduled first, evicting an older change can fail its write and this one still has to be flushed
+            self.schedule_flush()
+            self.remember(model_hash, CachedModelInfo(model_info, version))
+
+    @contextlib.contextmanager
+    def edit(self, model_hash):
+        # Read, modify and write back under the lock so concurrent handlers can't drop each other's changes
+        with self.lock:
+            model_info = self.get(model_hash)
+            yield model_info
+            self.put(model_hash, model_info)
+
+    def exists(self, model_hash):
+        with self.lock:
+            return model_hash in self.dirty or self.backend.exists(model_hash)
+
+    def invalidate(self, model_hash=None):
+        with self.lock:
+            if model_hash is None:
+                self.entries = OrderedDict((h, c) for h, c in self.entries.items() if h in self.dirty)
+            elif model_hash not in self.dirty:
+                self.entries.pop(model_hash, None)
+
+    def revalidate(self, model_hash):
+        # Drops the cached copy only if the file changed behind our back, our own writes keep theirs
+        with self.lock:
+            cached = self.entries.get(model_hash)
+            if cached is None or model_hash in self.dirty:
+                return False
+            if self.backend.get_version(model_hash) == cached.version:
+                return False
+            del self.entries[model_hash]
+            self.stats["invalidations"] += 1
+            return True
+
+    def write(self, model_hash):
+        # The change stays pending until the backend has it, so a failed write can be tried again
+        model_info = self.dirty[model_hash]
+        base = self.bases.get(model_hash)
+        rebased = []
+
+        def rebase(current_model_info):
+            # Another process saved this model since it was read, so our changes are applied to its copy instead of overwriting it
+            rebased.append(rebase_changes(base.model_info, model_info, current_model_info))
+            return rebased[0]
+
+        version = self.backend.write(model_hash, model_info, base.version if base is not None else None, rebase)
+        del self.dirty[model_hash]
+        self.bases.pop(model_hash, None)
+        self.stats["writes"] += 1
+        self.stats["conflicts"] += len(rebased)
+        cached = self.entries.get(model_hash)
+        if cached is not None:
+            cached.model_info = rebased[0] if rebased else model_info
+            cached.version = version
+            cached.checked_at = time.monotonic()
+        for callback in self.write_callbacks:
+            callback(model_hash)
+
+    def schedule_flush(self):
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+        now = time.monotonic()
+        if self.flush_deadline is None:
+            self.flush_deadline = now + self.max_flush_delay
+        self.flush_timer = threading.Timer(max(0.0, min(self.flush_delay, self.flush_deadline - now)), self.flush_in_background)
+        self.flush_timer.daemon = True
+        self.flush_timer.start()
+
+    def flush(self):
+        with self.lock:
+            if self.flush_timer is not None:
+                self.flush_timer.cancel()
+                self.flush_timer = None
+            self.flush_deadline = None
+            if not self.dirty:
+                return
+            errors = []
+            for model_hash in list(self.dirty):
+                try:
+                    self.write(model_hash)
+                except Exception as e:
+                    errors.append(e)
+            self.stats["flushes"] += 1
+            if errors:
+                # Whatever failed is still pending and gets another try
+                self.schedule_flush()
+                raise errors[0]
+
+    def flush_in_background(self):
+        # Nobody waits on the timer thread, so a failed flush is reported here instead of vanishing with the thread
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"could not save model info: {e}")
+
+    def list_hashes(self):
+        with self.lock:
+            return sorted(set(self.backend.list_hashes()) | set(self.dirty))
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats, cached=len(self.entries), dirty=len(self.dirty))
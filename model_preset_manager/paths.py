@@ -0,0 +1,12 @@
+import os
+
+EXTENSION_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPTS_DIRECTORY = os.path.join(EXTENSION_DIRECTORY, "scripts")
+MODEL_PRESETS_DIRECTORY = os.path.join(SCRIPTS_DIRECTORY, "model presets")
+MODEL_PRESETS_DATABASE_PATH = os.path.join(SCRIPTS_DIRECTORY, "model presets.sqlite3")
+CACHE_DIRECTORY = os.path.join(EXTENSION_DIRECTORY, "cache")
+
+
+def get_cache_file_path(name):
+    os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+    return os.path.join(CACHE_DIRECTORY, name)
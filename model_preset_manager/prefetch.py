@@ -0,0 +1,97 @@
+import json
+import os
+import threading
+
+from concurrent import futures
+
+from model_preset_manager import paths
+
+RECENT_CHECKPOINTS_FILE_NAME = "recent_checkpoints.json"
+MAX_RECENT_CHECKPOINTS = 20
+DEFAULT_RECENT_PREFETCH_COUNT = 0
+
+
+class RecentCheckpoints:
+    def __init__(self, path=None, max_entries=MAX_RECENT_CHECKPOINTS):
+        # The cache folder is only made on the first save, so creating this at import leaves nothing behind
+        self.path = path or os.path.join(paths.CACHE_DIRECTORY, RECENT_CHECKPOINTS_FILE_NAME)
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.names = self.load()
+
+    def load(self):
+        try:
+            with open(self.path, "r") as file:
+                names = json.load(file)
+        except (OSError, ValueError):
+            return []
+        return [name for name in names if isinstance(name, str)][:self.max_entries]
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w") as file:
+            json.dump(self.names, file)
+        os.replace(temporary_path, self.path)
+
+    def touch(self, name):
+        with self.lock:
+            if self.names and self.names[0] == name:
+                return
+            self.names = [name] + [other for other in self.names if other != name][:self.max_entries - 1]
+            try:
+                self.save()
+            except OSError as e:
+                print(f"could not save recent checkpoints: {e}")
+
+    def get(self, count=MAX_RECENT_CHECKPOINTS):
+        with self.lock:
+            return self.names[:count]
+
+
+class Prefetcher:
+    # One worker, so prefetching never competes with generation for more than a single core and disk stream
+    def __init__(self, warm_function, max_workers=1):
+        self.warm_function = warm_function
+        self.executor = futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="model_preset_manager_prefetch")
+        self.pending = {}
+        self.ready = {}
+        self.lock = threading.Lock()
+
+    def prefetch(self, model_filename):
+        with self.lock:
+            future = self.pending.get(model_filename)
+            if future is None:
+                future = self.executor.submit(self.warm, model_filename)
+                self.pending[model_filename] = future
+        return future
+
+    def prefetch_all(self, model_filenames):
+        return [self.prefetch(model_filename) for model_filename in dict.fromkeys(model_filenames) if model_filename]
+
+    def warm(self, model_filename):
+        try:
+            result = self.warm_function(model_filename)
+            with self.lock:
+                self.ready[model_filename] = result
+            return result
+        except Exception as e:
+            print(f"could not prefetch model info for {model_filename}: {e}")
+        finally:
+            with self.lock:
+                self.pending.pop(model_filename, None)
+
+    def get_ready(self, model_filename):
+        with self.lock:
+            return self.ready.get(model_filename)
+
+    def wait(self, model_filename, timeout=None):
+        # A prefetch already in flight is joined instead of doing the same hashing and downloads twice
+        with self.lock:
+            future = self.pending.get(model_filename)
+        if future is not None:
+            try:
+                future.result(timeout)
+            except futures.TimeoutError:
+                pass
+        return self.get_ready(model_filename)
@@ -0,0 +1,89 @@
+import codecs
+import html
+import json
+import re
+
+CIVITAI_MODEL_DESCRIPTION_PRESET_PREFIX = '###ModelPresets###'
+# Presets files are tiny, anything this big after a '{' isn't one
+MAX_PRESETS_LENGTH = 4 * 1024 * 1024
+# The longest token a chunk can end inside and still fail to decode, a \uXXXX escape or "false" fall well within it
+TRUNCATED_TOKEN_LENGTH = 8
+HTML_TAG_PATTERN = re.compile(r'<[^>]*>')
+
+
+def is_truncated(error, length):
+    return error.msg.startswith("Unterminated") or error.pos >= length - TRUNCATED_TOKEN_LENGTH
+
+
+class PresetExtractor:
+    def __init__(self, marker=CIVITAI_MODEL_DESCRIPTION_PRESET_PREFIX):
+        self.marker = marker
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.buffer = ""
+        self.marker_found = False
+        self.search_position = 0
+        self.result = None
+
+    def feed(self, data):
+        if self.result is not None:
+            return self.result
+        if isinstance(data, bytes):
+            data = self.text_decoder.decode(data)
+        self.buffer += data
+
+        if not self.marker_found:
+            marker_index = self.buffer.find(self.marker)
+            if marker_index == -1:
+                # Keep just enough of the tail to catch a marker split across chunks
+                self.buffer = self.buffer[-(len(self.marker) - 1):]
+                return None
+            self.buffer = self.buffer[marker_index + len(self.marker):]
+            self.marker_found = True
+
+        return self.scan(final=False)
+
+    def finish(self):
+        if self.result is None and self.marker_found:
+            self.buffer += self.text_decoder.decode(b"", final=True)
+            self.scan(final=True)
+        return self.result
+
+    def scan(self, final):
+        while True:
+            start = self.buffer.find('{', self.search_position)
+            if start == -1:
+                self.search_position = len(self.buffer)
+                return None
+            try:
+                candidate, _ = self.decoder.raw_decode(self.buffer, start)
+            except json.JSONDecodeError as e:
+                # A chunk can end inside any token (an escape, true, null...), only those errors at the end of the buffer wait for more data
+                if not final and is_truncated(e, len(self.buffer)) and len(self.buffer) - start < MAX_PRESETS_LENGTH:
+                    self.search_position = start
+                    return None
+                self.search_position = start + 1
+                continue
+            if isinstance(candidate, dict):
+                self.result = candidate
+                return candidate
+            self.search_position = start + 1
+
+
+def extract_presets_from_chunks(chunks, marker=CIVITAI_MODEL_DESCRIPTION_PRESET_PREFIX):
+    extractor = PresetExtractor(marker)
+    for chunk in chunks:
+        if extractor.feed(chunk) is not None:
+            return extractor.result
+    return extractor.finish()
+
+
+def extract_presets_from_text(text, marker=CIVITAI_MODEL_DESCRIPTION_PRESET_PREFIX):
+    return extract_presets_from_chunks([text], marker)
+
+
+def extract_presets_from_description(description_html, marker=CIVITAI_MODEL_DESCRIPTION_PRESET_PREFIX):
+    # The API returns the description as rendered html, tags come out before entities are decoded
+    if not description_html or marker not in description_html:
+        return None
+    return extract_presets_from_text(html.unescape(HTML_TAG_PATTERN.sub('', description_html)), marker)
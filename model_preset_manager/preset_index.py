@@ -0,0 +1,303 @@
+import atexit
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+from model_preset_manager import paths
+from model_preset_manager.generation_parameters import format_number, parse_generation_parameters
+
+PRESET_INDEX_FILE_NAME = "preset_index_{backend}.json"
+PRESET_INDEX_FORMAT_VERSION = 1
+REFRESH_INTERVAL = 2.0
+SAVE_DELAY = 5.0
+DEFAULT_SEARCH_LIMIT = 100
+PROMPT_PREVIEW_LENGTH = 120
+
+TOKEN_PATTERN = re.compile(r'[\w.+\-]+')
+QUERY_TERM_PATTERN = re.compile(r'(\w+):"([^"]*)"|(\w+):(\S+)|"([^"]*)"|(\S+)')
+# Filter name and the document summary field it is compared against
+QUERY_FILTERS = {
+    "sampler": "sampler",
+    "steps": "steps",
+    "cfg": "cfg_scale",
+    "size": "size",
+    "seed": "seed",
+    "clip": "clip_skip",
+    "model": "model_hash",
+    "preset": "preset_name",
+    "trigger": "trigger_words",
+}
+SUBSTRING_FILTERS = ("sampler", "preset_name", "trigger_words")
+NUMERIC_FILTERS = ("steps", "cfg_scale", "seed", "clip_skip")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(str(text).lower())
+
+
+def build_preset_document(model_hash, preset_name, generation_data, trigger_words):
+    parameters = parse_generation_parameters(generation_data)
+    summary = {
+        "model_hash": model_hash,
+        "preset_name": preset_name,
+        "sampler": parameters.sampler or "",
+        "steps": parameters.steps,
+        "cfg_scale": parameters.cfg_scale,
+        "size": f"{parameters.width}x{parameters.height}" if parameters.width is not None and parameters.height is not None else "",
+        "seed": parameters.seed,
+        "clip_skip": parameters.clip_skip,
+        "prompt": (parameters.prompt or "")[:PROMPT_PREVIEW_LENGTH],
+    }
+    searchable = [preset_name, parameters.prompt, parameters.negative_prompt or "", " ".join(trigger_words)]
+    searchable += [format_number(value) for value in parameters.get_parameters().values()]
+    return {"summary": summary, "tokens": sorted(set(tokenize(" ".join(searchable))))}
+
+
+def build_model_entry(model_hash, model_info, version):
+    trigger_words = [word for word in model_info.get("trigger_words", []) if word]
+    documents = [build_preset_document(model_hash, preset_name, generation_data or "", trigger_words) for preset_name, generation_data in model_info.get("presets", {}).items()]
+    return {"version": version, "url": model_info.get("url", ""), "trigger_words": trigger_words, "documents": documents}
+
+
+def normalize_number(value):
+    # Documents index numbers through format_number, so 7.0 and 7.00 have to become the same "7" token
+    try:
+        return format_number(float(value))
+    except ValueError:
+        return value
+
+
+def parse_query(query):
+    terms = []
+    filters = []
+    for filter_name, quoted_value, filter_name_plain, value, phrase, word in QUERY_TERM_PATTERN.findall(query or ""):
+        filter_name = (filter_name or filter_name_plain).lower()
+        if filter_name in QUERY_FILTERS:
+            field = QUERY_FILTERS[filter_name]
+            value = (quoted_value or value).lower()
+            if field in NUMERIC_FILTERS:
+                value = normalize_number(value)
+            filters.append((field, value))
+            # Filter values are indexed too, so they narrow the candidates before the exact comparison
+            if filter_name != "model":
+                terms += tokenize(value)
+        elif filter_name:
+            terms += tokenize(f"{filter_name}:{quoted_value or value}")
+        else:
+            terms += tokenize(phrase or word)
+    return terms, filters
+
+
+def matches_filter(summary, trigger_words, field, value):
+    if field == "trigger_words":
+        return any(value in word.lower() for word in trigger_words)
+    actual = summary.get(field)
+    if actual is None:
+        return False
+    if field in SUBSTRING_FILTERS:
+        return value in str(actual).lower()
+    if field == "model_hash":
+        return str(actual).lower().startswith(value)
+    if field in NUMERIC_FILTERS:
+        return normalize_number(actual) == value
+    return str(actual).lower() == value
+
+
+class PresetIndex:
+    def __init__(self, backend, index_file_path=None, refresh_interval=REFRESH_INTERVAL):
+        self.backend = backend
+        self.index_file_path = index_file_path or paths.get_cache_file_path(PRESET_INDEX_FILE_NAME.format(backend=backend.name))
+        self.refresh_interval = refresh_interval
+        self.lock = threading.RLock()
+        self.models = {}
+        self.postings = {}
+        self.documents = {}
+        self.next_document_id = 0
+        self.model_document_ids = {}
+        self.refreshed_at = None
+        self.stale_models = set()
+        self.dirty = False
+        self.save_timer = None
+        self.load()
+        atexit.register(self.save)
+
+    def load(self):
+        try:
+            with open(self.index_file_path, "r") as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return
+        if data.get("format_version") != PRESET_INDEX_FORMAT_VERSION:
+            return
+        with self.lock:
+            for model_hash, entry in data.get("models", {}).items():
+                self.add_model(model_hash, entry)
+
+    def save(self):
+        with self.lock:
+            if self.save_timer is not None:
+                self.save_timer.cancel()
+                self.save_timer = None
+            if not self.dirty:
+                return
+            # Model entries are replaced rather than changed, so a shallow copy is safe to write outside the lock
+            models = dict(self.models)
+            self.dirty = False
+        temporary_path = f"{self.index_file_path}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "w") as file:
+            json.dump({"format_version": PRESET_INDEX_FORMAT_VERSION, "models": models}, file, separators=(",", ":"))
+        os.replace(temporary_path, self.index_file_path)
+
+    def schedule_save(self):
+        # Writing the whole index takes a while on big libraries, so it's batched off the search path
+        if self.save_timer is not None:
+            self.save_timer.cancel()
+        self.save_timer = threading.Timer(SAVE_DELAY, self.save)
+        self.save_timer.daemon = True
+        self.save_timer.start()
+
+    def add_model(self, model_hash, entry):
+        self.remove_model(model_hash)
+        self.models[model_hash] = entry
+        document_ids = []
+        for document in entry["documents"]:
+            document_id = self.next_document_id
+            self.next_document_id += 1
+            self.documents[document_id] = (model_hash, document["summary"])
+            for token in document["tokens"]:
+                self.postings.setdefault(token, set()).add(document_id)
+            document_ids.append(document_id)
+        self.model_document_ids[model_hash] = document_ids
+
+    def remove_model(self, model_hash):
+        entry = self.models.pop(model_hash, None)
+        if entry is None:
+            return
+        for document_id, document in zip(self.model_document_ids.pop(model_hash, []), entry["documents"]):
+            del self.documents[document_id]
+            for token in document["tokens"]:
+                posting = self.postings.get(token)
+                if posting is not None:
+                    posting.discard(document_id)
+                    if not posting:
+                        del self.postings[token]
+
+    def refresh(self, force=False):
+        # Only models whose version (file mtime or database revision) changed are reindexed
+        with self.lock:
+            now = time.monotonic()
+            if not force and self.refreshed_at is not None and now - self.refreshed_at < self.refresh_interval:
+                stale_models, self.stale_models = self.stale_models, set()
+                return self.refresh_models(stale_models) if stale_models else 0
+            self.refreshed_at = now
+            self.stale_models.clear()
+            model_hashes = self.backend.list_hashes()
+            changed = 0
+            for model_hash in set(self.models) - set(model_hashes):
+                self.remove_model(model_hash)
+                changed += 1
+            changed += sum(self.refresh_model(model_hash) for model_hash in model_hashes)
+            if changed:
+                self.dirty = True
+                self.schedule_save()
+            return changed
+
+    def refresh_models(self, model_hashes):
+        # For when a file watcher already knows which models changed, nothing else is looked at
+        with self.lock:
+            changed = sum(self.refresh_model(model_hash) for model_hash in model_hashes)
+            if changed:
+                self.dirty = True
+                self.schedule_save()
+            return changed
+
+    def mark_stale(self, model_hash):
+        # Models saved in this process are reindexed by the next search, even when the refresh interval isn't up
+        with self.lock:
+            self.stale_models.add(model_hash)
+
+    def refresh_model(self, model_hash):
+        entry = self.models.get(model_hash)
+        version = self.backend.get_version(model_hash)
+        if version is None:
+            if entry is None:
+                return False
+            self.remove_model(model_hash)
+            return True
+        if entry is not None and entry["version"] == version:
+            return False
+        try:
+            result = self.backend.read(model_hash)
+        except (ValueError, TypeError) as e:
+            print(f"could not index presets for {model_hash}: {e}")
+            return False
+        if result is None:
+            return False
+        model_info, version = result
+        self.add_model(model_hash, build_model_entry(model_hash, model_info, version))
+        return True
+
+    def get_postings(self, term):
+        posting = self.postings.get(term)
+        if posting is not None:
+            return posting
+        # Partial words match every indexed token containing them
+        matched = set()
+        for token, token_posting in self.postings.items():
+            if term in token:
+                matched |= token_posting
+        return matched
+
+    def search(self, query, limit=DEFAULT_SEARCH_LIMIT, refresh=True):
+        if refresh:
+            self.refresh()
+        terms, filters = parse_query(query)
+        with self.lock:
+            postings = [self.get_postings(term) for term in dict.fromkeys(terms)]
+            for field, value in filters:
+                if field == "model_hash":
+                    postings.append({document_id for model_hash, document_ids in self.model_document_ids.items() if model_hash.lower().startswith(value) for document_id in document_ids})
+            if postings:
+                postings.sort(key=len)
+                document_ids = set(postings[0]).intersection(*postings[1:])
+            else:
+                document_ids = set(self.documents) if filters else set()
+            results = []
+            for document_id in sorted(document_ids, key=lambda document_id: (self.documents[document_id][0], document_id)):
+                model_hash, summary = self.documents[document_id]
+                trigger_words = self.models[model_hash]["trigger_words"]
+                if all(matches_filter(summary, trigger_words, field, value) for field, value in filters):
+                    results.append(summary)
+                    if limit and len(results) >= limit:
+                        break
+            return results
+
+    def get_stats(self):
+        with self.lock:
+            return {"models": len(self.models), "presets": len(self.documents), "tokens": len(self.postings)}
+
+
+def main(argv):
+    if not argv:
+        print("usage: python -m model_preset_manager.preset_index QUERY [json|sqlite]")
+        return 1
+    from model_preset_manager import storage
+
+    index = PresetIndex(storage.create_backend(argv[1] if len(argv) > 1 else "json"))
+    start = time.perf_counter()
+    changed = index.refresh(force=True)
+    index.save()
+    refreshed = time.perf_counter()
+    results = index.search(argv[0], refresh=False)
+    searched = time.perf_counter()
+    for result in results:
+        print(f"{result['model_hash']}  {result['preset_name']}  {result['sampler']}  {result['size']}  {result['prompt']}")
+    print(f"{len(results)} results in {(searched - refreshed) * 1000:.2f} ms, {changed} models reindexed in {(refreshed - start) * 1000:.1f} ms, {index.get_stats()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
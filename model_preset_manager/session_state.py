@@ -0,0 +1,82 @@
+import threading
+
+from model_preset_manager.trigger_words import get_matcher
+
+
+class ModelData:
+    __slots__ = ("short_hash", "trigger_words", "matcher")
+
+    def __init__(self, short_hash, trigger_words):
+        self.short_hash = short_hash
+        self.trigger_words = tuple(trigger_words or ())
+        self.matcher = get_matcher(self.trigger_words)
+
+
+class ModelDataCache:
+    # Shared by every session, entries are immutable and only replaced when a model's trigger words change
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, short_hash, trigger_words):
+        trigger_words = tuple(trigger_words or ())
+        model_data = self.entries.get(short_hash)
+        if model_data is not None and model_data.trigger_words == trigger_words:
+            return model_data
+        with self.lock:
+            model_data = self.entries.get(short_hash)
+            if model_data is None or model_data.trigger_words != trigger_words:
+                model_data = ModelData(short_hash, trigger_words)
+                self.entries[short_hash] = model_data
+            return model_data
+
+    def invalidate(self, short_hash=None):
+        with self.lock:
+            if short_hash is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(short_hash, None)
+
+
+model_data_cache = ModelDataCache()
+
+
+class SessionState:
+    # Lives in a gr.State, so each browser session gets its own current model and trigger words
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.model_filename = None
+        self.model_data = None
+
+    def set_model(self, model_filename, short_hash, trigger_words):
+        model_data = model_data_cache.get(short_hash, trigger_words)
+        with self.lock:
+            self.model_filename = model_filename
+            self.model_data = model_data
+        return self
+
+    @property
+    def short_hash(self):
+        model_data = self.model_data
+        return model_data.short_hash if model_data else None
+
+    @property
+    def trigger_words(self):
+        model_data = self.model_data
+        return list(model_data.trigger_words) if model_data else []
+
+    @property
+    def matcher(self):
+        model_data = self.model_data
+        return model_data.matcher if model_data else get_matcher(())
+
+    def __deepcopy__(self, memo):
+        # gr.State deep copies its values, the lock can't be copied and doesn't need to be
+        copied = SessionState()
+        copied.model_filename = self.model_filename
+        copied.model_data = self.model_data
+        return copied
+
+
+def get_session_state(session_state):
+    return session_state if isinstance(session_state, SessionState) else SessionState()
@@ -0,0 +1,177 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+
+from model_preset_manager import paths
+from model_preset_manager.metrics import increment, span
+from model_preset_manager.storage import JsonFileBackend, VersionConflictError
+
+MODEL_INFO_KEYS = ["url", "default_preset", "trigger_words", "presets"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS models (
+    hash TEXT PRIMARY KEY,
+    url TEXT NOT NULL DEFAULT '',
+    default_preset TEXT NOT NULL DEFAULT 'default',
+    extra TEXT NOT NULL DEFAULT '{}',
+    revision INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS trigger_words (
+    hash TEXT NOT NULL REFERENCES models(hash) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    word TEXT NOT NULL,
+    PRIMARY KEY (hash, position)
+);
+CREATE TABLE IF NOT EXISTS presets (
+    hash TEXT NOT NULL REFERENCES models(hash) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    generation_data TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (hash, name)
+);
+CREATE INDEX IF NOT EXISTS trigger_words_word_index ON trigger_words(word);
+CREATE INDEX IF NOT EXISTS presets_name_index ON presets(name);
+"""
+
+
+class SqliteBackend:
+    name = "sqlite"
+
+    def __init__(self, database_path=None):
+        self.database_path = database_path or paths.MODEL_PRESETS_DATABASE_PATH
+        self.local = threading.local()
+        with self.connect() as connection:
+            connection.executescript(SCHEMA)
+
+    def connect(self):
+        # sqlite connections can't be shared between threads, so keep one per thread
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.database_path), exist_ok=True)
+            connection = sqlite3.connect(self.database_path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA foreign_keys=ON")
+            self.local.connection = connection
+        return connection
+
+    def get_path(self, model_hash):
+        return self.database_path
+
+    def get_version(self, model_hash):
+        row = self.connect().execute("SELECT revision FROM models WHERE hash = ?", (model_hash,)).fetchone()
+        return row[0] if row else None
+
+    def read(self, model_hash):
+        connection = self.connect()
+        with span("storage_read", backend=self.name):
+            row = connection.execute("SELECT url, default_preset, extra, revision FROM models WHERE hash = ?", (model_hash,)).fetchone()
+            if row is None:
+                return None
+            url, default_preset, extra, revision = row
+            trigger_words = [word for word, in connection.execute("SELECT word FROM trigger_words WHERE hash = ? ORDER BY position", (model_hash,))]
+            presets = dict(connection.execute("SELECT name, generation_data FROM presets WHERE hash = ? ORDER BY position", (model_hash,)))
+        model_info = {"url": url, "default_preset": default_preset, "trigger_words": trigger_words, "presets": presets}
+        model_info.update(json.loads(extra))
+        return model_info, revision
+
+    def write(self, model_hash, model_info, expected_version=None, on_conflict=None):
+        with span("storage_write", backend=self.name), self.connect() as connection:
+            # The revision check and the write happen in one write transaction, so no other writer can slip in between
+            connection.execute("BEGIN IMMEDIATE")
+            if expected_version is not None:
+                current_version = self.get_version(model_hash)
+                if current_version is not None and current_version != expected_version:
+                    increment("storage_conflicts", backend=self.name)
+                    if on_conflict is None:
+                        raise VersionConflictError(model_hash, expected_version, current_version)
+                    model_info = on_conflict(self.read(model_hash)[0])
+            extra = {key: value for key, value in model_info.items() if key not in MODEL_INFO_KEYS}
+            connection.execute(
+                "INSERT INTO models (hash, url, default_preset, extra, revision) VALUES (?, ?, ?, ?, 1) "
+                "ON CONFLICT(hash) DO UPDATE SET url = excluded.url, default_preset = excluded.default_preset, extra = excluded.extra, revision = models.revision + 1",
+                (model_hash, model_info.get("url", "") or "", model_info.get("default_preset", "default") or "default", json.dumps(extra)))
+            connection.execute("DELETE FROM trigger_words WHERE hash = ?", (model_hash,))
+            connection.executemany("INSERT INTO trigger_words (hash, position, word) VALUES (?, ?, ?)",
+                                   [(model_hash, position, word) for position, word in enumerate(model_info.get("trigger_words", []))])
+            connection.execute("DELETE FROM presets WHERE hash = ?", (model_hash,))
+            connection.executemany("INSERT INTO presets (hash, name, position, generation_data) VALUES (?, ?, ?, ?)",
+                                   [(model_hash, name, position, data or "") for position, (name, data) in enumerate(model_info.get("presets", {}).items())])
+            revision, = connection.execute("SELECT revision FROM models WHERE hash = ?", (model_hash,)).fetchone()
+        return revision
+
+    def delete(self, model_hash):
+        with self.connect() as connection:
+            connection.execute("DELETE FROM models WHERE hash = ?", (model_hash,))
+
+    def exists(self, model_hash):
+        return self.get_version(model_hash) is not None
+
+    def list_hashes(self):
+        return [model_hash for model_hash, in self.connect().execute("SELECT hash FROM models ORDER BY hash")]
+
+    def find_models_by_trigger_word(self, word):
+        return [model_hash for model_hash, in self.connect().execute("SELECT DISTINCT hash FROM trigger_words WHERE word = ?", (word,))]
+
+    def find_presets(self, name=None, generation_data_contains=None):
+        query = "SELECT hash, name, generation_data FROM presets WHERE 1 = 1"
+        parameters = []
+        if name is not None:
+            query += " AND name = ?"
+            parameters.append(name)
+        if generation_data_contains is not None:
+            query += " AND instr(generation_data, ?) > 0"
+            parameters.append(generation_data_contains)
+        return self.connect().execute(query + " ORDER BY hash, position", parameters).fetchall()
+
+    def find_models_by_sampler(self, sampler):
+        # Presets saved with parsed parameters are matched exactly, older ones fall back to a text search
+        parsed = self.connect().execute(
+            "SELECT DISTINCT models.hash FROM models, json_each(models.extra, '$.preset_parameters') AS preset "
+            "WHERE json_extract(preset.value, '$.sampler') = ?", (sampler,))
+        model_hashes = {model_hash for model_hash, in parsed}
+        model_hashes.update(model_hash for model_hash, _, _ in self.find_presets(generation_data_contains=f"Sampler: {sampler},"))
+        return sorted(model_hashes)
+
+
+def import_json_directory(backend, directory=paths.MODEL_PRESETS_DIRECTORY):
+    json_backend = JsonFileBackend(lambda model_hash: os.path.join(directory, f"{model_hash}.json"))
+    imported = 0
+    for model_hash in json_backend.list_hashes():
+        try:
+            model_info, _ = json_backend.read(model_hash)
+        except (json.JSONDecodeError, TypeError) as e:
+            print(f"skipping {model_hash}: {e}")
+            continue
+        backend.write(model_hash, model_info)
+        imported += 1
+    return imported
+
+
+def export_json_directory(backend, directory=paths.MODEL_PRESETS_DIRECTORY):
+    json_backend = JsonFileBackend(lambda model_hash: os.path.join(directory, f"{model_hash}.json"))
+    exported = 0
+    for model_hash in backend.list_hashes():
+        model_info, _ = backend.read(model_hash)
+        json_backend.write(model_hash, model_info)
+        exported += 1
+    return exported
+
+
+def main(argv):
+    if len(argv) < 1 or argv[0] not in ("import", "export"):
+        print("usage: python -m model_preset_manager.sqlite_storage import|export [DIRECTORY] [DATABASE]")
+        return 1
+    directory = argv[1] if len(argv) > 1 else paths.MODEL_PRESETS_DIRECTORY
+    backend = SqliteBackend(argv[2] if len(argv) > 2 else None)
+    if argv[0] == "import":
+        print(f"imported {import_json_directory(backend, directory)} model info files into {backend.database_path}")
+    else:
+        print(f"exported {export_json_directory(backend, directory)} model info files to {directory}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,227 @@
+import contextlib
+import json
+import os
+
+from model_preset_manager import paths
+from model_preset_manager.metrics import increment, span
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+STORAGE_BACKENDS = ["json", "sqlite"]
+LOCK_DIRECTORY_NAME = ".locks"
+BACKUP_DIRECTORY_NAME = ".backups"
+
+
+class VersionConflictError(RuntimeError):
+    def __init__(self, model_hash, expected_version, current_version):
+        super().__init__(f"model info for {model_hash} was changed by someone else (expected version {expected_version}, found {current_version})")
+        self.model_hash = model_hash
+        self.expected_version = expected_version
+        self.current_version = current_version
+
+
+def get_model_info_file_path(model_hash):
+    return os.path.join(paths.MODEL_PRESETS_DIRECTORY, f"{model_hash}.json")
+
+
+def get_sidecar_path(path, directory_name, suffix):
+    # Locks and backups live in hidden folders next to the model info so the presets folder stays readable
+    directory, filename = os.path.split(path)
+    return os.path.join(directory, directory_name, filename + suffix)
+
+
+def get_lock_path(path):
+    return get_sidecar_path(path, LOCK_DIRECTORY_NAME, ".lock")
+
+
+def get_backup_path(path):
+    return get_sidecar_path(path, BACKUP_DIRECTORY_NAME, ".bak")
+
+
+def get_file_version(stat):
+    # Every write renames a new file into place, so the inode changes even when two writes land on the same mtime tick
+    return f"{stat.st_mtime_ns}-{stat.st_ino}"
+
+
+@contextlib.contextmanager
+def file_lock(lock_path):
+    # Advisory and exclusive, it only keeps out other writers that take the same lock
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    with open(lock_path, "a+b") as file:
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        else:
+            file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after 10 seconds, keep waiting like flock does
+                    pass
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+            else:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def fsync_directory(directory):
+    # Makes the rename itself durable, Windows can't open directories and doesn't need this
+    try:
+        directory_descriptor = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(directory_descriptor)
+    except OSError:
+        pass
+    finally:
+        os.close(directory_descriptor)
+
+
+def get_temporary_path(path):
+    # Writers of a file hold its lock, so one temporary name is enough and whatever a killed writer left behind is reused
+    return f"{path}.tmp"
+
+
+def read_json_file(path):
+    with open(path, "rb") as file:
+        version = get_file_version(os.fstat(file.fileno()))
+        return json.loads(file.read()), version
+
+
+def backup_file(path, backup_path):
+    # Only a file that still parses replaces the backup, so a damaged file never overwrites the last good copy
+    try:
+        with open(path, "rb") as file:
+            data = file.read()
+        json.loads(data)
+    except FileNotFoundError:
+        return
+    except ValueError:
+        return
+    os.makedirs(os.path.dirname(backup_path), exist_ok=True)
+    temporary_path = get_temporary_path(backup_path)
+    with open(temporary_path, "wb") as file:
+        file.write(data)
+    os.replace(temporary_path, backup_path)
+
+
+def write_json_atomic(path, data, backup_path=None):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    temporary_path = get_temporary_path(path)
+    try:
+        with open(temporary_path, "w") as file:
+            json.dump(data, file, indent=4)
+            file.flush()
+            os.fsync(file.fileno())
+        if backup_path is not None:
+            backup_file(path, backup_path)
+        os.replace(temporary_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temporary_path)
+        raise
+    fsync_directory(directory)
+    return get_file_version(os.stat(path))
+
+
+class JsonFileBackend:
+    name = "json"
+
+    def __init__(self, get_file_path=get_model_info_file_path):
+        self.get_file_path = get_file_path
+
+    def get_path(self, model_hash):
+        return self.get_file_path(model_hash)
+
+    def get_version(self, model_hash):
+        try:
+            return get_file_version(os.stat(self.get_file_path(model_hash)))
+        except FileNotFoundError:
+            return None
+
+    def read(self, model_hash):
+        path = self.get_file_path(model_hash)
+        with span("storage_read", backend=self.name):
+            try:
+                return read_json_file(path)
+            except FileNotFoundError:
+                return None
+            except ValueError as e:
+                return self.recover(model_hash, e)
+
+    def recover(self, model_hash, error):
+        path = self.get_file_path(model_hash)
+        backup_path = get_backup_path(path)
+        with file_lock(get_lock_path(path)):
+            # Another process may have repaired or rewritten the file while we waited for the lock
+            try:
+                return read_json_file(path)
+            except FileNotFoundError:
+                return None
+            except ValueError:
+                pass
+
+            try:
+                model_info, _ = read_json_file(backup_path)
+            except (OSError, ValueError):
+                model_info = None
+            corrupt_path = get_sidecar_path(path, BACKUP_DIRECTORY_NAME, ".corrupt")
+            os.makedirs(os.path.dirname(corrupt_path), exist_ok=True)
+            os.replace(path, corrupt_path)
+            increment("storage_recoveries", result="backup" if model_info is not None else "lost")
+            if model_info is None:
+                print(f"model info for {model_hash} could not be read ({error}) and has no usable backup, moved it to {corrupt_path}")
+                return None
+            version = write_json_atomic(path, model_info)
+            print(f"model info for {model_hash} could not be read ({error}), restored it from {backup_path} and moved the damaged file to {corrupt_path}")
+            return model_info, version
+
+    def write(self, model_hash, model_info, expected_version=None, on_conflict=None):
+        # With an expected version the write only goes through if nobody saved the file since it was read.
+        # on_conflict gets the newer copy and returns what to write instead, still under the lock so nobody can slip in again
+        path = self.get_file_path(model_hash)
+        with span("storage_write", backend=self.name), file_lock(get_lock_path(path)):
+            if expected_version is not None:
+                current_version = self.get_version(model_hash)
+                if current_version is not None and current_version != expected_version:
+                    increment("storage_conflicts", backend=self.name)
+                    if on_conflict is None:
+                        raise VersionConflictError(model_hash, expected_version, current_version)
+                    try:
+                        current_model_info, _ = read_json_file(path)
+                        model_info = on_conflict(current_model_info)
+                    except FileNotFoundError:
+                        pass
+                    except ValueError:
+                        # A damaged newer copy has nothing worth keeping, the backup still holds the last good one
+                        pass
+            return write_json_atomic(path, model_info, get_backup_path(path))
+
+    def exists(self, model_hash):
+        return os.path.exists(self.get_file_path(model_hash))
+
+    def list_hashes(self):
+        directory = os.path.dirname(self.get_file_path(""))
+        try:
+            filenames = os.listdir(directory)
+        except FileNotFoundError:
+            return []
+        return sorted(filename[:-len(".json")] for filename in filenames if filename.endswith(".json"))
+
+
+def create_backend(name="json", get_file_path=get_model_info_file_path):
+    if name == "sqlite":
+        from model_preset_manager.sqlite_storage import SqliteBackend
+        return SqliteBackend()
+    return JsonFileBackend(get_file_path)
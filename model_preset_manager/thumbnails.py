@@ -0,0 +1,145 @@
+import hashlib
+import os
+import tempfile
+import threading
+
+from concurrent import futures
+from io import BytesIO
+
+from model_preset_manager import paths
+from model_preset_manager.metrics import span
+
+THUMBNAIL_SIZE = (300, 300)
+MAX_THUMBNAIL_WORKERS = 2
+COMPACT_THUMBNAIL_DIRECTORY_NAME = "thumbnails"
+COMPACT_THUMBNAIL_QUALITY = 85
+
+
+def get_thumbnail_path_for_checkpoint(checkpoint_path):
+    return os.path.splitext(checkpoint_path)[0] + ".png"
+
+
+def get_compact_thumbnail_path(thumbnail_path):
+    key = hashlib.sha256(os.path.abspath(thumbnail_path).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(paths.CACHE_DIRECTORY, COMPACT_THUMBNAIL_DIRECTORY_NAME, f"{key}.webp")
+
+
+def get_display_thumbnail_path(thumbnail_path):
+    compact_thumbnail_path = get_compact_thumbnail_path(thumbnail_path)
+    if os.path.exists(compact_thumbnail_path) and os.path.exists(thumbnail_path) and os.path.getmtime(compact_thumbnail_path) >= os.path.getmtime(thumbnail_path):
+        return compact_thumbnail_path
+    return thumbnail_path
+
+
+def open_image(source):
+    from PIL import Image
+
+    img = Image.open(source)
+    # JPEG can decode straight to a fraction of its size, other formats ignore this
+    img.draft("RGB", THUMBNAIL_SIZE)
+    return img
+
+
+def save_atomic(img, path, image_format, **kwargs):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temporary_path = f"{path}.{threading.get_ident()}.tmp"
+    with span("image_encode", format=image_format):
+        img.save(temporary_path, image_format, **kwargs)
+    os.replace(temporary_path, path)
+
+
+def decode_thumbnail(img):
+    # PIL decodes lazily, the pixels are only read when the image is resized
+    with span("image_decode", format=img.format or "array"):
+        img.thumbnail(THUMBNAIL_SIZE)
+
+
+def write_thumbnail(img, thumbnail_path):
+    decode_thumbnail(img)
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA" if "transparency" in img.info or "A" in img.getbands() else "RGB")
+
+    # The webui only picks up png previews next to the checkpoint, the tab can use a smaller copy
+    save_atomic(img, thumbnail_path, "PNG", optimize=True)
+    try:
+        save_atomic(img, get_compact_thumbnail_path(thumbnail_path), "WEBP", quality=COMPACT_THUMBNAIL_QUALITY, method=4)
+    except (OSError, KeyError) as e:
+        print(f"could not write compact thumbnail: {e}")
+
+
+def save_thumbnail_from_file(source_path, thumbnail_path):
+    with open_image(source_path) as img:
+        write_thumbnail(img, thumbnail_path)
+
+
+def save_thumbnail_from_bytes(image_bytes, thumbnail_path):
+    with open_image(BytesIO(image_bytes)) as img:
+        write_thumbnail(img, thumbnail_path)
+
+
+def save_thumbnail_from_array(image, thumbnail_path):
+    import numpy as np
+    from PIL import Image
+
+    # Gradio already hands over uint8 arrays, only convert when it didn't
+    array = np.asarray(image)
+    if array.dtype != np.uint8:
+        array = array.astype(np.uint8)
+    write_thumbnail(Image.fromarray(array), thumbnail_path)
+
+
+def ensure_compact_thumbnail(thumbnail_path):
+    if not os.path.exists(thumbnail_path) or get_display_thumbnail_path(thumbnail_path) != thumbnail_path:
+        return
+    with open_image(thumbnail_path) as img:
+        decode_thumbnail(img)
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA")
+        save_atomic(img, get_compact_thumbnail_path(thumbnail_path), "WEBP", quality=COMPACT_THUMBNAIL_QUALITY, method=4)
+
+
+def download_thumbnail(client, image_url, thumbnail_path):
+    file_descriptor, temporary_path = tempfile.mkstemp(suffix=".download")
+    os.close(file_descriptor)
+    try:
+        client.download_to_file(image_url, temporary_path)
+        save_thumbnail_from_file(temporary_path, thumbnail_path)
+    finally:
+        os.remove(temporary_path)
+    return thumbnail_path
+
+
+class ThumbnailService:
+    def __init__(self, max_workers=MAX_THUMBNAIL_WORKERS):
+        self.executor = futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="model_preset_manager_thumbnail")
+        self.pending = {}
+        self.lock = threading.RLock()
+
+    def submit(self, thumbnail_path, function, *args):
+        # A thumbnail that's already queued isn't queued twice
+        key = os.path.abspath(thumbnail_path)
+        with self.lock:
+            future = self.pending.get(key)
+            if future is None:
+                future = self.executor.submit(function, *args)
+                self.pending[key] = future
+                future.add_done_callback(lambda _: self.forget(key))
+        return future
+
+    def forget(self, key):
+        with self.lock:
+            self.pending.pop(key, None)
+
+    def download(self, client, image_url, thumbnail_path, overwrite=False):
+        if not overwrite and os.path.exists(thumbnail_path):
+            done = futures.Future()
+            done.set_result(thumbnail_path)
+            return done
+        return self.submit(thumbnail_path, download_thumbnail, client, image_url, thumbnail_path)
+
+    def save_array(self, image, thumbnail_path):
+        # Uploads always win over whatever is queued, so they skip the dedupe
+        return self.executor.submit(save_thumbnail_from_array, image, thumbnail_path)
+
+
+thumbnail_service = ThumbnailService()
@@ -0,0 +1,78 @@
+import functools
+import re
+
+# Trigger words like "(style:1.2)" start or end with punctuation, so \b can't be used as the boundary
+TOKEN_START = r'(?<!\w)'
+TOKEN_END = r'(?!\w)'
+# A removed trigger word takes one trailing separator with it
+TRAILING_SEPARATOR = r'(?:\s*,)?[ \t]?'
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_word_pattern(word, with_separator=False):
+    return re.compile(TOKEN_START + re.escape(word) + TOKEN_END + (TRAILING_SEPARATOR if with_separator else ''))
+
+
+def build_trie_pattern(words):
+    # One alternation per shared prefix, so the regex engine never retries every word at every position
+    trie = {}
+    for word in words:
+        node = trie
+        for character in word:
+            node = node.setdefault(character, {})
+        node[''] = {}
+    return trie_node_to_pattern(trie)
+
+
+def trie_node_to_pattern(node):
+    alternatives = [re.escape(character) + trie_node_to_pattern(child) for character, child in sorted(node.items()) if character]
+    if not alternatives:
+        return ''
+    pattern = alternatives[0] if len(alternatives) == 1 else '(?:' + '|'.join(alternatives) + ')'
+    if '' in node:
+        # Greedy, so longer trigger words are tried before the shorter ones they start with
+        pattern = '(?:' + pattern + ')?'
+    return pattern
+
+
+class TriggerWordMatcher:
+    def __init__(self, trigger_words):
+        self.trigger_words = list(dict.fromkeys(word for word in trigger_words if word))
+        self.pattern = re.compile(TOKEN_START + '(?:' + build_trie_pattern(self.trigger_words) + ')' + TOKEN_END) if self.trigger_words else None
+        # Shorter trigger words hidden inside a longer match still count as present
+        self.contained_words = {
+            word: [other for other in self.trigger_words if other != word and compile_word_pattern(other).search(word)]
+            for word in self.trigger_words
+        }
+
+    def find(self, prompt):
+        if self.pattern is None or not prompt:
+            return []
+        return [(match.group(), match.start(), match.end()) for match in self.pattern.finditer(prompt)]
+
+    def find_present(self, prompt):
+        present = set()
+        for word, _, _ in self.find(prompt):
+            present.add(word)
+            present.update(self.contained_words.get(word, ()))
+        return [word for word in self.trigger_words if word in present]
+
+    def contains(self, prompt, word):
+        return compile_word_pattern(word).search(prompt) is not None
+
+    def add(self, prompt, word):
+        if self.contains(prompt, word):
+            return prompt
+        return f"{word} {prompt}"
+
+    def remove(self, prompt, word):
+        return compile_word_pattern(word, True).sub('', prompt).strip()
+
+
+@functools.lru_cache(maxsize=32)
+def get_cached_matcher(trigger_words):
+    return TriggerWordMatcher(trigger_words)
+
+
+def get_matcher(trigger_words):
+    return get_cached_matcher(tuple(trigger_words or ()))
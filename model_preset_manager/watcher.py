@@ -0,0 +1,326 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+from model_preset_manager import hash_cache, thumbnails
+from model_preset_manager.library_sync import CHECKPOINT_EXTENSIONS
+from model_preset_manager.metrics import increment
+from model_preset_manager.session_state import model_data_cache
+
+DEBOUNCE_DELAY = 1.0
+MAX_DEBOUNCE_DELAY = 10.0
+POLL_INTERVAL = 5.0
+# With change events coming in, caches only fall back to checking files themselves once a minute
+WATCHED_REVALIDATE_INTERVAL = 60.0
+# A watched path list of None means events were lost and everything has to be checked again
+RESCAN = None
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0x00080000
+# Files are reported once they are closed or renamed into place, so a checkpoint that is still being copied isn't hashed halfway
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct("iIII")
+READ_BUFFER_SIZE = 64 * 1024
+
+
+class InotifySource:
+    name = "inotify"
+
+    def __init__(self, directories):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.add_watch_function = libc.inotify_add_watch
+        self.add_watch_function.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.file_descriptor = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.file_descriptor < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.directories = {}
+        self.recursive_directories = set()
+        try:
+            for directory, recursive in directories:
+                self.add_watch(directory, recursive)
+        except OSError:
+            self.close()
+            raise
+
+    def add_watch(self, directory, recursive):
+        watch_descriptor = self.add_watch_function(self.file_descriptor, os.fsencode(directory), WATCH_MASK)
+        if watch_descriptor < 0:
+            error = ctypes.get_errno()
+            # Out of watches means a huge tree, polling still works there
+            raise OSError(error, f"could not watch {directory}: {os.strerror(error)}")
+        self.directories[watch_descriptor] = directory
+        if recursive:
+            self.recursive_directories.add(directory)
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False) and not entry.name.startswith("."):
+                        self.add_watch(entry.path, True)
+
+    def wait(self, timeout):
+        readable, _, _ = select.select([self.file_descriptor], [], [], timeout)
+        if not readable:
+            return set()
+        paths = set()
+        while True:
+            try:
+                data = os.read(self.file_descriptor, READ_BUFFER_SIZE)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+            offset = 0
+            while offset < len(data):
+                watch_descriptor, mask, _, name_length = EVENT_HEADER.unpack_from(data, offset)
+                name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + name_length].rstrip(b"\0")
+                offset += EVENT_HEADER.size + name_length
+                if mask & IN_Q_OVERFLOW:
+                    return RESCAN
+                directory = self.directories.get(watch_descriptor)
+                if mask & IN_IGNORED:
+                    self.directories.pop(watch_descriptor, None)
+                    continue
+                if directory is None or not name:
+                    continue
+                path = os.path.join(directory, os.fsdecode(name))
+                if mask & IN_ISDIR:
+                    # New folders inside a recursive tree are watched too, whatever they already hold counts as changed
+                    if mask & (IN_CREATE | IN_MOVED_TO) and directory in self.recursive_directories and not os.path.basename(path).startswith("."):
+                        try:
+                            self.add_watch(path, True)
+                        except OSError as e:
+                            print(f"could not watch {path}: {e}")
+                        for root, _, filenames in os.walk(path):
+                            paths.update(os.path.join(root, filename) for filename in filenames)
+                    continue
+                # A new file is only reported once it is closed or moved in, not while it is still being written
+                if mask & IN_CREATE:
+                    continue
+                paths.add(path)
+        return paths
+
+    def close(self):
+        if self.file_descriptor >= 0:
+            os.close(self.file_descriptor)
+            self.file_descriptor = -1
+
+
+def scan_directory(directory, recursive, snapshot):
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return
+    for entry in entries:
+        if entry.name.startswith("."):
+            continue
+        try:
+            if entry.is_dir():
+                if recursive:
+                    scan_directory(entry.path, True, snapshot)
+                continue
+            stat = entry.stat()
+        except OSError:
+            continue
+        snapshot[entry.path] = (stat.st_size, stat.st_mtime_ns)
+
+
+class PollingSource:
+    name = "polling"
+
+    def __init__(self, directories, poll_interval=POLL_INTERVAL):
+        self.directories = list(directories)
+        self.poll_interval = poll_interval
+        self.reported = self.scan()
+        self.previous = self.reported
+
+    def scan(self):
+        snapshot = {}
+        for directory, recursive in self.directories:
+            scan_directory(directory, recursive, snapshot)
+        return snapshot
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, self.poll_interval) if timeout is not None else self.poll_interval)
+        current = self.scan()
+        paths = set()
+        # A file is only reported once it looked the same in two scans in a row, so copies in progress are skipped
+        for path in set(current) | set(self.reported):
+            signature = current.get(path)
+            if signature != self.reported.get(path) and signature == self.previous.get(path):
+                paths.add(path)
+                if signature is None:
+                    self.reported.pop(path, None)
+                else:
+                    self.reported[path] = signature
+        self.previous = current
+        return paths
+
+    def close(self):
+        pass
+
+
+def create_source(directories, poll_interval=POLL_INTERVAL, use_inotify=True):
+    if use_inotify and sys.platform.startswith("linux"):
+        try:
+            return InotifySource(directories)
+        except (OSError, AttributeError) as e:
+            print(f"falling back to polling for file changes: {e}")
+    return PollingSource(directories, poll_interval)
+
+
+class DirectoryWatcher:
+    def __init__(self, directories, callback, debounce_delay=DEBOUNCE_DELAY, max_debounce_delay=MAX_DEBOUNCE_DELAY, poll_interval=POLL_INTERVAL, use_inotify=True):
+        # directories is a list of (directory, recursive), folders that don't exist are skipped
+        self.directories = [(directory, recursive) for directory, recursive in directories if os.path.isdir(directory)]
+        self.callback = callback
+        self.debounce_delay = debounce_delay
+        self.max_debounce_delay = max_debounce_delay
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+        self.source = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    @property
+    def backend(self):
+        return self.source.name if self.source else None
+
+    def start(self):
+        self.source = create_source(self.directories, self.poll_interval, self.use_inotify)
+        self.thread = threading.Thread(target=self.run, name="model_preset_manager_watcher", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def run(self):
+        pending = set()
+        first_event_at = None
+        last_event_at = None
+        try:
+            while not self.stopped.is_set():
+                paths = self.source.wait(self.debounce_delay if first_event_at is not None else self.poll_interval)
+                now = time.monotonic()
+                if paths is RESCAN:
+                    pending = RESCAN
+                    first_event_at = first_event_at or now
+                    last_event_at = now
+                elif paths:
+                    if pending is not RESCAN:
+                        pending |= paths
+                    first_event_at = first_event_at or now
+                    last_event_at = now
+                # Changes are handed over once things went quiet, or after a while during a long stream of them
+                if first_event_at is not None and (now - last_event_at >= self.debounce_delay or now - first_event_at >= self.max_debounce_delay):
+                    changes, pending = pending, set()
+                    first_event_at = last_event_at = None
+                    try:
+                        self.callback(changes)
+                    except Exception as e:
+                        print(f"could not handle file changes: {e}")
+        finally:
+            self.source.close()
+
+
+def get_checkpoints_for_thumbnail(path):
+    base_path = os.path.splitext(path)[0]
+    return [base_path + extension for extension in CHECKPOINT_EXTENSIONS if os.path.exists(base_path + extension)]
+
+
+def is_checkpoint_thumbnail(path):
+    return bool(get_checkpoints_for_thumbnail(path))
+
+
+class LibraryChangeHandler:
+    def __init__(self, model_info_store, presets_directory, checkpoint_directories, get_preset_index=None, library_manifest=None):
+        self.model_info_store = model_info_store
+        self.presets_directory = os.path.abspath(presets_directory)
+        self.checkpoint_directories = [os.path.abspath(directory) for directory in checkpoint_directories]
+        self.get_preset_index = get_preset_index
+        self.library_manifest = library_manifest
+        self.last_summary = None
+
+    def is_in_checkpoint_directory(self, path):
+        return any(path.startswith(directory + os.sep) for directory in self.checkpoint_directories)
+
+    def __call__(self, paths):
+        if paths is RESCAN:
+            return self.rescan()
+
+        model_hashes = set()
+        checkpoint_paths = set()
+        thumbnail_paths = set()
+        for path in map(os.path.abspath, paths):
+            if os.path.dirname(path) == self.presets_directory and path.endswith(".json"):
+                model_hashes.add(os.path.basename(path)[:-len(".json")])
+            elif self.is_in_checkpoint_directory(path):
+                if path.lower().endswith(CHECKPOINT_EXTENSIONS):
+                    checkpoint_paths.add(path)
+                elif path.lower().endswith(".png"):
+                    thumbnail_paths.add(path)
+
+        # Model info edited by hand: drop the cached copies and reindex just those models
+        for model_hash in model_hashes:
+            self.model_info_store.revalidate(model_hash)
+            model_data_cache.invalidate(model_hash)
+        reindexed = 0
+        if model_hashes and self.get_preset_index is not None:
+            reindexed = self.get_preset_index().refresh_models(model_hashes)
+
+        # New or replaced checkpoints are hashed in the background, the hash cache skips files that didn't change
+        hashing = [path for path in checkpoint_paths if os.path.isfile(path) and hash_cache.hash_cache.lookup(path) is None]
+        for path in hashing:
+            job = hash_cache.hash_cache.submit(path)
+            if self.library_manifest is not None:
+                job.future.add_done_callback(lambda _, path=path: self.library_manifest.update_checkpoints([path]))
+        for path in thumbnail_paths:
+            if os.path.isfile(path) and is_checkpoint_thumbnail(path):
+                thumbnails.thumbnail_service.submit(thumbnails.get_compact_thumbnail_path(path), thumbnails.ensure_compact_thumbnail, path)
+
+        # The manifest only looks at the checkpoints that changed, a thumbnail counts as a change to its checkpoint
+        if self.library_manifest is not None:
+            self.library_manifest.update_checkpoints(checkpoint_paths.union(*map(get_checkpoints_for_thumbnail, thumbnail_paths)))
+            for model_hash in model_hashes:
+                self.library_manifest.set_model_info_exists(model_hash, self.model_info_store.exists(model_hash))
+
+        increment("watcher_changes", len(model_hashes), kind="model_info")
+        increment("watcher_changes", len(checkpoint_paths), kind="checkpoint")
+        increment("watcher_changes", len(thumbnail_paths), kind="thumbnail")
+        self.last_summary = f"{len(model_hashes)} model info files changed ({reindexed} reindexed), {len(hashing)} checkpoints queued for hashing, {len(thumbnail_paths)} thumbnails changed"
+        return self.last_summary
+
+    def rescan(self):
+        self.model_info_store.invalidate()
+        model_data_cache.invalidate()
+        if self.get_preset_index is not None:
+            self.get_preset_index().refresh(force=True)
+        if self.library_manifest is not None:
+            self.library_manifest.scan()
+        self.last_summary = "too many changes at once, rescanned everything"
+        return self.last_summary
+
+
+def get_watched_directories(presets_directory, checkpoint_directories):
+    # Checkpoints can be sorted into sub folders, model info files can't
+    directories = {os.path.realpath(presets_directory): (presets_directory, False)}
+    for directory in checkpoint_directories:
+        directories.setdefault(os.path.realpath(directory), (directory, True))
+    return list(directories.values())
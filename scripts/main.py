@@ -1,148 +1,46 @@
-import base64
+# The webui tab: everything here turns Gradio events into calls on the model_preset_manager package
 import gradio as gr
-import hashlib
 import json
-import numpy as np
 import os
-import re
-import requests  # Replace urllib.request with requests
 import subprocess
 import time
 
-from io import BytesIO
+from model_preset_manager import batch_runner, bundles, civitai, hashing, library, library_manifest, library_sync, metrics, model_info_merge, paths, prefetch, preset_index, storage, thumbnails, watcher
+from model_preset_manager.civitai import get_model_url_trigger_words_and_first_image_url_from_hash, get_model_presets_from_civitai_model_url
+from model_preset_manager.generation_parameters import strip_preset_parameters
+from model_preset_manager.library import get_short_hash_from_filename, remove_hash_and_whitespace
+from model_preset_manager.model_info import get_default_preset, strip_remote_base
+from model_preset_manager.session_state import get_session_state
 from modules import generation_parameters_copypaste as parameters_copypaste
 from modules import script_callbacks
 from modules import shared
-from PIL import Image
-from pathlib import Path
-from typing import Any
-
-CIVITAI_MODEL_INFO_BY_HASH_URL = 'https://civitai.com/api/v1/model-versions/by-hash/'
-CIVITAI_MODEL_PAGE_BY_ID_URL = 'https://civitai.com/models/'
-CIVITAI_MODEL_DESCRIPTION_TAG = 'mantine-TypographyStylesProvider-root mantine-dfvxn9'
-CIVITAI_MODEL_DESCRIPTION_PRESET_PREFIX = '###ModelPresets###'
-
-def get_model_info_file_path(model_hash):
-    current_directory = os.path.dirname(__file__)
-    return os.path.join(current_directory, "model presets",f"{model_hash}.json")
-
-def empty_model_info():
-    return  {
-                "url": "",
-                "default_preset" : "default",
-                "trigger_words": [],
-                "presets": {"default": ""}
-            }
 
-def initialize_model_info_file(model_hash):
-    model_info_file_path = get_model_info_file_path(model_hash)
-    
-    os.makedirs(os.path.dirname(model_info_file_path), exist_ok=True)
-    
-    if not os.path.exists(model_info_file_path):
-        with open(model_info_file_path, "w") as file:
-            empty_model_info_file = empty_model_info()
+def get_storage_backend_name():
+    return shared.opts.data.get("model_preset_manager_storage_backend", "json")
 
-            json.dump(empty_model_info_file, file, indent=4)
-    return model_info_file_path
+# Parsed model info is cached in memory and written back in batches
+model_info_store = library.create_model_info_store(get_storage_backend_name())
 
-def get_model_hash_and_info_from_model_filename(model_filename, initializeIfMissing = True):    
-    short_hash = get_short_hash_from_filename(model_filename)
-    if initializeIfMissing:
-        model_info_file_path = initialize_model_info_file(short_hash)
-    else:
-        model_info_file_path = get_model_info_file_path(short_hash)
-    
-    try:
-        with open(model_info_file_path, "r") as file:
-            return short_hash, json.load(file)
-    except FileNotFoundError:
-        return short_hash, empty_model_info()
+def initialize_model_info_file(model_hash):
+    model_info_store.get(model_hash)
+    model_info_store.flush()
+    return model_info_store.backend.get_path(model_hash)
+
+def get_model_hash_and_info_from_model_filename(model_filename, initializeIfMissing = True, progress = None):    
+    short_hash = get_short_hash_from_filename(model_filename, progress)
+    return short_hash, model_info_store.get(short_hash, initializeIfMissing)
         
+def get_current_model_hash():
+    return get_short_hash_from_filename(current_model_filename())
+
 def get_model_hash_and_info_from_current_model(initializeIfMissing = True):
     return get_model_hash_and_info_from_model_filename(current_model_filename(), initializeIfMissing)
 
 def get_model_info_from_model_hash(model_hash):     
-    model_info_file_path = initialize_model_info_file(model_hash)
-    with open(model_info_file_path, "r") as file:
-        return json.load(file)
+    return model_info_store.get(model_hash)
 
 def save_model_info(short_hash, model_info):
-    model_info_file_path = initialize_model_info_file(short_hash)
-    with open(model_info_file_path, "w") as file:
-        json.dump(model_info, file, indent=4)
-
-def get_model_url_trigger_words_and_first_image_url_from_hash(short_hash):
-    response = requests.get(f"{CIVITAI_MODEL_INFO_BY_HASH_URL}{short_hash}")
-    data = response.json()
-
-    # The get() method returns None if the key does not exist.
-    trigger_words = data.get("trainedWords", [])
-    images = data.get("images", [{}])
-    model_url = f'{CIVITAI_MODEL_PAGE_BY_ID_URL}{data.get("modelId", "")}'
-
-    first_image_url = images[0].get("url", None)
-
-    return model_url, trigger_words, first_image_url
-
-def get_short_hash_from_filename(filename):
-    match = re.search(r'\[(.*?)\]', filename)
-    if match:
-        return match.group(1)
-    filename = remove_hash_and_whitespace(filename)
-    os.path.join("models", "Stable-diffusion", filename)
-    sha256 = hashlib.sha256()
-    with open(filename, 'rb') as f:
-        for chunk in iter(lambda: f.read(4096), b''):
-            sha256.update(chunk)
-    return sha256.hexdigest()[:10]
-
-def remove_hash_and_whitespace(s, remove_extension = False):
-    # Remove any whitespace and hash surrounded by square brackets
-    cleaned_string = re.sub(r'\s*\[.*?\]', '', s)
-    
-    # If remove_extension is set to True, remove the file extension as well
-    if remove_extension:
-        cleaned_string = re.sub(r'\.[^.]*$', '', cleaned_string)
-    
-    return cleaned_string
-
-def get_model_presets_from_civitai_model_url(model_url):   
-    headers = {'User-Agent': 'Mozilla/5.0'}
-    model_page_html = requests.get(model_url, headers=headers).text
-
-    data_start_index = model_page_html.find(CIVITAI_MODEL_DESCRIPTION_TAG)
-    if data_start_index == -1:
-        return None
-
-    model_page_html = model_page_html[data_start_index + len(CIVITAI_MODEL_DESCRIPTION_TAG):]
-    
-    preset_start_index = model_page_html.find(CIVITAI_MODEL_DESCRIPTION_PRESET_PREFIX)
-    if preset_start_index == -1:
-        return None
-    else:
-        preset_start_index += len(CIVITAI_MODEL_DESCRIPTION_PRESET_PREFIX)
-    
-    opened_braces = 0
-    json_start_index = -1
-    for i in range(preset_start_index, len(model_page_html)):
-        if model_page_html[i] == '{':
-            if opened_braces == 0:
-                json_start_index = i
-            opened_braces += 1
-        elif model_page_html[i] == '}':
-            opened_braces -= 1
-            if opened_braces == 0:
-                try:
-                    possible_json_str = model_page_html[json_start_index:i + 1]
-                    json_obj = json.loads(possible_json_str)
-                    return json_obj
-                except json.JSONDecodeError:
-                    pass
-    return None
-
-
-
+    model_info_store.put(short_hash, model_info)
 
 def get_thumbnail_path(modelName):
     return os.path.join("models", "Stable-diffusion", modelName + ".png")
@@ -151,15 +49,7 @@ def download_thumbnail(image_url, modelName):
     thumbnail_path = get_thumbnail_path(modelName)
     if os.path.exists(thumbnail_path):
         return
-    response = requests.get(image_url)
-    response.raise_for_status()
-
-    # Open the image using PIL and create a thumbnail with max size 300x300
-    img = Image.open(BytesIO(response.content))
-    img.thumbnail((300, 300))
-    
-    # Save the thumbnail
-    img.save(thumbnail_path)
+    thumbnails.thumbnail_service.download(civitai.civitai_client, image_url, thumbnail_path).result()
     
 def save_thumbnail_from_np_array(current_model, image):
     if image is None:
@@ -168,13 +58,9 @@ def save_thumbnail_from_np_array(current_model, image):
         
     current_model = remove_hash_and_whitespace(current_model, True)
     
-    # Open the image and create a thumbnail with max size 300x300
-    image = Image.fromarray(np.uint8(image))
-    image.thumbnail((300, 300))
-    
-    # Save the thumbnail
+    # Thumbnailing and saving happen on the thumbnail executor, not the request thread
     thumbnail_path = get_thumbnail_path(current_model)
-    image.save(thumbnail_path)
+    thumbnails.thumbnail_service.save_array(image, thumbnail_path)
     
 def get_model_thumbnail(image_url, short_hash, local, modelName):
     thumbnail_path = get_thumbnail_path(modelName)
@@ -184,48 +70,16 @@ def get_model_thumbnail(image_url, short_hash, local, modelName):
             download_thumbnail(image_url, modelName)
 
     if os.path.exists(thumbnail_path):
-        return thumbnail_path
+        return thumbnails.get_display_thumbnail_path(thumbnail_path)
     else:
         print("no local model thumbnail found")
+        metrics.increment("thumbnail_missing")
         return None
 
-def update_default_preset(model_info):
-    default_preset_name = model_info.get("default_preset", "default") or "default"
-    presets = model_info.get("presets", {})
-
-    if default_preset_name not in presets:
-        if presets:
-            first_preset_name = next(iter(presets.keys()))
-            model_info["default_preset"] = first_preset_name
-        else:
-            model_info["default_preset"] = "default"
-            model_info["presets"]["default"] = ""
-
-    return model_info
-
-def get_default_preset(model_info):
-    default_preset_name = model_info.get("default_preset", "default")
-    
-    if default_preset_name == "" or default_preset_name is None:
-        default_preset_name = "default"
-
-    presets = model_info.get("presets", {})
-
-    if default_preset_name in presets:
-        return default_preset_name, presets[default_preset_name]
-    elif len(presets) > 0:
-        first_preset_name, first_preset_value = next(iter(presets.items()))
-        return first_preset_name, first_preset_value
-    else:
-        return "default", ""
-
-def validate_model_info(model_info):
-    required_keys = ["url", "default_preset", "trigger_words", "presets"]
-    return model_info and all(key in model_info for key in required_keys)
-
-def download_model_info():
+def download_model_info(session_state = None, progress = gr.Progress()):
+    session_state = get_session_state(session_state)
     model_filename = current_model_filename()
-    short_hash, model_info = get_model_hash_and_info_from_model_filename(model_filename)
+    short_hash, model_info = get_model_hash_and_info_from_model_filename(model_filename, progress = progress)
     model_url, trigger_words, first_image_url = get_model_url_trigger_words_and_first_image_url_from_hash(short_hash)
     full_presets_file =  get_model_presets_from_civitai_model_url(model_url)
     
@@ -233,25 +87,85 @@ def download_model_info():
     if first_image_url:
         model_thumbnail = get_model_thumbnail(first_image_url, short_hash, False, remove_hash_and_whitespace(model_filename, True))
     
-    model_info = get_model_info_from_model_hash(short_hash)   
-    
-    global triggerWordChoices
-    triggerWordChoices = trigger_words
-    if validate_model_info(full_presets_file):
-        model_info = full_presets_file
-        triggerWordChoices = trigger_words = model_info.get("trigger_words", [])
+    # Presets and trigger words from Civitai are merged into the local ones, local edits win where both changed
+    merge_result = model_info_merge.merge_downloaded_model_info(get_model_info_from_model_hash(short_hash), model_url, trigger_words, full_presets_file)
+    model_info = merge_result.model_info
+    model_url = model_info.get("url", model_url)
+    trigger_words = model_info.get("trigger_words", [])
+    if merge_result.changed:
         save_model_info(short_hash, model_info)
-    else:            
-        set_trigger_words(model_filename)
-        set_model_url(model_filename, model_url) 
+    print(f"model info for {short_hash}: {merge_result.get_summary_text()}")
+    session_state.set_model(model_filename, short_hash, trigger_words)
            
     preset_name, current_generation_data = get_default_preset(model_info)        
     presets = model_info.get("presets",{})
         
-    return model_filename, model_url, model_thumbnail, model_generation_data_update_return(current_generation_data, preset_name), gr.CheckboxGroup.update(choices = trigger_words), gr.Dropdown.update(choices = list(presets.keys()), value = preset_name), preset_name, short_hash
-
-def model_generation_data_update_return(current_generation_data, preset_name):
-    model_hash, model_info = get_model_hash_and_info_from_current_model()
+    return model_filename, model_url, model_thumbnail, model_generation_data_update_return(current_generation_data, preset_name, model_info), gr.CheckboxGroup.update(choices = trigger_words), gr.Dropdown.update(choices = list(presets.keys()), value = preset_name), preset_name, short_hash, session_state
+
+# Checkpoints, their hashes and thumbnails, rescanned at startup and kept current by the watcher
+model_library = None
+
+def get_model_library():
+    global model_library
+    if model_library is None:
+        model_library = library_manifest.LibraryManifest(get_model_hashes = model_info_store.list_hashes)
+    return model_library
+
+library_sync_job = None
+
+def sync_model_library():
+    global library_sync_job
+    if library_sync_job is None or not library_sync_job.running:
+        client = civitai.CivitaiClient(requests_per_second = shared.opts.data.get("model_preset_manager_civitai_requests_per_second", civitai.DEFAULT_REQUESTS_PER_SECOND))
+        max_workers = int(shared.opts.data.get("model_preset_manager_sync_workers", library_sync.DEFAULT_MAX_WORKERS))
+        get_model_library().scan()
+        library_sync_job = library_sync.LibrarySyncJob(get_model_library().list_checkpoints(), model_info_store, client, max_workers).start()
+
+    # Stream the job status to the output box until every model is done
+    while library_sync_job.running:
+        yield library_sync_job.get_status_text()
+        time.sleep(1)
+    yield library_sync_job.get_status_text()
+
+def cancel_model_library_sync():
+    if library_sync_job is None or not library_sync_job.running:
+        return "no library sync running"
+    library_sync_job.cancel()
+    return "library sync cancelled"
+
+preset_batch_job = None
+
+def get_checkpoint_titles():
+    try:
+        from modules import sd_models
+        return sd_models.checkpoint_tiles()
+    except Exception:
+        return []
+
+def run_preset_batch(checkpoints, preset_names):
+    global preset_batch_job
+    if preset_batch_job is None or not preset_batch_job.running:
+        checkpoints = checkpoints or [current_model_filename()]
+        preset_names = [name.strip() for name in (preset_names or "").split(",") if name.strip()] or None
+        selections = [(checkpoint, get_short_hash_from_filename(checkpoint), preset_names) for checkpoint in checkpoints]
+        jobs = batch_runner.build_jobs(model_info_store, selections)
+        # Jobs are grouped by checkpoint so every model is loaded once, the checkpoint in use is put back at the end
+        preset_batch_job = batch_runner.BatchRunner(jobs, batch_runner.webui_process, batch_runner.webui_load_checkpoint, current_model_filename(), restore_checkpoint = True).start()
+    while preset_batch_job.running:
+        yield preset_batch_job.get_status_text()
+        time.sleep(1)
+    yield preset_batch_job.get_status_text()
+
+def cancel_preset_batch():
+    if preset_batch_job is None or not preset_batch_job.running:
+        return "no preset batch running"
+    preset_batch_job.cancel()
+    batch_runner.webui_interrupt()
+    return "preset batch cancelled"
+
+def model_generation_data_update_return(current_generation_data, preset_name, model_info = None):
+    if model_info is None:
+        model_hash, model_info = get_model_hash_and_info_from_current_model()
     default_preset_name, preset_original_data = get_default_preset(model_info)
     default = default_preset_name == preset_name
     return gr.Textbox.update(label = model_generation_data_label_text(default), value = current_generation_data)
@@ -259,39 +173,79 @@ def model_generation_data_update_return(current_generation_data, preset_name):
 def current_model_filename():
     return shared.opts.data.get('sd_model_checkpoint', 'Not found')
 
-def retrieve_model_info_from_disk(current_generation_data):
-    model_filename = current_model_filename()
+def prefetch_model_info(model_filename):
+    # Runs on the prefetch thread, hashing and Civitai requests happen here instead of on a button click
+    short_hash = get_short_hash_from_filename(model_filename)
+    model_info = model_info_store.get(short_hash)
+    model_path = hashing.resolve_checkpoint_path(remove_hash_and_whitespace(model_filename))
+    if not model_info.get('url') and shared.opts.data.get("model_preset_manager_prefetch_download", True):
+        checkpoint = library_sync.Checkpoint(model_filename, model_path, short_hash)
+        library_sync.LibrarySyncJob([], model_info_store, civitai.civitai_client).sync_checkpoint(checkpoint)
+    thumbnails.ensure_compact_thumbnail(get_thumbnail_path(remove_hash_and_whitespace(model_filename, True)))
+    return short_hash
+
+model_prefetcher = prefetch.Prefetcher(prefetch_model_info)
+recent_checkpoints = prefetch.RecentCheckpoints()
+
+def on_model_loaded(sd_model):
+    checkpoint_info = getattr(sd_model, "sd_checkpoint_info", None)
+    model_filename = getattr(checkpoint_info, "title", None) or current_model_filename()
+    recent_checkpoints.touch(model_filename)
+    if shared.opts.data.get("model_preset_manager_prefetch", True):
+        model_prefetcher.prefetch(model_filename)
+
+library_watcher = None
+
+def start_library_watcher():
+    global library_watcher
+    if library_watcher is not None or not shared.opts.data.get("model_preset_manager_watch", True):
+        return
+    checkpoint_directories = hashing.get_model_directories()
+    handler = watcher.LibraryChangeHandler(model_info_store, paths.MODEL_PRESETS_DIRECTORY, checkpoint_directories, get_preset_search_index, get_model_library())
+    library_watcher = watcher.DirectoryWatcher(watcher.get_watched_directories(paths.MODEL_PRESETS_DIRECTORY, checkpoint_directories), handler).start()
+    if library_watcher.backend == "inotify" and model_info_store.backend.name == "json":
+        # Hand edits are pushed to us now, so cached model info and the search index stop checking files on every use.
+        # Writes to the sqlite database don't show up as file events, so that backend keeps checking
+        model_info_store.revalidate_interval = watcher.WATCHED_REVALIDATE_INTERVAL
+        get_preset_search_index().refresh_interval = watcher.WATCHED_REVALIDATE_INTERVAL
+
+def on_app_started(demo, app):
+    # Prometheus can scrape this, ?format=json returns the same numbers as json
+    app.add_api_route("/model_preset_manager/metrics", get_metrics, methods=["GET"])
+    start_library_watcher()
+    model_prefetcher.executor.submit(get_model_library().scan)
+    if not shared.opts.data.get("model_preset_manager_prefetch", True):
+        return
+    recent_count = int(shared.opts.data.get("model_preset_manager_prefetch_recent", prefetch.DEFAULT_RECENT_PREFETCH_COUNT))
+    model_prefetcher.prefetch_all([current_model_filename()] + recent_checkpoints.get(recent_count))
+    model_prefetcher.executor.submit(refresh_preset_search_index)
 
-    short_hash, model_info = get_model_hash_and_info_from_model_filename(model_filename, False)
+def load_prefetched_model_info(session_state = None):
+    # Fills the tab on page load only when the prefetch is done, so opening the tab never waits on it
+    model_filename = current_model_filename()
+    short_hash = model_prefetcher.get_ready(model_filename)
+    if short_hash and model_info_store.get(short_hash, False).get('url'):
+        return retrieve_model_info_from_disk(session_state)
+    return [gr.update()] * 8 + [get_session_state(session_state)]
 
-    if model_info:
-        model_url = model_info['url']
+def retrieve_model_info_from_disk(session_state = None, progress = gr.Progress()):
+    session_state = get_session_state(session_state)
+    model_filename = current_model_filename()
+    model_prefetcher.wait(model_filename)
 
-        if model_url:
-            model_thumbnail = get_model_thumbnail("", short_hash, True, remove_hash_and_whitespace(model_filename, True))
-            
-            preset_name, current_generation_data = get_default_preset(model_info)
-            presets = model_info.setdefault('presets', {"default": ""})
-            trigger_words = model_info.setdefault('trigger_words', [])
-                
-            global triggerWordChoices
-            triggerWordChoices = trigger_words
-            return model_filename, model_url, model_thumbnail, model_generation_data_update_return(current_generation_data, preset_name), gr.CheckboxGroup.update(choices = trigger_words), gr.Dropdown.update(choices = list(presets.keys()), value = preset_name), preset_name, short_hash
-        else:
-            presets = model_info.setdefault('presets', {"default": ""})
-            return download_model_info()
+    short_hash, model_info, preset_name, current_generation_data = library.load_model_info(model_info_store, model_filename, progress)
+    if model_info is None:
+        return download_model_info(session_state, progress)
 
-    else:
-        # Handle the case when the model is not found in the data structure
-        presets = model_info.setdefault('presets', {"default": ""})
-        return download_model_info()
+    model_url = model_info['url']
+    model_thumbnail = get_model_thumbnail("", short_hash, True, remove_hash_and_whitespace(model_filename, True))
+    presets = model_info['presets']
+    trigger_words = model_info['trigger_words']
+    session_state.set_model(model_filename, short_hash, trigger_words)
+    return model_filename, model_url, model_thumbnail, model_generation_data_update_return(current_generation_data, preset_name, model_info), gr.CheckboxGroup.update(choices = trigger_words), gr.Dropdown.update(choices = list(presets.keys()), value = preset_name), preset_name, short_hash, session_state
 
 def set_model_info(model_filename, label, info):
-    short_hash, model_info = get_model_hash_and_info_from_model_filename(model_filename)    
-    
-    model_info[label] = info
-    
-    save_model_info(short_hash, model_info)
+    library.set_model_info(model_info_store, get_short_hash_from_filename(model_filename), label, info)
     return f"{label} updated."
 
 def set_model_url(current_model, model_url):
@@ -301,26 +255,23 @@ def show_model_url(model_url):
     iframe_html = f'<iframe src="{model_url}" width="100%" height="1080" frameborder="0"></iframe>'
     return iframe_html
 
-def set_trigger_words(current_model):
-    global triggerWordChoices
-    return set_model_info(current_model, 'trigger_words', triggerWordChoices)
+def set_trigger_words(current_model, trigger_words):
+    return set_model_info(current_model, 'trigger_words', trigger_words)
 
 def bind_buttons(buttons, source_text_component):
     for tabname, button in buttons.items():
         parameters_copypaste.register_paste_params_button(parameters_copypaste.ParamBinding(paste_button=button, tabname=tabname, source_text_component=source_text_component, source_image_component=None, source_tabname=None))
 
-def getCheckedBoxesFromPrompt(prompt):
-    global triggerWordChoices
-    checked_boxes = [choice for choice in triggerWordChoices if choice in prompt]
+def getCheckedBoxesFromPrompt(prompt, session_state = None):
+    # The matcher is compiled once per model and shared by every session using it
+    checked_boxes = get_session_state(session_state).matcher.find_present(prompt)
     return checked_boxes
 
-def adjustPromptToCheckBox(checkBoxChange: gr.SelectData, prompt):
-    new_prompt = prompt    
-    if checkBoxChange.selected and checkBoxChange.value not in new_prompt:
-        new_prompt = f"{checkBoxChange.value} {new_prompt}"
-    elif not checkBoxChange.selected and checkBoxChange.value in new_prompt:
-        new_prompt = re.sub(f"{checkBoxChange.value} ?", "", new_prompt).strip()
-    return new_prompt
+def adjustPromptToCheckBox(checkBoxChange: gr.SelectData, prompt, session_state = None):
+    matcher = get_session_state(session_state).matcher
+    if checkBoxChange.selected:
+        return matcher.add(prompt, checkBoxChange.value)
+    return matcher.remove(prompt, checkBoxChange.value)
 
 def compare_lists(list_a, list_b):
     # Remove duplicates from list_a
@@ -344,61 +295,75 @@ def compare_lists(list_a, list_b):
 def model_generation_data_label_text(default=False):
     return f"Model Generation Data{' (default preset)' if default else ''}"
   
-def handle_text_change(prompt):
-    checked_boxes = getCheckedBoxesFromPrompt(prompt)
+def handle_text_change(prompt, session_state = None):
+    checked_boxes = getCheckedBoxesFromPrompt(prompt, session_state)
     return checked_boxes
 
-def handle_checkbox_change(checkBoxChange: gr.SelectData, prompt):
-    new_prompt = adjustPromptToCheckBox(checkBoxChange, prompt)
+def handle_checkbox_change(checkBoxChange: gr.SelectData, prompt, session_state = None):
+    new_prompt = adjustPromptToCheckBox(checkBoxChange, prompt, session_state)
     return new_prompt
 
 def save_preset(preset_name_textbox_value, model_generation_data):
-    short_hash, model_info = get_model_hash_and_info_from_current_model()
-    model_info['presets'][preset_name_textbox_value] = model_generation_data
-    save_model_info(short_hash, model_info)
-    return gr.Dropdown.update(choices = list(model_info['presets'].keys()), value = preset_name_textbox_value),  f"{preset_name_textbox_value} saved", model_generation_data_update_return(model_generation_data, preset_name_textbox_value)
+    model_info = library.save_preset(model_info_store, get_current_model_hash(), preset_name_textbox_value, model_generation_data)
+    return gr.Dropdown.update(choices = list(model_info['presets'].keys()), value = preset_name_textbox_value),  f"{preset_name_textbox_value} saved", model_generation_data_update_return(model_generation_data, preset_name_textbox_value, model_info)
 
 def rename_preset(preset_dropdown_value, preset_name_textbox_value, model_generation_data):
-    short_hash, model_info = get_model_hash_and_info_from_current_model()
-    new_current_preset_name = preset_name_textbox_value
-
-    # Check if the preset name is already the same
-    if preset_dropdown_value == preset_name_textbox_value:
-        message = f"Preset already named {preset_name_textbox_value}"        
-    # Check if the new preset name already exists
-    elif preset_name_textbox_value in model_info['presets'].keys():
-        message = f"Preset name {preset_name_textbox_value} already exists"
-        new_current_preset_name = preset_dropdown_value
-    else:
-        # Rename the preset by creating a new key with the same value and removing the old one
-        model_info['presets'][preset_name_textbox_value] = model_info['presets'][preset_dropdown_value]
-        del model_info['presets'][preset_dropdown_value]
-        if model_info['default_preset'] == preset_dropdown_value:
-            model_info['default_preset'] = preset_name_textbox_value
-        message = f"Preset {preset_dropdown_value} renamed to {preset_name_textbox_value}"
-
-    save_model_info(short_hash, model_info)
-    return gr.Dropdown.update(choices = list(model_info['presets'].keys()), value = new_current_preset_name), message, model_generation_data_update_return(model_generation_data, preset_dropdown_value)
+    model_info, new_current_preset_name, message = library.rename_preset(model_info_store, get_current_model_hash(), preset_dropdown_value, preset_name_textbox_value)
+    return gr.Dropdown.update(choices = list(model_info['presets'].keys()), value = new_current_preset_name), message, model_generation_data_update_return(model_generation_data, preset_dropdown_value, model_info)
 
 def delete_preset(preset_dropdown_value, model_generation_data):   
-    short_hash, model_info = get_model_hash_and_info_from_current_model()
-    del model_info['presets'][preset_dropdown_value]
-    model_info = update_default_preset(model_info)
-    save_model_info(short_hash, model_info)
+    model_info = library.delete_preset(model_info_store, get_current_model_hash(), preset_dropdown_value)
     new_current_preset_name, model_generation_data = get_default_preset(model_info)
-    formatted_dict = json.dumps(model_info, indent=4)
-    return gr.Dropdown.update(choices = list(model_info['presets'].keys()), value = new_current_preset_name), new_current_preset_name, f"Preset {preset_dropdown_value} deleted", model_generation_data_update_return(model_generation_data, new_current_preset_name)
+    return gr.Dropdown.update(choices = list(model_info['presets'].keys()), value = new_current_preset_name), new_current_preset_name, f"Preset {preset_dropdown_value} deleted", model_generation_data_update_return(model_generation_data, new_current_preset_name, model_info)
 
 def update_current_preset(preset_dropdown_value):
-    model_hash, model_info = get_model_hash_and_info_from_current_model()
-    new_model_generation_data = model_info['presets'].get(preset_dropdown_value,"")
-    return preset_dropdown_value, model_generation_data_update_return(new_model_generation_data, preset_dropdown_value)
+    model_info, new_model_generation_data = library.get_preset(model_info_store, current_model_filename(), preset_dropdown_value)
+    return preset_dropdown_value, model_generation_data_update_return(new_model_generation_data, preset_dropdown_value, model_info)
 
 def set_default_preset(preset_dropdown_value, model_generation_data):
-    short_hash, model_info = get_model_hash_and_info_from_current_model()
-    model_info['default_preset'] = preset_dropdown_value
-    save_model_info(short_hash, model_info)
-    return f"{preset_dropdown_value} set to default", model_generation_data_update_return(model_generation_data, preset_dropdown_value)
+    model_info = library.set_default_preset(model_info_store, get_current_model_hash(), preset_dropdown_value)
+    return f"{preset_dropdown_value} set to default", model_generation_data_update_return(model_generation_data, preset_dropdown_value, model_info)
+
+preset_search_index = None
+
+def get_preset_search_index():
+    global preset_search_index
+    if preset_search_index is None:
+        preset_search_index = preset_index.PresetIndex(model_info_store.backend)
+        model_info_store.write_callbacks.append(preset_search_index.mark_stale)
+    return preset_search_index
+
+def refresh_preset_search_index():
+    model_info_store.flush()
+    return get_preset_search_index().refresh(force = True)
+
+def search_presets(query):
+    if not query or not query.strip():
+        return gr.Dataframe.update(value = [], label = "Search Results")
+    start = time.perf_counter()
+    # Saved but not yet written presets would be missed by the index otherwise
+    model_info_store.flush()
+    results = get_preset_search_index().search(query)
+    elapsed = (time.perf_counter() - start) * 1000
+    rows = [[result["model_hash"], result["preset_name"], result["sampler"], result["steps"], result["cfg_scale"], result["size"], result["prompt"]] for result in results]
+    return gr.Dataframe.update(value = rows, label = f"Search Results ({len(rows)} presets in {elapsed:.1f} ms)")
+
+def export_preset_bundle(current_model_only):
+    # Unsaved edits are written first so the bundle matches what the tab shows
+    model_info_store.flush()
+    model_hashes = [get_current_model_hash()] if current_model_only else None
+    bundle_path = paths.get_cache_file_path(f"model presets {time.strftime('%Y%m%d-%H%M%S')}.jsonl.gz")
+    exported = bundles.export_bundle(model_info_store.backend, bundle_path, model_hashes)
+    return bundle_path, f"exported {exported} models to {bundle_path}"
+
+def import_preset_bundle(bundle_file, policy):
+    if bundle_file is None:
+        return "no bundle file selected"
+    try:
+        counts, errors = bundles.import_bundle(model_info_store, bundle_file.name, policy)
+    except (ValueError, RuntimeError, OSError) as e:
+        return f"could not import bundle: {e}"
+    return bundles.format_import_report(counts, errors)
 
 def reveal_presets_file_in_explorer(model_hash):
     if not model_hash:
@@ -412,7 +377,8 @@ def reveal_presets_file_in_explorer(model_hash):
     
 def get_civitai_preset_sharing_text():
     short_hash, model_info = get_model_hash_and_info_from_current_model()
-    return f"###ModelPresets###\n{json.dumps(model_info)}"
+    # Parsed parameters are rebuilt from the presets on import, so they're left out of the shared text
+    return f"###ModelPresets###\n{json.dumps(strip_remote_base(strip_preset_parameters(model_info)))}"
 
 def get_template_generation_data(includeExamplePrompt):
     prompt = "{Your Prompt Here}\n" if includeExamplePrompt else ""
@@ -423,9 +389,40 @@ Steps: 20, Sampler: Euler a, CFG scale: 7, Size: 512x512, Clip skip: 1
 def append_template_generation_info(generation_data):
     return generation_data + get_template_generation_data(generation_data == "")
 
-triggerWordChoices = None
+def show_metrics():
+    text = metrics.metrics.get_summary_text()
+    last_profile = metrics.metrics.get_last_profile()
+    if last_profile:
+        profile_path, profile_text = last_profile
+        text += f"\n\nLast profile (saved to {profile_path}):\n{profile_text}"
+    return text
+
+def profile_next_action():
+    metrics.metrics.request_profile()
+    return "The next action in this tab will be profiled, press Show Metrics afterwards to see where its time went"
+
+def reset_metrics():
+    metrics.metrics.reset()
+    return "Metrics reset"
+
+def get_metrics(format: str = "prometheus"):
+    from fastapi.responses import JSONResponse, PlainTextResponse
+    if format == "json":
+        return JSONResponse(metrics.metrics.to_dict())
+    return PlainTextResponse(metrics.metrics.to_prometheus(), media_type=metrics.PROMETHEUS_CONTENT_TYPE)
+
+def apply_metrics_log_setting():
+    if shared.opts.data.get("model_preset_manager_metrics_log", False):
+        metrics.metrics.enable_log()
+    else:
+        metrics.metrics.disable_log()
+
+apply_metrics_log_setting()
+
 def on_ui_tabs():
     with gr.Blocks() as custom_tab_interface:
+        # Per-session model and trigger words, concurrent sessions no longer share them
+        session_state = gr.State(None)
         current_model_textbox = gr.Textbox(interactive=False, label="Current Model:", visible=False) 
         with gr.Row():
             with gr.Column(scale = 1):
@@ -448,10 +445,13 @@ def on_ui_tabs():
                                     show_presets_in_explorer_button = gr.Button("Reveal Presets File")
                                 with gr.Row():
                                     retrieve_button = gr.Button("Retrieve Local Model Info", elem_id = "retrieve_model_info_button")
-                                    download_button = gr.Button("Download and Overwrite Model Info")
+                                    download_button = gr.Button("Download and Merge Model Info")
                                 with gr.Row():
                                     open_model_page_button = gr.Button("Open Model Page")
                                     set_model_url_button = gr.Button("Set Model URL") 
+                                with gr.Row():
+                                    sync_library_button = gr.Button("Sync Entire Model Library with Civitai")
+                                    cancel_sync_library_button = gr.Button("Stop Library Sync")
 
                                                   
                 with gr.Row():
@@ -488,6 +488,46 @@ def on_ui_tabs():
                                     with gr.Row():
                                         gr.Markdown('<div style="height: 10px;"></div>')
                          
+                with gr.Row():
+                    with gr.Column():
+                        gr.Markdown('<center><h3>Batch Generation</h2></center>')
+                        with gr.Box():
+                            batch_checkpoints_dropdown = gr.Dropdown(choices=get_checkpoint_titles(), multiselect=True, label="Checkpoints (leave empty for the current one)")
+                            batch_preset_names_textbox = gr.Textbox(label="Preset names, comma separated (leave empty for every preset)")
+                            with gr.Row():
+                                run_batch_button = gr.Button("Generate Presets")
+                                cancel_batch_button = gr.Button("Stop Preset Generation")
+
+                with gr.Row():
+                    with gr.Column():
+                        gr.Markdown('<center><h3>Preset Bundles</h2></center>')
+                        with gr.Box():
+                            with gr.Row():
+                                with gr.Column():
+                                    export_current_model_only_checkbox = gr.Checkbox(label="Only export the current model", value=False)
+                                    export_bundle_button = gr.Button("Export Preset Bundle")
+                                    export_bundle_file = gr.File(label="Exported Bundle", interactive=False)
+                                with gr.Column():
+                                    import_bundle_file = gr.File(label="Bundle to Import", file_types=[".gz", ".zst", ".jsonl"])
+                                    import_policy_radio = gr.Radio(choices=bundles.CONFLICT_POLICIES, value=bundles.DEFAULT_CONFLICT_POLICY, label="When a preset name is already used")
+                                    import_bundle_button = gr.Button("Import Preset Bundle")
+
+                with gr.Row():
+                    with gr.Column():
+                        gr.Markdown('<center><h3>Search Presets</h2></center>')
+                        with gr.Box():
+                            preset_search_textbox = gr.Textbox(label="Search every model's presets", placeholder='dpm++ 2m karras 1024x1024, or sampler:"Euler a" steps:30 cfg:7 size:512x768 trigger:word model:hash')
+                            preset_search_results = gr.Dataframe(headers=["Model Hash", "Preset", "Sampler", "Steps", "CFG Scale", "Size", "Prompt"], label="Search Results", interactive=False, wrap=True)
+
+                with gr.Row():
+                    with gr.Column():
+                        gr.Markdown('<center><h3>Diagnostics</h2></center>')
+                        with gr.Box():
+                            with gr.Row():
+                                show_metrics_button = gr.Button("Show Metrics")
+                                profile_next_action_button = gr.Button("Profile Next Action")
+                                reset_metrics_button = gr.Button("Reset Metrics")
+
                 with gr.Row():
                     with gr.Column(scale = 4):
                         output_textbox = gr.Textbox(interactive=False, label="Output").style(show_copy_button=True)
@@ -502,36 +542,64 @@ def on_ui_tabs():
         
 
         # Update the preset name textbox when a preset is selected in the dropdown
-        preset_dropdown.change(fn=update_current_preset, inputs=[preset_dropdown], outputs=[preset_name_textbox, model_generation_data], show_progress=False)
+        preset_dropdown.change(fn=metrics.instrument_handler(update_current_preset), inputs=[preset_dropdown], outputs=[preset_name_textbox, model_generation_data], show_progress=False)
                         
         model_url_output = gr.HTML(label="model page", height=800)  
    
-        image_input.change(fn=save_thumbnail_from_np_array, inputs=[current_model_textbox, image_input])
-        triggerWords.select(fn=handle_checkbox_change, inputs =[model_generation_data], outputs=[model_generation_data], show_progress=False)
+        image_input.change(fn=metrics.instrument_handler(save_thumbnail_from_np_array), inputs=[current_model_textbox, image_input])
+        triggerWords.select(fn=metrics.instrument_handler(handle_checkbox_change), inputs =[model_generation_data, session_state], outputs=[model_generation_data], show_progress=False)
         triggerWords.loading_html = ""            
                    
-        open_model_page_button.click(fn=show_model_url, inputs=[model_url_textbox], outputs=[model_url_output])  
-        set_model_url_button.click(fn=set_model_url, inputs=[current_model_textbox, model_url_textbox], outputs=[output_textbox]) 
-        append_template_button.click(fn=append_template_generation_info, inputs=[model_generation_data], outputs=[model_generation_data]) 
+        open_model_page_button.click(fn=metrics.instrument_handler(show_model_url), inputs=[model_url_textbox], outputs=[model_url_output])  
+        set_model_url_button.click(fn=metrics.instrument_handler(set_model_url), inputs=[current_model_textbox, model_url_textbox], outputs=[output_textbox]) 
+        append_template_button.click(fn=metrics.instrument_handler(append_template_generation_info), inputs=[model_generation_data], outputs=[model_generation_data]) 
         
-        download_button.click(fn=download_model_info, inputs=[], outputs=[current_model_textbox, model_url_textbox, image_input, model_generation_data, triggerWords, preset_dropdown, preset_name_textbox, model_hash_textbox])
-        retrieve_button.click(fn=retrieve_model_info_from_disk, inputs=[], outputs=[current_model_textbox, model_url_textbox, image_input, model_generation_data, triggerWords, preset_dropdown, preset_name_textbox, model_hash_textbox])
-        show_presets_in_explorer_button.click(fn = reveal_presets_file_in_explorer, inputs = [model_hash_textbox], outputs = [output_textbox])
+        download_button.click(fn=metrics.instrument_handler(download_model_info), inputs=[session_state], outputs=[current_model_textbox, model_url_textbox, image_input, model_generation_data, triggerWords, preset_dropdown, preset_name_textbox, model_hash_textbox, session_state])
+        retrieve_button.click(fn=metrics.instrument_handler(retrieve_model_info_from_disk), inputs=[session_state], outputs=[current_model_textbox, model_url_textbox, image_input, model_generation_data, triggerWords, preset_dropdown, preset_name_textbox, model_hash_textbox, session_state])
+        sync_library_button.click(fn=metrics.instrument_handler(sync_model_library), inputs=[], outputs=[output_textbox])
+        cancel_sync_library_button.click(fn=metrics.instrument_handler(cancel_model_library_sync), inputs=[], outputs=[output_textbox])
+        export_bundle_button.click(fn=metrics.instrument_handler(export_preset_bundle), inputs=[export_current_model_only_checkbox], outputs=[export_bundle_file, output_textbox])
+        import_bundle_button.click(fn=metrics.instrument_handler(import_preset_bundle), inputs=[import_bundle_file, import_policy_radio], outputs=[output_textbox])
+        run_batch_button.click(fn=metrics.instrument_handler(run_preset_batch), inputs=[batch_checkpoints_dropdown, batch_preset_names_textbox], outputs=[output_textbox])
+        cancel_batch_button.click(fn=metrics.instrument_handler(cancel_preset_batch), inputs=[], outputs=[output_textbox])
+        show_presets_in_explorer_button.click(fn=metrics.instrument_handler(reveal_presets_file_in_explorer), inputs = [model_hash_textbox], outputs = [output_textbox])
                 
-        set_preset_button.click(fn=set_default_preset, inputs=[preset_dropdown, model_generation_data], outputs=[output_textbox, model_generation_data ])                
-        save_preset_button.click(fn=save_preset, inputs=[preset_name_textbox, model_generation_data], outputs=[preset_dropdown, output_textbox, model_generation_data])            
-        rename_preset_button.click(fn=rename_preset, inputs=[preset_dropdown, preset_name_textbox, model_generation_data], outputs=[preset_dropdown, output_textbox, model_generation_data])
-        delete_preset_button.click(fn=delete_preset, inputs=[preset_dropdown, model_generation_data], outputs=[preset_dropdown, preset_name_textbox, output_textbox, model_generation_data])         
+        set_preset_button.click(fn=metrics.instrument_handler(set_default_preset), inputs=[preset_dropdown, model_generation_data], outputs=[output_textbox, model_generation_data ])                
+        save_preset_button.click(fn=metrics.instrument_handler(save_preset), inputs=[preset_name_textbox, model_generation_data], outputs=[preset_dropdown, output_textbox, model_generation_data])            
+        rename_preset_button.click(fn=metrics.instrument_handler(rename_preset), inputs=[preset_dropdown, preset_name_textbox, model_generation_data], outputs=[preset_dropdown, output_textbox, model_generation_data])
+        delete_preset_button.click(fn=metrics.instrument_handler(delete_preset), inputs=[preset_dropdown, model_generation_data], outputs=[preset_dropdown, preset_name_textbox, output_textbox, model_generation_data])         
+        
+        get_civitai_preset_text.click(fn=metrics.instrument_handler(get_civitai_preset_sharing_text), inputs=[], outputs=[output_textbox])         
         
-        get_civitai_preset_text.click(fn=get_civitai_preset_sharing_text, inputs=[], outputs=[output_textbox])         
+        show_metrics_button.click(fn=metrics.instrument_handler(show_metrics), inputs=[], outputs=[output_textbox])
+        profile_next_action_button.click(fn=metrics.instrument_handler(profile_next_action), inputs=[], outputs=[output_textbox])
+        reset_metrics_button.click(fn=metrics.instrument_handler(reset_metrics), inputs=[], outputs=[output_textbox])
+
+        preset_search_textbox.change(fn=metrics.instrument_handler(search_presets), inputs=[preset_search_textbox], outputs=[preset_search_results], show_progress=False)
         
-        model_generation_data.change(fn = handle_text_change, inputs = [model_generation_data], outputs = [triggerWords], show_progress=False)
+        model_generation_data.change(fn=metrics.instrument_handler(handle_text_change), inputs = [model_generation_data, session_state], outputs = [triggerWords], show_progress=False)
         
         bind_buttons(buttons, model_generation_data)       
         
+        custom_tab_interface.load(fn=metrics.instrument_handler(load_prefetched_model_info), inputs=[session_state], outputs=[current_model_textbox, model_url_textbox, image_input, model_generation_data, triggerWords, preset_dropdown, preset_name_textbox, model_hash_textbox, session_state])
+        
 
     return [(custom_tab_interface, "Model Preset Manager", "model preset manager")]
 
 
+def on_ui_settings():
+    section = ("model_preset_manager", "Model Preset Manager")
+    shared.opts.add_option("model_preset_manager_storage_backend", shared.OptionInfo("json", "Model info storage (sqlite keeps every model in one indexed database, requires restart)", gr.Radio, {"choices": storage.STORAGE_BACKENDS}, section=section))
+    shared.opts.add_option("model_preset_manager_civitai_requests_per_second", shared.OptionInfo(civitai.DEFAULT_REQUESTS_PER_SECOND, "Maximum Civitai requests per second during library sync", gr.Slider, {"minimum": 0.5, "maximum": 10, "step": 0.5}, section=section))
+    shared.opts.add_option("model_preset_manager_sync_workers", shared.OptionInfo(library_sync.DEFAULT_MAX_WORKERS, "Models synced in parallel during library sync", gr.Slider, {"minimum": 1, "maximum": 16, "step": 1}, section=section))
+    shared.opts.add_option("model_preset_manager_prefetch", shared.OptionInfo(True, "Load model info in the background when the checkpoint changes and at startup", section=section))
+    shared.opts.add_option("model_preset_manager_prefetch_download", shared.OptionInfo(True, "Download missing model info from Civitai while prefetching", section=section))
+    shared.opts.add_option("model_preset_manager_prefetch_recent", shared.OptionInfo(prefetch.DEFAULT_RECENT_PREFETCH_COUNT, "Recently used checkpoints to prefetch at startup", gr.Slider, {"minimum": 0, "maximum": prefetch.MAX_RECENT_CHECKPOINTS, "step": 1}, section=section))
+    shared.opts.add_option("model_preset_manager_watch", shared.OptionInfo(True, "Watch the model presets and checkpoint folders for files added or edited outside the webui (requires restart)", section=section))
+    shared.opts.add_option("model_preset_manager_metrics_log", shared.OptionInfo(False, "Append every timed handler, file, hash, network and image call to cache/metrics.jsonl", onchange=apply_metrics_log_setting, section=section))
+
 script_callbacks.on_ui_tabs(on_ui_tabs)
+script_callbacks.on_ui_settings(on_ui_settings)
+script_callbacks.on_model_loaded(on_model_loaded)
+script_callbacks.on_app_started(on_app_started)
 